@@ -37,9 +37,13 @@ INSTALLED_APPS = [
     'main_app',
     'crispy_forms',
     'specs',
+    'reports',
 ]
 
 MIDDLEWARE = [
+    # первым, чтобы учитывать запросы к базе всех остальных middleware (сессия, пользователь)
+    'main_app.middleware.QueryStatsMiddleware',
+    'main_app.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +67,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main_app.context_processors.navigation',
             ],
             # 'libraries': {
             #     'specifications': 'main_app.template_tags.specifications',
@@ -88,6 +93,38 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения каталога (main_app/routers.py). Локально реплика - та же база под вторым алиасом,
+# в продакшене здесь HOST реплики. В тестах реплика смотрит в тестовую основную базу (MIRROR).
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['main_app.routers.ReplicaRouter']
+REPLICA_DATABASES = ['replica']
+# реплика, отставшая больше чем на столько секунд, не используется
+REPLICA_MAX_LAG = 2
+# как часто каждый процесс проверяет отставание реплик
+REPLICA_CHECK_INTERVAL = 5
+# сколько секунд после записи пользователь читает только основную базу; не меньше REPLICA_MAX_LAG
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Кэш страниц каталога и его версия должны быть общими для всех процессов,
+# поэтому в продакшене здесь нужен memcached/redis вместо локальной памяти.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'e_commerce',
+    }
+}
+
+# через сколько дней без изменений открытая корзина считается брошенной (python manage.py compact_carts)
+ABANDONED_CART_DAYS = 30
+
+# как часто каждый процесс сливает статистику запросов по view в кэш (python manage.py view_stats)
+QUERY_STATS_FLUSH_INTERVAL = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
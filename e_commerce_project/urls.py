@@ -21,7 +21,8 @@ from django.conf import settings
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('main_app.urls')),
-    path('product-specs/', include('specs.urls'))
+    path('product-specs/', include('specs.urls')),
+    path('reports/', include('reports.urls')),
 ]
 
 if settings.DEBUG:
@@ -1,9 +1,164 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db.models import Q
+from django.utils import timezone
+
 from .models import *
+from .utils import MAX_PRICE_PERCENT, MIN_PRICE_PERCENT, change_products_price, move_products
+
+
+# Поиск в админке: "=поле" - это iexact, "^поле" - istartswith, то есть UPPER(поле) = / LIKE UPPER('...%').
+# Обычный btree-индекс такие условия не обслуживает, на PostgreSQL для них есть индексы
+# по UPPER(поле) text_pattern_ops (миграция 0023). Небольшие справочники читаются целиком.
+
+
+class IdSearchMixin:
+    """
+    Поиск по номеру: если введено число, строка ищется по id_search_fields точным сравнением.
+    В search_fields "=id" превратился бы в UPPER(id::text) и не попал бы в первичный ключ
+    """
+    id_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if term.isdigit() and int(term) < 2 ** 31:
+            condition = Q()
+            for field in self.id_search_fields:
+                condition |= Q(**{field: int(term)})
+            results |= queryset.filter(condition)
+        return results, may_have_duplicates
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('title', 'slug', 'products_count')
+    search_fields = ('title', '=slug')
+    prepopulated_fields = {'slug': ('title',)}
+
+
+class ProductActionForm(ActionForm):
+    """Параметры массовых действий над товарами, выводятся рядом с выбором действия"""
+    percent = forms.DecimalField(
+        label='Изменить цену на, %', required=False, min_value=MIN_PRICE_PERCENT, max_value=MAX_PRICE_PERCENT,
+        decimal_places=2
+    )
+    category = forms.ModelChoiceField(label='Категория', queryset=Category.objects.all(), required=False)
+
+
+class ProductAdmin(admin.ModelAdmin):
+    """
+    Список товаров без N+1: категория подтягивается join'ом, поиск - по slug без учета регистра и по началу названия
+    (индексы по UPPER, см. выше), общее количество строк без фильтра не считается. Массовые изменения цен и категорий - один UPDATE
+    """
+    list_display = ('title', 'slug', 'category', 'price')
+    list_select_related = ('category',)
+    list_filter = ('category',)
+    search_fields = ('=slug', '^title')
+    autocomplete_fields = ('category',)
+    show_full_result_count = False
+    action_form = ProductActionForm
+    actions = ('change_price', 'move_to_category')
+
+    def get_action_value(self, request, field):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        return form.cleaned_data[field] if form.is_valid() else None
+
+    @admin.action(description='Изменить цену выбранных товаров на указанный процент')
+    def change_price(self, request, queryset):
+        percent = self.get_action_value(request, 'percent')
+        if percent is None:
+            self.message_user(
+                request, f'Укажите процент изменения цены от {MIN_PRICE_PERCENT} до {MAX_PRICE_PERCENT}', messages.ERROR
+            )
+            return
+        try:
+            count, repriced = change_products_price(queryset, percent)
+        except ValueError as error:
+            self.message_user(request, str(error), messages.ERROR)
+            return
+        if repriced is None:
+            self.message_user(request, f'Цены изменены у {count} товаров, открытые корзины пересчитываются в фоне')
+        else:
+            self.message_user(request, f'Цены изменены у {count} товаров, пересчитано корзин: {repriced}')
+
+    @admin.action(description='Перенести выбранные товары в указанную категорию')
+    def move_to_category(self, request, queryset):
+        category = self.get_action_value(request, 'category')
+        if category is None:
+            self.message_user(request, 'Выберите категорию', messages.ERROR)
+            return
+        count = move_products(queryset, category)
+        self.message_user(request, f'В категорию "{category}" перенесено {count} товаров')
+
+
+class CartProductAdmin(IdSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'cart', 'product', 'quantity', 'total_price')
+    list_select_related = ('cart', 'product')
+    raw_id_fields = ('customer', 'cart', 'product')
+    search_fields = ('=product__slug',)
+    id_search_fields = ('cart_id',)
+    show_full_result_count = False
+
+
+class CartAdmin(IdSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'owner', 'total_products', 'total_price', 'in_order')
+    list_select_related = ('owner__user',)
+    list_filter = ('in_order',)
+    raw_id_fields = ('owner',)
+    search_fields = ('=owner__user__username',)
+    id_search_fields = ('id',)
+    show_full_result_count = False
+
+
+class CustomerAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'user', 'phone_number', 'orders_count', 'orders_total', 'last_order_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username', '=user__email', '=phone_number')
+    readonly_fields = ('orders_count', 'orders_total', 'last_order_at')
+    show_full_result_count = False
+
+
+class OrderLineInline(admin.TabularInline):
+    """Строки заказа - снимок на момент оформления, только для чтения"""
+    model = OrderLine
+    fields = readonly_fields = ('title', 'price', 'quantity', 'total_price')
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+def make_status_action(status, label):
+
+    @admin.action(description=f'Перевести в статус "{label}"')
+    def set_status(modeladmin, request, queryset):
+        count = queryset.update(status=status, updated_at=timezone.now())
+        modeladmin.message_user(request, f'Статус "{label}" выставлен {count} заказам')
+
+    set_status.__name__ = f'set_status_{status}'
+    return set_status
+
+
+class OrderAdmin(IdSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'customer', 'first_name', 'last_name', 'status', 'buying_type', 'total_price', 'created_at')
+    list_select_related = ('customer__user',)
+    list_filter = ('status', 'buying_type')
+    raw_id_fields = ('customer', 'cart')
+    search_fields = ('=phone_number', '^last_name')
+    id_search_fields = ('id',)
+    readonly_fields = ('total_products', 'total_price')
+    inlines = (OrderLineInline,)
+    show_full_result_count = False
+    actions = [make_status_action(status, label) for status, label in Order.STATUS_CHOICES]
+
 
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(CartProduct)
-admin.site.register(Cart)
-admin.site.register(Customer)
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(Product, ProductAdmin)
+admin.site.register(CartProduct, CartProductAdmin)
+admin.site.register(Cart, CartAdmin)
+admin.site.register(Customer, CustomerAdmin)
+admin.site.register(Order, OrderAdmin)
@@ -0,0 +1,211 @@
+"""
+JSON API корзины. Асинхронные view работают под ASGI (e_commerce_project/asgi.py)
+и возвращают обновленную строку и итоги корзины одним ответом, без редиректа на /cart/.
+В Django 3.2 ORM синхронный, поэтому вся работа с сессией и базой выполняется
+одним вызовом sync_to_async на запрос.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from .cart import SessionCart
+from .mixins import change_customer_cart, get_cart
+from .models import Order, Product
+from .utils import CART_ADD, CART_OPERATIONS, CART_REMOVE, CART_SET, MAX_CART_QUANTITY, CartLimitError
+
+
+def serialize_line(item):
+    return {
+        'product': item.product.slug,
+        'title': item.product.title,
+        'price': item.product.price,
+        'quantity': item.quantity,
+        'total_price': item.total_price,
+    }
+
+
+def serialize_cart(cart, lines=None):
+    data = {'total_products': cart.total_products, 'total_price': cart.total_price}
+    if lines is not None:
+        data['lines'] = [serialize_line(item) for item in lines]
+    return data
+
+
+def read_cart(request):
+    cart = get_cart(request)
+    return {'cart': serialize_cart(cart, cart.items)}
+
+
+MAX_CART_OPERATIONS = 100
+
+
+def apply_operations(request, cart, operations):
+    """
+    Применяет операции [(операция, товар, количество), ...] к корзине покупателя или к анонимной корзине в сессии.
+    Возвращает (корзина, {id товара: строка корзины или None}): корзина покупателя, ушедшая в заказ
+    после начала запроса, заменяется открытой
+    """
+    if not isinstance(cart, SessionCart):
+        return change_customer_cart(request, cart, operations)
+    for operation, product, quantity in operations:
+        if operation == CART_ADD:
+            cart.add(product, quantity)
+        elif operation == CART_SET:
+            cart.set_quantity(product, quantity)
+        else:
+            cart.remove(product)
+    items = {item.product.id: item for item in cart.items}
+    return cart, {product.id: items.get(product.id) for _, product, _ in operations}
+
+
+def change_cart(request, operations):
+    """
+    Выполняет список изменений [(операция, slug товара, количество), ...] и возвращает измененные строки и итоги.
+    Все товары достаются одним запросом, изменения корзины покупателя выполняются одной транзакцией.
+    """
+    cart = get_cart(request)
+    slugs = {slug for _, slug, _ in operations}
+    products = Product.objects.in_bulk(slugs, field_name='slug')
+    if slugs - set(products):
+        raise Product.DoesNotExist
+    cart, lines = apply_operations(
+        request, cart, [(operation, products[slug], quantity) for operation, slug, quantity in operations]
+    )
+    slugs = {product.id: product.slug for product in products.values()}
+    return {
+        'lines': [
+            serialize_line(line) if line else {'product': slugs[product_id], 'quantity': 0}
+            for product_id, line in lines.items()
+        ],
+        'cart': serialize_cart(cart),
+    }
+
+
+def reorder(request, order_id):
+    """Добавляет в корзину все товары заказа покупателя одной пачкой"""
+    order = Order.objects.filter(pk=order_id, customer__user=request.user).first()
+    if order is None:
+        raise Order.DoesNotExist
+    # товары, удаленные из каталога после оформления заказа, пропускаются
+    operations = [
+        (CART_ADD, line.product.slug, line.quantity)
+        for line in order.lines.select_related('product').filter(product__isnull=False)
+    ]
+    return change_cart(request, operations)
+
+
+def read_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def get_quantity(request):
+    if request.content_type == 'application/json':
+        value = (read_json(request) or {}).get('quantity')
+    else:
+        value = request.POST.get('quantity')
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if 0 < quantity <= MAX_CART_QUANTITY else None
+
+
+def get_operations(request):
+    """
+    Список операций из тела запроса {"operations": [{"op": "add", "product": "slug", "quantity": 1}, ...]}.
+    Для add и set количество - целое число от 1 до MAX_CART_QUANTITY. При ошибке возвращает None
+    """
+    operations = (read_json(request) or {}).get('operations')
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_CART_OPERATIONS:
+        return None
+    result = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            return None
+        slug, quantity = operation.get('product'), operation.get('quantity', 1)
+        if not isinstance(slug, str):
+            return None
+        if operation['op'] == CART_REMOVE:
+            quantity = 0
+        elif not isinstance(quantity, int) or isinstance(quantity, bool) or not 0 < quantity <= MAX_CART_QUANTITY:
+            return None
+        result.append((operation['op'], slug, quantity))
+    return result
+
+
+async def cart_detail(request):
+    """GET api/cart/ - все строки и итоги корзины"""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return JsonResponse(await sync_to_async(read_cart)(request))
+
+
+async def _change_cart(request, operation, slug):
+    # в Django 3.2 асинхронными могут быть только view-функции, поэтому методы проверяем вручную
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    quantity = 1 if operation == CART_ADD else 0
+    if operation == CART_SET:
+        quantity = await sync_to_async(get_quantity)(request)
+        if quantity is None:
+            return JsonResponse(
+                {'error': f'Количество должно быть целым числом от 1 до {MAX_CART_QUANTITY}'}, status=400
+            )
+    try:
+        data = await sync_to_async(change_cart)(request, [(operation, slug, quantity)])
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Товар не найден в каталоге'}, status=404)
+    except CartLimitError:
+        return JsonResponse({'error': 'Сумма корзины превышает допустимую'}, status=400)
+    return JsonResponse({'line': data['lines'][0], 'cart': data['cart']})
+
+
+async def cart_add(request, slug):
+    return await _change_cart(request, CART_ADD, slug)
+
+
+async def cart_remove(request, slug):
+    return await _change_cart(request, CART_REMOVE, slug)
+
+
+async def cart_set_quantity(request, slug):
+    return await _change_cart(request, CART_SET, slug)
+
+
+async def cart_batch(request):
+    """
+    POST api/cart/batch/ - несколько изменений корзины за один запрос и одну транзакцию
+    {"operations": [{"op": "add" | "set" | "remove", "product": "slug", "quantity": 2}, ...]}
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    operations = await sync_to_async(get_operations)(request)
+    if operations is None:
+        return JsonResponse({'error': f'Ожидается от 1 до {MAX_CART_OPERATIONS} корректных операций'}, status=400)
+    try:
+        data = await sync_to_async(change_cart)(request, operations)
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Товар не найден в каталоге'}, status=404)
+    except CartLimitError:
+        return JsonResponse({'error': 'Сумма корзины превышает допустимую'}, status=400)
+    return JsonResponse(data)
+
+
+async def cart_reorder(request, order_id):
+    """POST api/cart/reorder/<id заказа>/ - повторить заказ: все его товары добавляются в корзину одной пачкой"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return JsonResponse({'error': 'Требуется авторизация'}, status=403)
+    try:
+        data = await sync_to_async(reorder)(request, order_id)
+    except (Order.DoesNotExist, Product.DoesNotExist):
+        return JsonResponse({'error': 'Заказ не найден'}, status=404)
+    except CartLimitError:
+        return JsonResponse({'error': 'Сумма корзины превышает допустимую'}, status=400)
+    return JsonResponse(data)
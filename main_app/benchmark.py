@@ -0,0 +1,193 @@
+"""
+Нагрузочный бенчмарк основных страниц магазина (python manage.py benchmark).
+
+Данные создаются генератором с фиксированным seed, запросы идут через django.test.Client
+в настоящие view со всеми middleware, поэтому результаты разных прогонов сравнимы между собой.
+Каждый сценарий выполняется всеми воркерами одновременно, у каждого воркера свой пользователь и своя корзина.
+"""
+import math
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import Client
+
+from .images import ensure_placeholder_image
+from .models import Cart, Category, Customer, Order, Product
+from .query_stats import QueryCollector
+from .utils import CART_ADD, apply_cart_operations, place_order, recount_category_products
+
+BENCH_PREFIX = 'bench'
+BENCH_PASSWORD = 'bench-password'
+BENCH_IMAGE = f'{BENCH_PREFIX}.jpg'
+
+
+def seed_dataset(categories=5, products=2000, users=8, orders_per_user=20, seed=1):
+    """
+    Создает категории, товары, пользователей и историю заказов с префиксом bench.
+    Повторный вызов с теми же параметрами ничего не дублирует
+    """
+    rng = random.Random(seed)
+    ensure_placeholder_image(BENCH_IMAGE)
+    category_objects = []
+    for index in range(categories):
+        category, _ = Category.objects.get_or_create(
+            slug=f'{BENCH_PREFIX}-category-{index}', defaults={'title': f'Bench category {index}'}
+        )
+        category_objects.append(category)
+    existing = set(Product.objects.filter(slug__startswith=f'{BENCH_PREFIX}-product-').values_list('slug', flat=True))
+    Product.objects.bulk_create([
+        Product(
+            category=category_objects[index % categories], slug=f'{BENCH_PREFIX}-product-{index}',
+            title=f'Bench product {index}', description='Товар для нагрузочного теста',
+            image=BENCH_IMAGE, price=Decimal(rng.randrange(100, 200000)) / 100,
+        )
+        for index in range(products) if f'{BENCH_PREFIX}-product-{index}' not in existing
+    ], batch_size=1000)
+    recount_category_products()
+
+    product_slugs = [f'{BENCH_PREFIX}-product-{index}' for index in range(products)]
+    User = get_user_model()
+    usernames = []
+    for index in range(users):
+        username = f'{BENCH_PREFIX}-user-{index}'
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            user = User.objects.create_user(username, f'{username}@example.com', BENCH_PASSWORD)
+            customer = Customer.objects.create(user=user)
+            for _ in range(orders_per_user):
+                cart = Cart.objects.create(owner=customer)
+                lines = Product.objects.in_bulk(rng.sample(product_slugs, 3), field_name='slug')
+                apply_cart_operations(cart, [(CART_ADD, product, rng.randint(1, 3)) for product in lines.values()])
+                place_order(Order(customer=customer, first_name='Bench', last_name='User', phone_number='0'), cart)
+        usernames.append(username)
+    return {'categories': [category.slug for category in category_objects], 'products': product_slugs,
+            'users': usernames}
+
+
+class Scenario:
+    """Сценарий: prepare выполняется без замера (например, положить товар в корзину перед оформлением)"""
+
+    def __init__(self, name, request, prepare=None, expected_status=(200,)):
+        self.name = name
+        self.request = request
+        self.prepare = prepare
+        self.expected_status = expected_status
+
+
+def _add_random_product(client, dataset, rng):
+    return client.get(f'/add_to_cart/{rng.choice(dataset["products"])}/')
+
+
+ORDER_FORM = {
+    'first_name': 'Bench', 'last_name': 'User', 'phone_number': '0', 'address': 'Bench street',
+    'buying_type': 'self', 'order_date': '2030-01-01', 'comment': '',
+}
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        Scenario('home', lambda client, dataset, rng: client.get('/')),
+        Scenario('category', lambda client, dataset, rng: client.get(
+            f'/category/{rng.choice(dataset["categories"])}/'
+        )),
+        Scenario('product', lambda client, dataset, rng: client.get(f'/products/{rng.choice(dataset["products"])}/')),
+        Scenario('add_to_cart', _add_random_product, expected_status=(302,)),
+        Scenario('cart', lambda client, dataset, rng: client.get('/cart/')),
+        Scenario(
+            'checkout', lambda client, dataset, rng: client.post('/make_order/', ORDER_FORM),
+            prepare=_add_random_product, expected_status=(302,),
+        ),
+        Scenario('profile', lambda client, dataset, rng: client.get('/profile/')),
+    )
+}
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга"""
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def _worker(scenario, dataset, username, requests, seed):
+    rng = random.Random(seed)
+    # ошибки view считаются как ответы 500, а не обрывают прогон
+    client = Client(raise_request_exception=False)
+    client.login(username=username, password=BENCH_PASSWORD)
+    samples, errors = [], 0
+    try:
+        for _ in range(requests):
+            if scenario.prepare:
+                scenario.prepare(client, dataset, rng)
+            collector = QueryCollector()
+            started = time.perf_counter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(collector))
+                response = scenario.request(client, dataset, rng)
+            samples.append(((time.perf_counter() - started) * 1000, collector.count))
+            if response.status_code not in scenario.expected_status:
+                errors += 1
+    finally:
+        connections.close_all()
+    return samples, errors
+
+
+def run_scenario(scenario, dataset, workers, requests, seed=1):
+    """Все воркеры одновременно выполняют по requests запросов сценария"""
+    barrier = threading.Barrier(workers)
+
+    def start(index):
+        barrier.wait()
+        return _worker(scenario, dataset, dataset['users'][index % len(dataset['users'])], requests, seed + index)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(start, range(workers)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for samples, _ in results for latency, _ in samples]
+    queries = [count for samples, _ in results for _, count in samples]
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2),
+        },
+        'queries': {'mean': round(statistics.mean(queries), 2), 'max': max(queries)},
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    """
+    Сравнение с сохраненным прогоном. Регрессия - p95 медленнее базового больше чем на tolerance
+    или больше SQL-запросов на ответ
+    """
+    rows = []
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        p95, base_p95 = current['latency_ms']['p95'], base['latency_ms']['p95']
+        queries, base_queries = current['queries']['mean'], base['queries']['mean']
+        rows.append({
+            'scenario': name,
+            'p95_ms': p95,
+            'baseline_p95_ms': base_p95,
+            'p95_change': round((p95 - base_p95) / base_p95, 3) if base_p95 else 0,
+            'queries': queries,
+            'baseline_queries': base_queries,
+            'regression': p95 > base_p95 * (1 + tolerance) or queries > base_queries,
+        })
+    return rows
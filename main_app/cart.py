@@ -0,0 +1,70 @@
+from .models import Product
+from .utils import MAX_CART_QUANTITY
+
+SESSION_CART_KEY = 'anonymous_cart'
+
+
+class SessionCartProduct:
+    """Строка анонимной корзины. Повторяет поля CartProduct, которые используются в шаблонах"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.total_price = product.price * quantity
+
+
+class SessionCart:
+    """
+    Корзина анонимного пользователя.
+    Хранится в сессии компактным списком [[id товара, количество], ...], поэтому у каждого посетителя
+    своя корзина и до авторизации в таблицы корзин ничего не пишется.
+    """
+
+    owner = None
+    in_order = False
+
+    def __init__(self, session):
+        self.session = session
+        self.lines = {product_id: quantity for product_id, quantity in session.get(SESSION_CART_KEY, [])}
+        self._items = None
+
+    @property
+    def items(self):
+        # товары подтягиваются одним запросом и только если шаблон действительно выводит строки корзины
+        if self._items is None:
+            products = Product.objects.in_bulk(self.lines)
+            self._items = [
+                SessionCartProduct(products[product_id], quantity)
+                for product_id, quantity in self.lines.items() if product_id in products
+            ]
+        return self._items
+
+    @property
+    def total_products(self):
+        # товары, удаленные из каталога после добавления в корзину, не считаются, как и в items
+        return len(self.items)
+
+    @property
+    def total_price(self):
+        return sum((item.total_price for item in self.items), 0)
+
+    def add(self, product, quantity=1):
+        self.lines[product.id] = min(self.lines.get(product.id, 0) + quantity, MAX_CART_QUANTITY)
+        self.save()
+
+    def set_quantity(self, product, quantity):
+        if quantity <= 0:
+            return self.remove(product)
+        self.lines[product.id] = min(quantity, MAX_CART_QUANTITY)
+        self.save()
+
+    def remove(self, product):
+        if self.lines.pop(product.id, None) is not None:
+            self.save()
+
+    def save(self):
+        self.session[SESSION_CART_KEY] = [[product_id, quantity] for product_id, quantity in self.lines.items()]
+        self._items = None
+
+    def __str__(self):
+        return 'anonymous'
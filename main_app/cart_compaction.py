@@ -0,0 +1,117 @@
+"""
+Удаление брошенных корзин (python manage.py compact_carts).
+
+Брошенная корзина - не ушедшая в заказ и не менявшаяся покупателем дольше заданного срока (Cart.updated_at).
+Корзины удаляются пачками, каждая пачка - отдельная короткая транзакция, между пачками пауза,
+поэтому блокировки держатся недолго и не мешают покупателям. Корзины, которые в этот момент кто-то меняет,
+пропускаются (SKIP LOCKED) и удаляются при следующем запуске.
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import Cart, CartProduct, Order
+
+
+def open_archive(path):
+    # дозапись: архив копится между запусками, у .gz каждый запуск - отдельный gzip-блок
+    if path.endswith('.gz'):
+        return gzip.open(path, 'at', encoding='utf-8')
+    return open(path, 'a', encoding='utf-8')
+
+
+class CartCompactor:
+    """Находит брошенные корзины и удаляет их вместе со строками, при необходимости сначала дописав в архив"""
+
+    def __init__(self, older_than_days, batch_size=500, pause=0.5, archive=None, dry_run=False):
+        self.cutoff = timezone.now() - timedelta(days=older_than_days)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive = archive
+        self.dry_run = dry_run
+        self.carts = self.lines = self.skipped = 0
+        self.total_price = 0
+
+    def abandoned(self):
+        # корзина, на которую ссылается заказ, не удаляется, даже если флаг in_order не выставлен
+        return Cart.objects.filter(
+            ~models.Exists(Order.objects.filter(cart=models.OuterRef('pk'))),
+            in_order=False, updated_at__lt=self.cutoff,
+        )
+
+    def estimate(self):
+        """Сколько корзин и строк будет удалено, для --dry-run"""
+        carts = self.abandoned()
+        totals = carts.aggregate(count=models.Count('id'), total_price=models.Sum('total_price'))
+        self.carts = totals['count']
+        self.total_price = totals['total_price'] or 0
+        self.lines = CartProduct.objects.filter(cart__in=carts).count()
+
+    def run(self, on_batch=None):
+        if self.dry_run:
+            self.estimate()
+            return
+        archive = open_archive(self.archive) if self.archive else None
+        try:
+            position = None
+            while True:
+                # ключ (updated_at, id) идет по частичному индексу cart_open_updated_at, без OFFSET
+                candidates = self.abandoned().order_by('updated_at', 'id')
+                if position is not None:
+                    candidates = candidates.filter(
+                        models.Q(updated_at__gt=position[0]) | models.Q(updated_at=position[0], id__gt=position[1])
+                    )
+                batch = list(candidates.values_list('updated_at', 'id')[:self.batch_size])
+                if not batch:
+                    break
+                position = batch[-1]
+                self.delete_batch([cart_id for _, cart_id in batch], archive)
+                if on_batch:
+                    on_batch(self)
+                if len(batch) < self.batch_size:
+                    break
+                time.sleep(self.pause)
+        finally:
+            if archive:
+                archive.close()
+
+    def delete_batch(self, cart_ids, archive):
+        with transaction.atomic():
+            # условие проверяется еще раз под блокировкой: покупатель мог вернуться к корзине
+            carts = list(
+                self.abandoned().select_for_update(skip_locked=True).filter(id__in=cart_ids)
+                .values('id', 'owner_id', 'total_products', 'total_price', 'updated_at')
+            )
+            self.skipped += len(cart_ids) - len(carts)
+            if not carts:
+                return
+            ids = [cart['id'] for cart in carts]
+            if archive:
+                self.write_archive(archive, carts)
+            lines, _ = CartProduct.objects.filter(cart_id__in=ids).delete()
+            deleted, _ = Cart.objects.filter(id__in=ids).delete()
+        self.carts += deleted
+        self.lines += lines
+        self.total_price += sum(cart['total_price'] for cart in carts)
+
+    @staticmethod
+    def write_archive(archive, carts):
+        lines = {}
+        for line in CartProduct.objects.filter(cart_id__in=[cart['id'] for cart in carts]).values(
+            'cart_id', 'product_id', 'quantity', 'total_price'
+        ).order_by('id'):
+            cart_id = line.pop('cart_id')
+            lines.setdefault(cart_id, []).append({**line, 'total_price': str(line['total_price'])})
+        for cart in carts:
+            archive.write(json.dumps({
+                **cart,
+                'total_price': str(cart['total_price']),
+                'updated_at': cart['updated_at'].isoformat(),
+                'lines': lines.get(cart['id'], []),
+            }, ensure_ascii=False) + '\n')
+        # архив пишется до удаления: если удаление не пройдет, корзина окажется в архиве дважды, но не потеряется
+        archive.flush()
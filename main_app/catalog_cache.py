@@ -0,0 +1,51 @@
+import hashlib
+import re
+import time
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_CHANGED_AT_KEY = 'catalog_changed_at'
+FRAGMENT_PLACEHOLDER = '<!--page-fragment:{}-->'
+FRAGMENT_PLACEHOLDER_RE = re.compile(r'<!--page-fragment:([\w/.-]+)-->')
+
+
+def get_catalog_version():
+    """
+    Версия каталога. Входит в ключи кэша страниц, поэтому при любом изменении каталога
+    достаточно сдвинуть версию - старые страницы просто перестают читаться и вытесняются сами.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # если версия вытеснена из кэша, начинаем с текущего времени, чтобы не совпасть со старыми ключами
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+    cache.set(CATALOG_CHANGED_AT_KEY, time.time(), timeout=None)
+
+
+def catalog_changed_recently(seconds):
+    """Каталог менялся меньше seconds секунд назад - реплики могли еще не получить изменения (см. routers.py)"""
+    changed_at = cache.get(CATALOG_CHANGED_AT_KEY)
+    return changed_at is not None and time.time() - changed_at < seconds
+
+
+def get_page_cache_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{get_catalog_version()}:{path}'
+
+
+def render_fragments(request, html):
+    """Подставляет в общую закэшированную страницу персональные куски: корзину, меню пользователя, сообщения"""
+    context = {'cart': getattr(request, 'cart', None)}
+    return FRAGMENT_PLACEHOLDER_RE.sub(
+        lambda match: render_to_string(match.group(1), context, request=request), html
+    )
@@ -0,0 +1,87 @@
+import csv
+import json
+import zlib
+
+from specs.models import CategoryFeature, ProductFeatures
+from .catalog_import import PRODUCT_COLUMNS
+from .models import Product
+
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: вместо записи просто возвращает строку"""
+
+    def write(self, value):
+        return value
+
+
+def iter_products(chunk_size=CHUNK_SIZE):
+    """
+    Товары вместе с характеристиками. Товары и характеристики читаются двумя курсорами,
+    отсортированными по id товара, и склеиваются на лету, как merge join.
+    На PostgreSQL iterator() использует серверные курсоры, поэтому в памяти не больше одного чанка.
+    """
+    products = Product.objects.order_by('id').values_list(
+        'id', 'slug', 'title', 'category__slug', 'price', 'description', 'image'
+    ).iterator(chunk_size=chunk_size)
+    features = ProductFeatures.objects.order_by('product_id', 'id').values_list(
+        'product_id', 'feature__feature_filter_name', 'value'
+    ).iterator(chunk_size=chunk_size)
+    feature = next(features, None)
+    for product_id, *values in products:
+        product_features = {}
+        while feature is not None and feature[0] <= product_id:
+            if feature[0] == product_id:
+                product_features.setdefault(feature[1], feature[2])
+            feature = next(features, None)
+        row = dict(zip(PRODUCT_COLUMNS, values))
+        row['price'] = str(row['price'])
+        row['features'] = product_features
+        yield row
+
+
+def iter_csv(rows):
+    feature_columns = sorted(set(CategoryFeature.objects.values_list('feature_filter_name', flat=True)))
+    writer = csv.writer(Echo())
+    yield writer.writerow(list(PRODUCT_COLUMNS) + feature_columns)
+    for row in rows:
+        yield writer.writerow(
+            [row[column] if row[column] is not None else '' for column in PRODUCT_COLUMNS]
+            + [row['features'].get(column, '') for column in feature_columns]
+        )
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    # склеиваем строки в куски по ~64 КБ, чтобы не отдавать клиенту по одной строке
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 - формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_catalog(file_format='csv', compress=False, chunk_size=CHUNK_SIZE):
+    """Генератор байтовых кусков выгрузки каталога в формате CSV или JSONL, по желанию сжатых gzip"""
+    rows = iter_products(chunk_size)
+    chunks = buffered(iter_csv(rows) if file_format == 'csv' else iter_jsonl(rows))
+    return gzipped(chunks) if compress else chunks
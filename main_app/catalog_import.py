@@ -0,0 +1,243 @@
+import csv
+import gzip
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+from .catalog_cache import bump_catalog_version
+from .images import schedule_variants
+from .models import Category, Product
+from .search import SEARCH_BATCH_SIZE, update_search_index
+from .utils import MAX_PRICE, recount_category_products, reprice_carts
+
+PRODUCT_COLUMNS = ('slug', 'title', 'category', 'price', 'description', 'image')
+
+
+class RowError(ValueError):
+    pass
+
+
+def open_catalog_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(file, file_format):
+    """
+    Построчное чтение файла каталога, в памяти держится одна строка.
+    CSV: колонки товара + по колонке на характеристику (имя колонки = feature_filter_name).
+    JSONL: {"slug": ..., "title": ..., "category": ..., "price": ..., "features": {"ram": "8"}}
+    """
+    if file_format == 'csv':
+        for row in csv.DictReader(file):
+            features = {key: value for key, value in row.items() if key not in PRODUCT_COLUMNS and value}
+            yield {**{key: row.get(key) for key in PRODUCT_COLUMNS}, 'features': features}
+    else:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+class CatalogValidator:
+    """
+    Справочники категорий, характеристик и допустимых значений (FeatureValidator).
+    Загружаются один раз за импорт, дальше каждая строка проверяется без запросов в базу.
+    """
+
+    def __init__(self):
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.features = {
+            (category_id, filter_name): feature_id
+            for feature_id, category_id, filter_name in CategoryFeature.objects.values_list(
+                'id', 'category_id', 'feature_filter_name'
+            )
+        }
+        self.valid_values = {}
+        for feature_id, value in FeatureValidator.objects.values_list('feature_key_id', 'validation_feature_value'):
+            self.valid_values.setdefault(feature_id, set()).add(value)
+
+    @staticmethod
+    def clean_text(value, name, model=Product, required=False):
+        """Строковое поле строки файла; длина проверяется по max_length поля модели с тем же именем"""
+        if value is None:
+            value = ''
+        if not isinstance(value, str):
+            raise RowError(f'{name} должно быть строкой')
+        value = value.strip()
+        if required and not value:
+            raise RowError(f'не заполнено {name}')
+        # слишком длинное значение на PostgreSQL прервало бы запись всей пачки (DataError)
+        max_length = model._meta.get_field(name).max_length
+        if max_length and len(value) > max_length:
+            raise RowError(f'{name} длиннее {max_length} символов')
+        return value
+
+    def clean(self, row):
+        if not isinstance(row, dict):
+            raise RowError('строка не является JSON-объектом')
+        slug = self.clean_text(row.get('slug'), 'slug', required=True)
+        title = self.clean_text(row.get('title'), 'title', required=True)
+        category = self.clean_text(row.get('category'), 'category', required=True)
+        description = self.clean_text(row.get('description'), 'description')
+        image = self.clean_text(row.get('image'), 'image')
+        category_id = self.categories.get(category)
+        if category_id is None:
+            raise RowError(f'неизвестная категория "{category}"')
+        try:
+            price = Decimal(str(row.get('price')).replace(',', '.'))
+            # NaN и бесконечность проходят quantize, но ломают сравнение ниже
+            if not price.is_finite():
+                raise InvalidOperation
+            price = price.quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            raise RowError(f'некорректная цена "{row.get("price")}"')
+        if price < 0 or price > MAX_PRICE:
+            raise RowError(f'цена вне допустимого диапазона: {price}')
+        row_features = row.get('features') or {}
+        if not isinstance(row_features, dict):
+            raise RowError('features должен быть объектом {"имя для фильтра": "значение"}')
+        features = {}
+        for filter_name, value in row_features.items():
+            feature_id = self.features.get((category_id, filter_name))
+            if feature_id is None:
+                raise RowError(f'у категории нет характеристики "{filter_name}"')
+            if isinstance(value, (dict, list)):
+                raise RowError(f'значение характеристики "{filter_name}" должно быть строкой или числом')
+            value = self.clean_text(None if value is None else str(value), 'value', model=ProductFeatures)
+            valid_values = self.valid_values.get(feature_id)
+            if valid_values is not None and value not in valid_values:
+                raise RowError(f'недопустимое значение "{value}" для характеристики "{filter_name}"')
+            features[feature_id] = value
+        return {
+            'slug': slug,
+            'title': title,
+            'category_id': category_id,
+            'price': price,
+            'description': description or None,
+            'image': image,
+            'features': features,
+        }
+
+
+class CatalogImporter:
+    """
+    Импорт каталога пачками: на пачку уходит фиксированное число запросов
+    (чтение существующих товаров и характеристик, bulk_update и bulk_create), память не растет с размером файла.
+    Массовые операции не вызывают сигналы, поэтому счетчики категорий, поисковый индекс, картинки
+    и кэш каталога обновляются здесь явно, а корзины с товарами, у которых изменилась цена, - после каждой пачки.
+    Размер пачки - это и длина списков slug__in и id в поисковом индексе, поэтому на SQLite он не больше 999.
+    """
+
+    product_fields = ('title', 'category_id', 'price', 'description', 'image')
+
+    def __init__(self, batch_size=SEARCH_BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.validator = CatalogValidator()
+        self.created = self.updated = self.errors = self.processed = 0
+        self.category_changed = False
+        self.repriced_products = self.repriced_carts = 0
+
+    def run(self, rows, on_error=None, on_progress=None):
+        batch = {}
+        for line_number, row in enumerate(rows, start=1):
+            self.processed += 1
+            try:
+                cleaned = self.validator.clean(row)
+            except RowError as error:
+                self.errors += 1
+                if on_error:
+                    on_error(line_number, error)
+                continue
+            batch[cleaned['slug']] = cleaned
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = {}
+                if on_progress:
+                    on_progress(self)
+        if batch:
+            self.write_batch(batch)
+        if on_progress:
+            on_progress(self)
+        if not self.dry_run:
+            self.finish()
+
+    def write_batch(self, batch):
+        if self.dry_run:
+            return
+        with transaction.atomic():
+            existing = {product.slug: product for product in Product.objects.filter(slug__in=batch)}
+            to_update, to_create, images, changed_prices = [], [], set(), []
+            for slug, data in batch.items():
+                product = existing.get(slug)
+                if product is None:
+                    to_create.append(Product(slug=slug, **{field: data[field] for field in self.product_fields}))
+                    images.add(data['image'])
+                    continue
+                if product.price != data['price']:
+                    changed_prices.append(product.id)
+                if product.category_id != data['category_id']:
+                    self.category_changed = True
+                if product.image.name != data['image']:
+                    images.add(data['image'])
+                for field in self.product_fields:
+                    setattr(product, field, data[field])
+                to_update.append(product)
+            Product.objects.bulk_update(to_update, self.product_fields)
+            Product.objects.bulk_create(to_create)
+            # bulk_create не на всех базах возвращает id, поэтому id новых товаров читаем одним запросом
+            product_ids = dict(Product.objects.filter(slug__in=batch).values_list('slug', 'id'))
+            self.write_features(batch, product_ids)
+            self.created += len(to_create)
+            self.updated += len(to_update)
+        update_search_index(product_ids.values())
+        for image in images - {''}:
+            schedule_variants(image)
+        if changed_prices:
+            # импорт и так работает вне запроса, поэтому корзины пересчитываются сразу
+            self.repriced_products += len(changed_prices)
+            self.repriced_carts += reprice_carts(changed_prices)
+
+    @staticmethod
+    def write_features(batch, product_ids):
+        existing = {}
+        for feature in ProductFeatures.objects.filter(product_id__in=product_ids.values()):
+            existing.setdefault((feature.product_id, feature.feature_id), feature)
+        to_update, to_create = [], []
+        for slug, data in batch.items():
+            product_id = product_ids[slug]
+            for feature_id, value in data['features'].items():
+                feature = existing.get((product_id, feature_id))
+                if feature is None:
+                    to_create.append(ProductFeatures(product_id=product_id, feature_id=feature_id, value=value))
+                elif feature.value != value:
+                    feature.value = value
+                    to_update.append(feature)
+        ProductFeatures.objects.bulk_update(to_update, ['value'])
+        ProductFeatures.objects.bulk_create(to_create)
+
+    def finish(self):
+        if self.created or self.category_changed:
+            recount_category_products()
+        if self.created or self.updated:
+            bump_catalog_version()
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'jsonl' if name.endswith(('.jsonl', '.json')) else 'csv'
+
+
+def iter_catalog_file(path, file_format=None):
+    file_format = detect_format(path, file_format)
+    with open_catalog_file(path) as file:
+        yield from read_rows(file, file_format)
+
@@ -0,0 +1,20 @@
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .catalog_cache import get_catalog_version
+from .models import Category
+
+
+def get_navigation_categories():
+    """Категории для меню вместе со счетчиками товаров. Хранятся в кэше под текущей версией каталога"""
+    key = f'navigation:{get_catalog_version()}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.order_by('title'))
+        cache.set(key, categories, 60 * 60 * 24)
+    return categories
+
+
+def navigation(request):
+    # ленивый объект: если шаблон не выводит меню (или страница взята из кэша), кэш даже не читается
+    return {'categories': SimpleLazyObject(get_navigation_categories)}
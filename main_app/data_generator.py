@@ -0,0 +1,317 @@
+"""
+Генератор синтетических данных масштаба продакшена (python manage.py generate_data).
+
+Все строки детерминированы seed'ом и базовой датой (base_date - "сегодня" сгенерированных данных, от нее
+отсчитываются даты заказов): один и тот же seed с той же датой на пустой базе дает те же данные.
+Популярность категорий, значений характеристик и товаров в корзинах неравномерная (степенное распределение),
+как в реальном магазине. Идентификаторы назначаются генератором, поэтому связи между таблицами не требуют
+чтения вставленных строк. Строки пишутся пачками: COPY на PostgreSQL, executemany на остальных базах.
+"""
+import io
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+from .catalog_cache import bump_catalog_version
+from .images import ensure_placeholder_image
+from .models import Cart, CartProduct, Category, Customer, Order, OrderLine, Product
+from .partitions import ensure_partitions
+from .search import rebuild_search_index
+from .utils import recount_category_products
+
+PROFILES = {
+    'small': {'categories': 20, 'products': 10_000, 'customers': 1_000, 'orders_per_customer': 5},
+    'medium': {'categories': 200, 'products': 1_000_000, 'customers': 100_000, 'orders_per_customer': 5},
+    'large': {'categories': 1_000, 'products': 10_000_000, 'customers': 1_000_000, 'orders_per_customer': 5},
+}
+GENERATED_PASSWORD = 'generated'
+GENERATED_IMAGE = 'generated.jpg'
+ORDER_STATUSES = (
+    (Order.STATUS_COMPLETED, 70), (Order.STATUS_READY, 10), (Order.STATUS_IN_PROGRESS, 10), (Order.STATUS_NEW, 10),
+)
+
+
+class SkewedSampler:
+    """
+    Номер от 0 до size - 1, маленькие номера выпадают чаще: u ** skew при skew > 1 прижимается к нулю.
+    Память O(1), поэтому подходит и для десяти миллионов товаров
+    """
+
+    def __init__(self, rng, size, skew):
+        self.rng = rng
+        self.size = size
+        self.skew = skew
+
+    def __call__(self):
+        return min(self.size - 1, int(self.size * self.rng.random() ** self.skew))
+
+    def distinct(self, count):
+        count = min(count, self.size)
+        chosen = set()
+        while len(chosen) < count:
+            chosen.add(self())
+        return sorted(chosen)
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY: NULL - \\N, спецсимволы экранируются обратной косой чертой"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class TableWriter:
+    """
+    Буфер строк одной таблицы. Сбрасывается явно: таблицы со связями сбрасываются вместе,
+    в порядке внешних ключей и в одной транзакции
+    """
+
+    def __init__(self, model, batch_size, now):
+        self.model = model
+        self.batch_size = batch_size
+        self.now = now
+        self.fields = model._meta.concrete_fields
+        self.columns = [field.column for field in self.fields]
+        self.rows = []
+        self.written = 0
+
+    def add(self, **values):
+        row = []
+        for field in self.fields:
+            if field.attname in values:
+                value = values[field.attname]
+            elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                # pre_save здесь не вызывается, а значения по умолчанию у auto_now полей нет
+                value = self.now
+            else:
+                value = field.get_default()
+            row.append(field.get_db_prep_save(value, connection))
+        self.rows.append(row)
+
+    @property
+    def full(self):
+        return len(self.rows) >= self.batch_size
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(column) for column in self.columns)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # текстовый формат, а не CSV: в CSV пустая строка и NULL неотличимы без кавычек
+                buffer = io.StringIO(''.join('\t'.join(map(copy_value, row)) + '\n' for row in self.rows))
+                cursor.cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+            else:
+                placeholders = ', '.join(['%s'] * len(self.columns))
+                cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', self.rows)
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=models.Max('pk'))['last'] or 0) + 1
+
+
+def product_price(seed, number):
+    # цена - функция номера товара, поэтому строки корзин и заказов знают цену, не храня весь каталог в памяти
+    return Decimal(100 + (number * 2654435761 + seed * 40503) % 2_000_000) / 100
+
+
+class DataGenerator:
+
+    def __init__(self, categories, products, customers, orders_per_customer, features_per_category=5,
+                 values_per_feature=8, open_cart_share=0.3, max_lines=5, skew=2.0, days=365, seed=1,
+                 base_date=None, batch_size=5000, on_progress=None):
+        self.categories = categories
+        self.products = products
+        self.customers = customers
+        self.orders_per_customer = orders_per_customer
+        self.features_per_category = features_per_category
+        self.values_per_feature = values_per_feature
+        self.open_cart_share = open_cart_share
+        self.max_lines = max_lines
+        self.skew = skew
+        self.days = days
+        self.seed = seed
+        self.batch_size = batch_size
+        self.on_progress = on_progress or (lambda message: None)
+        self.rng = random.Random(seed)
+        # начало базового дня, а не текущее время: иначе даты зависели бы от момента запуска
+        self.base_date = base_date or datetime.now(dt_timezone.utc).date()
+        self.now = datetime.combine(self.base_date, time.min, tzinfo=dt_timezone.utc)
+
+    def writer(self, model):
+        return TableWriter(model, self.batch_size, self.now)
+
+    def run(self, rebuild_search=True):
+        # у всех товаров одна и та же картинка, но это настоящий файл: уменьшенные копии для нее создаются
+        ensure_placeholder_image(GENERATED_IMAGE)
+        self.generate_catalog()
+        # заказы генерируются за прошедшие дни: секции под них создаются заранее, а не копятся в секции по умолчанию
+        ensure_partitions(self.now - timedelta(days=self.days), self.now)
+        self.generate_customers()
+        # у вставленных с явными id таблиц на PostgreSQL нужно подвинуть последовательности
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [
+                Category, CategoryFeature, FeatureValidator, Product, ProductFeatures, get_user_model(),
+                Customer, Cart, CartProduct, Order, OrderLine,
+            ]):
+                cursor.execute(sql)
+        recount_category_products()
+        if rebuild_search:
+            self.on_progress('Перестройка поискового индекса...')
+            rebuild_search_index()
+        bump_catalog_version()
+
+    def generate_catalog(self):
+        rng = self.rng
+        category_id, feature_id, validator_id = next_id(Category), next_id(CategoryFeature), next_id(FeatureValidator)
+        categories, features = self.writer(Category), self.writer(CategoryFeature)
+        validators = self.writer(FeatureValidator)
+        self.category_ids = []
+        # по номеру категории: [(id характеристики, [значения]), ...]
+        category_features = []
+        for number in range(self.categories):
+            current_id = category_id + number
+            self.category_ids.append(current_id)
+            categories.add(id=current_id, title=f'Категория {current_id}', slug=f'category-{current_id}')
+            own_features = []
+            for feature_number in range(self.features_per_category):
+                values = [f'{feature_number}-{value}' for value in range(self.values_per_feature)]
+                features.add(
+                    id=feature_id, category_id=current_id, feature_name=f'Характеристика {feature_number}',
+                    feature_filter_name=f'f{feature_number}', unit=None,
+                )
+                for value in values:
+                    validators.add(
+                        id=validator_id, category_id=current_id, feature_key_id=feature_id,
+                        validation_feature_value=value,
+                    )
+                    validator_id += 1
+                own_features.append((feature_id, values))
+                feature_id += 1
+            category_features.append(own_features)
+        self.flush([categories, features, validators])
+
+        self.first_product_id = next_id(Product)
+        products, product_features = self.writer(Product), self.writer(ProductFeatures)
+        product_feature_id = next_id(ProductFeatures)
+        category_sampler = SkewedSampler(rng, self.categories, self.skew)
+        value_sampler = SkewedSampler(rng, self.values_per_feature, self.skew)
+        for number in range(self.products):
+            product_id = self.first_product_id + number
+            category = category_sampler()
+            products.add(
+                id=product_id, category_id=self.category_ids[category], title=f'Товар {product_id}',
+                slug=f'product-{product_id}', image=GENERATED_IMAGE, description=f'Описание товара {product_id}',
+                price=product_price(self.seed, product_id),
+            )
+            for current_feature_id, values in category_features[category]:
+                product_features.add(
+                    id=product_feature_id, product_id=product_id, feature_id=current_feature_id,
+                    value=values[value_sampler()],
+                )
+                product_feature_id += 1
+            if products.full:
+                self.flush([products, product_features])
+                self.on_progress(f'Товаров: {products.written}')
+        self.flush([products, product_features])
+        self.on_progress(f'Товаров: {products.written}, характеристик товаров: {product_features.written}')
+
+    def generate_customers(self):
+        rng = self.rng
+        User = get_user_model()
+        # соль из seed: хэш пароля тоже одинаковый от запуска к запуску
+        password = make_password(GENERATED_PASSWORD, salt=f'generated{self.seed}')
+        user_id, customer_id = next_id(User), next_id(Customer)
+        cart_id, cart_product_id = next_id(Cart), next_id(CartProduct)
+        order_id, order_line_id = next_id(Order), next_id(OrderLine)
+        writers = {
+            model: self.writer(model) for model in (User, Customer, Cart, CartProduct, Order, OrderLine)
+        }
+        product_sampler = SkewedSampler(rng, self.products, self.skew)
+        statuses, weights = zip(*ORDER_STATUSES)
+
+        def write_cart(customer, in_order, updated_at):
+            nonlocal cart_id, cart_product_id
+            lines = []
+            for number in product_sampler.distinct(rng.randint(1, self.max_lines)):
+                product_id = self.first_product_id + number
+                quantity = rng.choices((1, 2, 3), weights=(80, 15, 5))[0]
+                price = product_price(self.seed, product_id)
+                lines.append((product_id, price, quantity, price * quantity))
+                writers[CartProduct].add(
+                    id=cart_product_id, customer_id=customer, cart_id=cart_id, product_id=product_id,
+                    quantity=quantity, total_price=price * quantity,
+                )
+                cart_product_id += 1
+            total = sum(line[3] for line in lines)
+            writers[Cart].add(id=cart_id, owner_id=customer, total_products=len(lines), total_price=total,
+                              in_order=in_order, updated_at=updated_at)
+            cart_id += 1
+            return cart_id - 1, lines, total
+
+        for number in range(self.customers):
+            current_user, current_customer = user_id + number, customer_id + number
+            writers[User].add(
+                id=current_user, username=f'customer-{current_user}', email=f'customer-{current_user}@example.com',
+                password=password, first_name='Покупатель', last_name=str(current_user), date_joined=self.now,
+            )
+            orders_total, last_order_at = Decimal(0), None
+            orders_count = rng.randint(0, self.orders_per_customer * 2)
+            # заказы по времени: большая часть - за последние дни (u ** skew прижимает к нулю)
+            created = sorted(
+                (self.now - timedelta(days=self.days * rng.random() ** self.skew) for _ in range(orders_count))
+            )
+            pending = []
+            for created_at in created:
+                order_cart, lines, total = write_cart(current_customer, in_order=True, updated_at=created_at)
+                pending.append((order_id, order_cart, lines, total, created_at))
+                order_id += 1
+                orders_total += total
+                last_order_at = created_at
+            # покупатель пишется раньше заказов, сводка по заказам уже посчитана
+            writers[Customer].add(
+                id=current_customer, user_id=current_user, phone_number=f'{current_user:011d}'[-11:],
+                address=f'Адрес {current_user}', orders_count=orders_count, orders_total=orders_total,
+                last_order_at=last_order_at,
+            )
+            for current_order, order_cart, lines, total, created_at in pending:
+                writers[Order].add(
+                    id=current_order, customer_id=current_customer, first_name='Покупатель',
+                    last_name=str(current_user), phone_number=f'{current_user}', cart_id=order_cart,
+                    address=f'Адрес {current_user}', status=rng.choices(statuses, weights=weights)[0],
+                    buying_type=rng.choice((Order.BUYING_TYPE_SELF, Order.BUYING_TYPE_DELIVERY)),
+                    total_products=len(lines), total_price=total, created_at=created_at,
+                    order_date=created_at.date(),
+                )
+                for product_id, price, quantity, line_total in lines:
+                    writers[OrderLine].add(
+                        id=order_line_id, order_id=current_order, product_id=product_id,
+                        title=f'Товар {product_id}', price=price, quantity=quantity, total_price=line_total,
+                    )
+                    order_line_id += 1
+            if rng.random() < self.open_cart_share:
+                # часть открытых корзин давно брошена (см. compact_carts)
+                write_cart(current_customer, in_order=False,
+                           updated_at=self.now - timedelta(days=self.days * rng.random() ** self.skew))
+            if any(writer.full for writer in writers.values()):
+                self.flush(writers.values())
+                self.on_progress(f'Покупателей: {number + 1}, заказов: {writers[Order].written}')
+        self.flush(writers.values())
+        self.on_progress(f'Покупателей: {writers[Customer].written}, заказов: {writers[Order].written}, '
+                         f'строк корзин: {writers[CartProduct].written}')
+
+    @staticmethod
+    def flush(writers):
+        # writers передаются в порядке внешних ключей: пользователь -> покупатель -> корзина -> ... -> строки заказа
+        with transaction.atomic():
+            for writer in writers:
+                writer.flush()
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .catalog_cache import bump_catalog_version
+from .tasks import run_in_background
+
+# Варианты картинки товара: имя -> максимальный размер. Пропорции сохраняются, маленькие картинки не растягиваются
+IMAGE_VARIANTS = {
+    'listing': (400, 400),
+    'listing_2x': (800, 800),
+    'detail': (900, 900),
+    'detail_2x': (1800, 1800),
+}
+IMAGE_FORMATS = {
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+
+# состояние вариантов картинки в общем кэше, чтобы не спрашивать хранилище при каждом показе
+VARIANTS_READY = 'ready'
+VARIANTS_PENDING = 'pending'
+VARIANTS_FAILED = 'failed'
+VARIANTS_STATE_TIMEOUTS = {
+    VARIANTS_READY: 60 * 60 * 24 * 7,
+    # если фоновая задача потерялась (например, процесс перезапустили), генерация повторится
+    VARIANTS_PENDING: 60 * 10,
+    # оригинал отсутствует или не читается: не пробуем снова до сохранения товара
+    VARIANTS_FAILED: 60 * 60 * 24,
+}
+
+logger = logging.getLogger(__name__)
+
+_pending = set()
+_pending_lock = threading.Lock()
+# в текущей пачке фоновых задач были готовые картинки - по ее окончании сдвигается версия каталога
+_generated = False
+
+
+def get_variant_name(image_name, variant, extension):
+    base, _ = os.path.splitext(image_name)
+    return f'variants/{base}/{variant}.{extension}'
+
+
+def _state_key(image_name):
+    return f'image_variants:{hashlib.md5(image_name.encode()).hexdigest()}'
+
+
+def get_variants_state(image_name):
+    return cache.get(_state_key(image_name))
+
+
+def set_variants_state(image_name, state):
+    cache.set(_state_key(image_name), state, VARIANTS_STATE_TIMEOUTS[state])
+
+
+def forget_variants_state(image_name):
+    cache.delete(_state_key(image_name))
+
+
+def generate_variants(image_name, storage=default_storage):
+    """Создает все варианты картинки. Ошибки чтения оригинала (OSError, ValueError) передаются вызывающему"""
+    with storage.open(image_name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+    for variant, size in IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        for extension, options in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, **options)
+            name = get_variant_name(image_name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    set_variants_state(image_name, VARIANTS_READY)
+
+
+def ensure_placeholder_image(image_name, size=(1200, 900), storage=default_storage):
+    """
+    Однотонная картинка под именем image_name, если файла еще нет. Для синтетических товаров (бенчмарк, генератор):
+    ссылка на несуществующий файл оставила бы товары без уменьшенных копий
+    """
+    if storage.exists(image_name):
+        return
+    buffer = BytesIO()
+    Image.new('RGB', size, (220, 220, 220)).save(buffer, **IMAGE_FORMATS['jpg'])
+    storage.save(image_name, ContentFile(buffer.getvalue()))
+
+
+def _generate_in_background(image_name):
+    global _generated
+    generated = False
+    try:
+        generate_variants(image_name)
+        generated = True
+    except Exception:
+        logger.warning('Не удалось создать варианты картинки %s', image_name, exc_info=True)
+        set_variants_state(image_name, VARIANTS_FAILED)
+    finally:
+        with _pending_lock:
+            _pending.discard(image_name)
+            _generated = _generated or generated
+            bump = _generated and not _pending
+            if bump:
+                _generated = False
+    if bump:
+        # закэшированные страницы могли сохраниться со ссылками на оригинал - сбрасываем их
+        # один раз на всю пачку картинок, а не после каждой
+        bump_catalog_version()
+
+
+def schedule_variants(image_name, retry=True):
+    """
+    Ставит генерацию вариантов в фон. retry=False - не ставить картинку, генерация которой уже не удалась:
+    так делает показ страницы, а сохранение товара и импорт пробуют снова
+    """
+    if not retry and get_variants_state(image_name) == VARIANTS_FAILED:
+        return
+    with _pending_lock:
+        if image_name in _pending:
+            return
+        _pending.add(image_name)
+    set_variants_state(image_name, VARIANTS_PENDING)
+    run_in_background(_generate_in_background, image_name)
+
+
+def get_variant_url(image, variant, extension='jpg'):
+    """
+    URL варианта картинки или None, если вариант еще не готов. В этом случае генерация ставится в очередь,
+    а шаблон показывает оригинал - следующий показ страницы получит уменьшенную копию
+    """
+    if not image:
+        return ''
+    name = get_variant_name(image.name, variant, extension)
+    state = get_variants_state(image.name)
+    if state == VARIANTS_READY:
+        return default_storage.url(name)
+    if state is None:
+        # хранилище проверяется один раз, дальше состояние берется из кэша
+        if default_storage.exists(name):
+            set_variants_state(image.name, VARIANTS_READY)
+            return default_storage.url(name)
+        schedule_variants(image.name, retry=False)
+    return None
@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from main_app.benchmark import SCENARIOS, compare_with_baseline, run_scenario, seed_dataset
+
+
+def int_at_least(minimum):
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f'должно быть не меньше {minimum}')
+        return number
+    return parse
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный бенчмарк основных страниц: главная, категория, товар, добавление в корзину, корзина, '
+        'оформление заказа, профиль. По умолчанию работает на отдельной тестовой базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--workers', type=int_at_least(1), default=4, help='Сколько клиентов работает одновременно')
+        parser.add_argument('--requests', type=int_at_least(1), default=50, help='Запросов на воркер в каждом сценарии')
+        parser.add_argument('--categories', type=int_at_least(1), default=5)
+        # в каждом заказе истории три разных товара
+        parser.add_argument('--products', type=int_at_least(3), default=2000)
+        parser.add_argument('--orders-per-user', type=int_at_least(0), default=20)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--warmup', type=int_at_least(0), default=5, help='Запросов на воркер для прогрева, не учитываются'
+        )
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимое замедление p95, доля')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Код возврата 1 при регрессии')
+        parser.add_argument(
+            '--use-current-db', action='store_true',
+            help='Работать в текущей базе (данные с префиксом bench остаются), а не в отдельной тестовой'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # команда вызвана из тестов, окружение уже подготовил раннер
+            own_environment = False
+        else:
+            own_environment = True
+        old_names = {}
+        if not options['use_current_db']:
+            mirrors = {}
+            for alias in connections:
+                settings_dict = connections[alias].settings_dict
+                if settings_dict['TEST'].get('MIRROR'):
+                    # реплика смотрит в тестовую базу своей основной, как в тестах
+                    mirrors[alias] = settings_dict['TEST']['MIRROR']
+                    continue
+                if connections[alias].vendor == 'sqlite' and not settings_dict['TEST'].get('NAME'):
+                    # общая база SQLite в памяти не переживает параллельную запись, поэтому тестовая база - файл
+                    settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), f'benchmark_{alias}.sqlite3')
+                old_names[alias] = settings_dict['NAME']
+                connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            for alias, mirror in mirrors.items():
+                connections[alias].creation.set_as_test_mirror(connections[mirror].settings_dict)
+        try:
+            results = self.run(options)
+        finally:
+            for alias, old_name in old_names.items():
+                connections[alias].creation.destroy_test_db(old_name, verbosity=0)
+            if own_environment:
+                teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результат сохранен в {options["output"]}')
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            differs = [
+                key for key in ('database', 'workers', 'requests', 'products', 'orders_per_user', 'seed')
+                if baseline.get('meta', {}).get(key) != results['meta'][key]
+            ]
+            if differs:
+                self.stdout.write(self.style.WARNING(
+                    f'Параметры базового прогона отличаются ({", ".join(differs)}), сравнение неточное'
+                ))
+            rows = compare_with_baseline(results, baseline, options['tolerance'])
+            self.report_comparison(rows)
+            if options['fail_on_regression'] and any(row['regression'] for row in rows):
+                raise CommandError('Есть регрессии относительно базового прогона')
+
+    def run(self, options):
+        if connection.vendor == 'sqlite' and options['workers'] > 1:
+            self.stdout.write(self.style.WARNING(
+                'SQLite блокирует базу целиком на запись: сценарии с записью при нескольких воркерах дадут ошибки, '
+                'сравнимые цифры получаются на PostgreSQL'
+            ))
+        self.stdout.write('Подготовка данных...')
+        dataset = seed_dataset(
+            categories=options['categories'], products=options['products'], users=options['workers'],
+            orders_per_user=options['orders_per_user'], seed=options['seed'],
+        )
+        cache.clear()
+        scenarios = {}
+        for name in options['scenarios']:
+            scenario = SCENARIOS[name]
+            if options['warmup']:
+                run_scenario(scenario, dataset, options['workers'], options['warmup'], options['seed'])
+            self.stdout.write(f'Сценарий {name}...')
+            scenarios[name] = run_scenario(scenario, dataset, options['workers'], options['requests'], options['seed'])
+        return {
+            'meta': {
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                **{key: options[key] for key in ('workers', 'requests', 'categories', 'products', 'orders_per_user',
+                                                  'seed', 'warmup')},
+            },
+            'scenarios': scenarios,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"сценарий":<12} {"запросов":>8} {"ошибок":>6} {"rps":>8} {"p50, мс":>8} {"p95, мс":>8} '
+            f'{"p99, мс":>8} {"SQL/ответ":>9}'
+        )
+        for name, row in results['scenarios'].items():
+            latency = row['latency_ms']
+            self.stdout.write(
+                f'{name:<12} {row["requests"]:>8} {row["errors"]:>6} {row["throughput_rps"]:>8} {latency["p50"]:>8} '
+                f'{latency["p95"]:>8} {latency["p99"]:>8} {row["queries"]["mean"]:>9}'
+            )
+
+    def report_comparison(self, rows):
+        self.stdout.write('')
+        self.stdout.write('Сравнение с базовым прогоном:')
+        for row in rows:
+            line = (
+                f'{row["scenario"]:<12} p95 {row["baseline_p95_ms"]} -> {row["p95_ms"]} мс '
+                f'({row["p95_change"]:+.0%}), SQL {row["baseline_queries"]} -> {row["queries"]}'
+            )
+            self.stdout.write(self.style.ERROR(line) if row['regression'] else self.style.SUCCESS(line))
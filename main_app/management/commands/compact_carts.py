@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main_app.cart_compaction import CartCompactor
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет брошенные корзины (не ушедшие в заказ и не менявшиеся дольше --older-than дней) вместе '
+        'со строками. Рассчитана на регулярный запуск по расписанию'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=getattr(settings, 'ABANDONED_CART_DAYS', 30),
+            help='Возраст брошенной корзины в днях, по умолчанию ABANDONED_CART_DAYS',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Корзин в одной транзакции')
+        parser.add_argument('--sleep', type=float, default=0.5, help='Пауза между пачками, секунд')
+        parser.add_argument('--archive', help='Дописать удаляемые корзины в JSONL-файл (можно .gz)')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удаляя')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        compactor = CartCompactor(
+            options['older_than'], batch_size=options['batch_size'], pause=options['sleep'],
+            archive=options['archive'], dry_run=options['dry_run'],
+        )
+
+        def on_batch(compactor):
+            self.stdout.write(
+                f'[{time.monotonic() - started:.1f} c] удалено корзин {compactor.carts}, строк {compactor.lines}'
+            )
+
+        compactor.run(on_batch)
+        summary = f'корзин {compactor.carts}, строк {compactor.lines}, на сумму {compactor.total_price}'
+        if options['dry_run']:
+            self.stdout.write(f'Будет удалено: {summary}')
+            return
+        if compactor.skipped:
+            self.stdout.write(f'Пропущено корзин, которые менялись во время удаления: {compactor.skipped}')
+        if options['archive']:
+            self.stdout.write(f'Архив: {options["archive"]}')
+        self.stdout.write(self.style.SUCCESS(f'Удалено: {summary}'))
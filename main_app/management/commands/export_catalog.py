@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from main_app.catalog_export import export_catalog
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка каталога с характеристиками в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunks = export_catalog(options['format'], options['gzip'], options['chunk_size'])
+        if options['path']:
+            with open(options['path'], 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
@@ -0,0 +1,35 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from main_app.catalog_cache import bump_catalog_version
+from main_app.images import (
+    IMAGE_FORMATS, IMAGE_VARIANTS, VARIANTS_FAILED, generate_variants, get_variant_name, set_variants_state
+)
+from main_app.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии картинок товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать и уже существующие копии')
+
+    def handle(self, *args, **options):
+        names = Product.objects.exclude(image='').order_by().values_list('image', flat=True).distinct()
+        generated = 0
+        for name in names.iterator():
+            if not options['force'] and all(
+                default_storage.exists(get_variant_name(name, variant, extension))
+                for variant in IMAGE_VARIANTS for extension in IMAGE_FORMATS
+            ):
+                continue
+            try:
+                generate_variants(name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{name}: {error}')
+                set_variants_state(name, VARIANTS_FAILED)
+                continue
+            generated += 1
+        if generated:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {generated}'))
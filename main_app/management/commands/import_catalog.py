@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.catalog_import import CatalogImporter, iter_catalog_file
+from main_app.search import SEARCH_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт каталога товаров и их характеристик из CSV или JSONL (в том числе .gz)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу каталога')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=SEARCH_BATCH_SIZE, help='Не больше 999 на SQLite')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывая')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        importer = CatalogImporter(batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        def on_error(line_number, error):
+            self.stderr.write(f'Строка {line_number}: {error}')
+
+        def on_progress(importer):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Обработано {importer.processed} строк за {elapsed:.1f} c '
+                f'({importer.processed / max(elapsed, 0.001):.0f} строк/c): создано {importer.created}, '
+                f'обновлено {importer.updated}, ошибок {importer.errors}'
+            )
+
+        importer.run(iter_catalog_file(options['path'], options['format']), on_error, on_progress)
+        if importer.repriced_products:
+            self.stdout.write(
+                f'Изменились цены {importer.repriced_products} товаров, пересчитано корзин: {importer.repriced_carts}'
+            )
+        self.stdout.write(self.style.SUCCESS('Импорт завершен'))
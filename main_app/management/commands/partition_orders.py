@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from main_app.partitions import (
+    add_months, detach_partitions_before, ensure_partitions, is_partitioned, list_partitions, month_start,
+    split_default_partition,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживание помесячных секций таблицы заказов: создает секции на --ahead месяцев вперед и выносит '
+        'строки из секции по умолчанию. Рассчитана на запуск по расписанию, например раз в сутки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help='На сколько месяцев вперед создавать секции')
+        parser.add_argument(
+            '--detach-before', metavar='YYYY-MM',
+            help='Отключить секции месяцев раньше указанного. Таблицы секций и строк их заказов (<секция>_lines) '
+                 'остаются в базе, заказы пропадают из магазина',
+        )
+        parser.add_argument('--list', action='store_true', help='Показать секции и примерное число строк')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            self.stdout.write(
+                f'Таблица заказов не секционирована (база {connection.vendor}), '
+                f'выборки за период обслуживает индекс order_created_at'
+            )
+            return
+        created = split_default_partition()
+        now = timezone.now()
+        created += ensure_partitions(month_start(now), add_months(month_start(now), options['ahead']))
+        for name in created:
+            self.stdout.write(f'Создана секция {name}')
+        if options['detach_before']:
+            try:
+                month = datetime.strptime(options['detach_before'], '%Y-%m')
+            except ValueError:
+                raise CommandError('--detach-before ожидает месяц в формате YYYY-MM')
+            for name in detach_partitions_before(month):
+                self.stdout.write(self.style.WARNING(f'Отключена секция {name}'))
+        if options['list']:
+            for name, bounds, rows in list_partitions():
+                self.stdout.write(f'{name:<32} {bounds:<80} ~{max(rows, 0)} строк')
+        self.stdout.write(self.style.SUCCESS(f'Секций создано: {len(created)}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main_app.search import SEARCH_BATCH_SIZE, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SEARCH_BATCH_SIZE, help='Не больше 999 на SQLite')
+
+    def handle(self, *args, **options):
+        rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
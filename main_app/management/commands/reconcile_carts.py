@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from main_app.models import Cart
+from main_app.utils import get_drifted_carts, recalculate_cart
+
+
+class Command(BaseCommand):
+    help = 'Сверяет итоги корзин с суммой по строкам и при необходимости пересчитывает их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Пересчитать корзины с расхождениями')
+        parser.add_argument('--all', action='store_true', help='Проверять и корзины, ушедшие в заказ')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.all() if options['all'] else Cart.objects.filter(in_order=False)
+        drifted = 0
+        for cart in get_drifted_carts(carts).iterator():
+            drifted += 1
+            self.stdout.write(
+                f'Корзина {cart.id}: сохранено {cart.total_price} / {cart.total_products}, '
+                f'по строкам {cart.actual_total_price} / {cart.actual_total_products}'
+            )
+            if options['fix']:
+                recalculate_cart(cart)
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Пересчитано корзин: {drifted}'))
+        else:
+            self.stdout.write(f'Корзин с расхождениями: {drifted}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main_app.models import CartProduct
+from main_app.utils import reprice_carts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает строки и итоги открытых корзин по текущим ценам товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        product_ids = CartProduct.objects.filter(cart__in_order=False).values_list('product_id', flat=True).distinct()
+        repriced = reprice_carts(product_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано корзин: {repriced}'))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+
+from main_app.query_stats import REPEATED_QUERY_THRESHOLD, load_stats, reset_stats
+
+SORT_KEYS = {
+    'total': lambda stats: stats.total_wall_time,
+    'p95': lambda stats: stats.wall_time.percentile(95) or float('inf'),
+    'queries': lambda stats: stats.queries.percentile(95) or float('inf'),
+    'requests': lambda stats: stats.requests,
+}
+
+
+def format_bound(value):
+    # None - значение больше последней границы гистограммы
+    return '>max' if value is None else str(value)
+
+
+class Command(BaseCommand):
+    help = (
+        'Статистика по view: число запросов, перцентили p50/p95/p99 времени ответа, времени в базе и числа SQL, '
+        'а также view с признаками N+1'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total', help='Порядок вывода, по умолчанию total')
+        parser.add_argument('--top', type=int, default=20, help='Сколько view показать')
+        parser.add_argument('--reset', action='store_true', help='Очистить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Статистика очищена'))
+            return
+        stats = load_stats()
+        if not stats:
+            self.stdout.write('Статистики пока нет')
+            return
+        self.stdout.write(
+            f'{"view":<40} {"запросов":>8}  {"время, мс p50/p95/p99":>22}  {"база, мс p50/p95/p99":>22}  '
+            f'{"SQL p50/p95/p99":>16}  {"SQL max":>7}'
+        )
+        ordered = sorted(stats.items(), key=lambda item: SORT_KEYS[options['sort']](item[1]), reverse=True)
+        for view_name, view in ordered[:options['top']]:
+            percentiles = [
+                '/'.join(format_bound(histogram.percentile(percent)) for percent in (50, 95, 99))
+                for histogram in (view.wall_time, view.db_time, view.queries)
+            ]
+            line = (
+                f'{view_name:<40} {view.requests:>8}  {percentiles[0]:>22}  {percentiles[1]:>22}  '
+                f'{percentiles[2]:>16}  {view.max_queries:>7}'
+            )
+            self.stdout.write(self.style.WARNING(line) if view.suspected_n_plus_one else line)
+
+        suspects = [(name, view) for name, view in ordered if view.suspected_n_plus_one]
+        if suspects:
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING(
+                f'Возможный N+1 (один запрос повторяется {REPEATED_QUERY_THRESHOLD} и более раз за ответ):'
+            ))
+            for view_name, view in sorted(suspects, key=lambda item: item[1].max_repeated, reverse=True):
+                self.stdout.write(f'  {view_name}: до {view.max_repeated} повторов, SQL от {view.min_queries} '
+                                  f'до {view.max_queries} запросов на ответ')
+                self.stdout.write(f'    {view.worst_sql[:300]}')
@@ -0,0 +1,58 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .catalog_cache import catalog_changed_recently
+from .query_stats import QueryCollector, recorder
+from .routers import routing_state
+
+PIN_PRIMARY_COOKIE = 'pin_primary'
+
+
+class QueryStatsMiddleware:
+    """
+    Считает для каждого view (по имени из urls.py) число запросов к базе, время в базе и общее время ответа.
+    Запросы перехватываются через connection.execute_wrapper, поэтому работает и с DEBUG = False
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        collector = QueryCollector()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+        wall_time = (time.perf_counter() - started) * 1000
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            recorder.record(match.view_name, collector, wall_time)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Разрешает чтение каталога с реплик для GET/HEAD (см. routers.py). Если в запросе была запись,
+    пользователь следующие REPLICA_PIN_SECONDS секунд читает только основную базу и видит свои изменения.
+    Должна стоять раньше SessionMiddleware, чтобы сохранение сессии тоже считалось записью
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+        use_replicas = (
+            request.method in ('GET', 'HEAD')
+            and PIN_PRIMARY_COOKIE not in request.COOKIES
+            and not catalog_changed_recently(pin_seconds)
+        )
+        with routing_state(use_replicas) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            response.set_cookie(PIN_PRIMARY_COOKIE, '1', max_age=pin_seconds, httponly=True, samesite='Lax')
+        return response
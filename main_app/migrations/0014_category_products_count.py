@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:57
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_category_products(apps, schema_editor):
+    Category = apps.get_model('main_app', 'Category')
+    Product = apps.get_model('main_app', 'Product')
+    Category.objects.update(
+        products_count=Coalesce(models.Subquery(
+            Product.objects.filter(category=models.OuterRef('pk'))
+            .values('category').annotate(count=models.Count('id')).values('count'),
+            output_field=models.PositiveIntegerField(),
+        ), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество товаров'),
+        ),
+        migrations.RunPython(count_category_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+# SQL записан прямо в миграции: она должна делать то же самое, как бы ни менялся main_app/search.py
+POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('russian', coalesce(p.title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(p.description, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(
+        (SELECT string_agg(f.value, ' ') FROM specs_productfeatures f WHERE f.product_id = p.id), ''
+    )), 'C')
+"""
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE main_app_product ADD COLUMN search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX main_app_product_search_vector_idx ON main_app_product USING gin (search_vector)'
+        )
+        schema_editor.execute(f'UPDATE main_app_product p SET search_vector = {POSTGRES_DOCUMENT}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE main_app_product_fts '
+            "USING fts5(title, description, features, tokenize='unicode61')"
+        )
+        schema_editor.execute("""
+            INSERT INTO main_app_product_fts (rowid, title, description, features)
+            SELECT p.id, p.title, coalesce(p.description, ''),
+                   coalesce((SELECT group_concat(f.value, ' ') FROM specs_productfeatures f
+                             WHERE f.product_id = p.id), '')
+            FROM main_app_product p
+        """)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE main_app_product DROP COLUMN search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE main_app_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0014_category_products_count'),
+        ('specs', '0002_productfeatures'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
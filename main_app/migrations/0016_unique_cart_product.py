@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+def merge_duplicate_cart_products(apps, schema_editor):
+    """Перед добавлением ограничения склеиваем дубли строк: количество и сумма переходят в самую раннюю строку"""
+    Cart = apps.get_model('main_app', 'Cart')
+    CartProduct = apps.get_model('main_app', 'CartProduct')
+    duplicates = (
+        CartProduct.objects.values('cart', 'product')
+        .annotate(count=models.Count('id')).filter(count__gt=1).order_by()
+    )
+    for duplicate in duplicates.iterator():
+        cart_products = list(
+            CartProduct.objects.filter(cart=duplicate['cart'], product=duplicate['product']).order_by('id')
+        )
+        keep, rest = cart_products[0], cart_products[1:]
+        keep.quantity = sum(cart_product.quantity for cart_product in cart_products)
+        keep.total_price = sum(cart_product.total_price for cart_product in cart_products)
+        keep.save(update_fields=['quantity', 'total_price'])
+        CartProduct.objects.filter(pk__in=[cart_product.pk for cart_product in rest]).delete()
+        Cart.objects.filter(pk=duplicate['cart']).update(total_products=models.F('total_products') - len(rest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
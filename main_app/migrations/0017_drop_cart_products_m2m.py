@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def sync_carts_with_foreign_key(apps, schema_editor):
+    """
+    Источником правды для строк корзины становится CartProduct.cart.
+    Находим корзины, у которых m2m и внешний ключ расходятся (строка привязана к чужой корзине
+    или отсутствует в m2m), и пересчитываем их итоги по внешнему ключу
+    """
+    Cart = apps.get_model('main_app', 'Cart')
+    CartProduct = apps.get_model('main_app', 'CartProduct')
+    Through = Cart.products.through
+    linked = Through.objects.filter(cart_id=models.OuterRef('cart_id'), cartproduct_id=models.OuterRef('pk'))
+    cart_ids = set(
+        CartProduct.objects.annotate(linked=models.Exists(linked)).filter(linked=False).values_list('cart_id', flat=True)
+    )
+    for cart_id, cart_product_cart_id in Through.objects.exclude(
+        cart_id=models.F('cartproduct__cart_id')
+    ).values_list('cart_id', 'cartproduct__cart_id'):
+        cart_ids.update((cart_id, cart_product_cart_id))
+    lines = CartProduct.objects.filter(cart_id=models.OuterRef('pk')).order_by().values('cart_id')
+    Cart.objects.filter(pk__in=cart_ids).update(
+        total_price=Coalesce(
+            models.Subquery(lines.annotate(total=models.Sum('total_price')).values('total')), 0,
+            output_field=models.DecimalField(),
+        ),
+        total_products=Coalesce(models.Subquery(lines.annotate(count=models.Count('id')).values('count')), 0),
+    )
+
+
+def fill_m2m_from_foreign_key(apps, schema_editor):
+    Cart = apps.get_model('main_app', 'Cart')
+    CartProduct = apps.get_model('main_app', 'CartProduct')
+    Through = Cart.products.through
+    Through.objects.bulk_create(
+        [Through(cart_id=cart_id, cartproduct_id=pk) for pk, cart_id in CartProduct.objects.values_list('pk', 'cart_id')],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0016_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_carts_with_foreign_key, fill_m2m_from_foreign_key),
+        migrations.RemoveField(
+            model_name='cart',
+            name='products',
+        ),
+    ]
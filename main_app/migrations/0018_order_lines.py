@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_existing_orders(apps, schema_editor):
+    """Строки уже оформленных заказов копируются из их корзин, итоги заказа - из итогов корзины"""
+    Order = apps.get_model('main_app', 'Order')
+    OrderLine = apps.get_model('main_app', 'OrderLine')
+    CartProduct = apps.get_model('main_app', 'CartProduct')
+    orders = Order.objects.filter(cart__isnull=False).select_related('cart').order_by('id')
+    for order in orders.iterator(chunk_size=500):
+        lines = [
+            OrderLine(
+                order=order, product_id=item.product_id, title=item.product.title,
+                price=item.total_price / item.quantity if item.quantity else item.product.price,
+                quantity=item.quantity, total_price=item.total_price,
+            )
+            for item in CartProduct.objects.filter(cart_id=order.cart_id).select_related('product')
+        ]
+        OrderLine.objects.bulk_create(lines)
+        Order.objects.filter(pk=order.pk).update(
+            total_products=order.cart.total_products, total_price=order.cart.total_price
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0017_drop_cart_products_m2m'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customer',
+            name='orders',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_products',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество позиций'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=250, verbose_name='Наименование')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Сумма')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='main_app.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='main_app.product', verbose_name='Товар')),
+            ],
+        ),
+        migrations.RunPython(snapshot_existing_orders, migrations.RunPython.noop),
+    ]
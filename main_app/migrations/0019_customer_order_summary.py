@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:08
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def summarize_customer_orders(apps, schema_editor):
+    Customer = apps.get_model('main_app', 'Customer')
+    Order = apps.get_model('main_app', 'Order')
+    orders = Order.objects.filter(customer=models.OuterRef('pk')).order_by().values('customer')
+    Customer.objects.update(
+        orders_count=Coalesce(models.Subquery(
+            orders.annotate(count=models.Count('id')).values('count'), output_field=models.PositiveIntegerField()
+        ), 0),
+        orders_total=Coalesce(models.Subquery(
+            orders.annotate(total=models.Sum('total_price')).values('total'), output_field=models.DecimalField()
+        ), 0),
+        last_order_at=models.Subquery(orders.annotate(last=models.Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0018_order_lines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата последнего заказа'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество заказов'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Сумма всех заказов'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_id'),
+        ),
+        migrations.RunPython(summarize_customer_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,119 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:22
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations, models
+
+# SQL записан прямо в миграции: она должна делать то же самое, как бы ни менялся main_app/partitions.py.
+# Только PostgreSQL 12+: main_app_order пересоздается секционированной по created_at (PARTITION BY RANGE)
+# с помесячными секциями main_app_order_pYYYY_MM и секцией по умолчанию. Первичный ключ секционированной
+# таблицы обязан включать created_at, поэтому внешний ключ main_app_orderline.order_id на заказ снимается -
+# каскадное удаление строк выполняет ORM. На остальных базах таблица и внешний ключ остаются как есть.
+# Данные копируются одним INSERT ... SELECT: на большой таблице это надолго блокирует заказы.
+ORDER_TABLE = 'main_app_order'
+ORDER_LINE_TABLE = 'main_app_orderline'
+MONTHS_AHEAD = 3
+
+
+def add_months(value, months):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def order_line_foreign_keys(cursor):
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE contype = 'f' AND conrelid = %s::regclass "
+        "AND confrelid = %s::regclass",
+        [ORDER_LINE_TABLE, ORDER_TABLE],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def rebuild_order_table(cursor, partitioned):
+    """Пересоздает таблицу заказов с теми же данными, последовательностью id, индексами и внешними ключами"""
+    old_table = f'{ORDER_TABLE}_old'
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s',
+        [ORDER_TABLE, f'{ORDER_TABLE}_pkey'],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [ORDER_TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [ORDER_TABLE, 'id'])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(f'SELECT min(created_at) FROM {ORDER_TABLE}')
+    first_order = cursor.fetchone()[0]
+
+    cursor.execute(f'ALTER TABLE {ORDER_TABLE} RENAME TO {old_table}')
+    # последовательность id принадлежит колонке старой таблицы и удалилась бы вместе с ней
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    partition_by = ' PARTITION BY RANGE (created_at)' if partitioned else ''
+    # NOT NULL, значения по умолчанию (nextval последовательности) и CHECK (PositiveIntegerField) переносятся
+    cursor.execute(
+        f'CREATE TABLE {ORDER_TABLE} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS){partition_by}'
+    )
+    if partitioned:
+        cursor.execute(f'CREATE TABLE {ORDER_TABLE}_default PARTITION OF {ORDER_TABLE} DEFAULT')
+        now = datetime.now(dt_timezone.utc)
+        month = add_months((first_order or now).astimezone(dt_timezone.utc), 0)
+        while month <= add_months(now, MONTHS_AHEAD):
+            cursor.execute(
+                f"CREATE TABLE {ORDER_TABLE}_p{month:%Y_%m} PARTITION OF {ORDER_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+            month = add_months(month, 1)
+    cursor.execute(f'INSERT INTO {ORDER_TABLE} SELECT * FROM {old_table}')
+    cursor.execute(f'DROP TABLE {old_table}')
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {ORDER_TABLE}.id')
+
+    primary_key = '(id, created_at)' if partitioned else '(id)'
+    cursor.execute(f'ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {ORDER_TABLE}_pkey PRIMARY KEY {primary_key}')
+    for sql in indexes:
+        # у индекса секционированной таблицы определение вида "ON ONLY таблица"
+        cursor.execute(sql.replace(' ON ONLY ', ' ON '))
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in order_line_foreign_keys(cursor):
+            cursor.execute(f'ALTER TABLE {ORDER_LINE_TABLE} DROP CONSTRAINT {name}')
+        rebuild_order_table(cursor, partitioned=True)
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_order_table(cursor, partitioned=False)
+    # если в базе есть строки без заказа, ключ не создастся и миграция остановится с ошибкой
+    OrderLine = apps.get_model('main_app', 'OrderLine')
+    schema_editor.execute(schema_editor._create_fk_sql(
+        OrderLine, OrderLine._meta.get_field('order'), '_fk_%(to_table)s_%(to_column)s'
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0020_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания заказа'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_at'),
+        ),
+        migrations.RunPython(forwards, backwards),
+    ]
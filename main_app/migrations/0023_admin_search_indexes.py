@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Индексы под поиск в админке (search_fields "=поле" и "^поле"): Django сравнивает UPPER(поле::text),
+# text_pattern_ops позволяет тому же индексу обслуживать и равенство, и LIKE 'префикс%' при любой локали.
+# Только PostgreSQL; индексы строятся CONCURRENTLY, чтобы не блокировать запись в большие таблицы.
+# У секционированной таблицы заказов (миграция 0021) так нельзя - там индекс строится обычным образом.
+SEARCH_INDEXES = (
+    ('product_slug_upper_idx', 'main_app_product', 'slug'),
+    ('product_title_upper_idx', 'main_app_product', 'title'),
+    ('customer_phone_upper_idx', 'main_app_customer', 'phone_number'),
+    ('order_phone_upper_idx', 'main_app_order', 'phone_number'),
+    ('order_last_name_upper_idx', 'main_app_order', 'last_name'),
+    ('productfeatures_value_upper_idx', 'specs_productfeatures', 'value'),
+    ('auth_user_username_upper_idx', 'auth_user', 'username'),
+    ('auth_user_email_upper_idx', 'auth_user', 'email'),
+)
+
+
+def is_partitioned(schema_editor, table):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        return cursor.fetchone()[0]
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        concurrently = '' if is_partitioned(schema_editor, table) else 'CONCURRENTLY'
+        schema_editor.execute(
+            f'CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, _ in SEARCH_INDEXES:
+        concurrently = '' if is_partitioned(schema_editor, table) else 'CONCURRENTLY'
+        schema_editor.execute(f'DROP INDEX {concurrently} IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('main_app', '0022_order_updated_at'),
+        ('specs', '0002_productfeatures'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
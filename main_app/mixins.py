@@ -1,31 +1,97 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import View
 
+from .cart import SessionCart
+from .catalog_cache import get_page_cache_key, render_fragments
 from .models import Cart, Customer
+from .utils import CartAlreadyOrderedError, apply_cart_operations
 
+CART_SESSION_KEY = 'cart'
 
-class CartMixin(View):
 
-    def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
+def get_customer_cart(request):
+    """
+    Корзина авторизованного пользователя.
+    Идентификаторы покупателя и корзины запоминаются в сессии, поэтому в обычном случае корзина
+    вместе с покупателем достается одним запросом с join, без отдельного запроса за Customer.
+    """
+    carts = Cart.objects.select_related('owner').filter(owner__user_id=request.user.id, in_order=False)
+    cached = request.session.get(CART_SESSION_KEY)
+    cart = None
+    if cached:
+        cart = carts.filter(id=cached['cart_id'], owner_id=cached['customer_id']).first()
+    if not cart:
+        # в сессии ничего нет или корзина уже ушла в заказ - ищем открытую корзину одним запросом
+        cart = carts.first()
+    if not cart:
+        customer = Customer.objects.filter(user=request.user).first()
+        if not customer:
+            customer = Customer.objects.create(user=request.user)
+        cart = Cart.objects.create(owner=customer)
+    if cached != {'customer_id': cart.owner_id, 'cart_id': cart.id}:
+        request.session[CART_SESSION_KEY] = {'customer_id': cart.owner_id, 'cart_id': cart.id}
+    return cart
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return get_customer_cart(request)
+    return SessionCart(request.session)
+
 
-            if not customer:
-                customer = Customer.objects.create(
-                    user=request.user
-                )
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
+def forget_cart(request):
+    """Сбрасывает закэшированную в сессии корзину, например после оформления заказа"""
+    request.session.pop(CART_SESSION_KEY, None)
 
-            if not cart:
-                cart = Cart.objects.create(owner=customer)
 
-        else:
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
+def change_customer_cart(request, cart, operations):
+    """
+    Применяет операции к корзине покупателя (см. apply_cart_operations). Если корзина, найденная в начале запроса,
+    тем временем ушла в заказ в соседней вкладке или удалена, открытая корзина покупателя ищется заново.
+    Возвращает (корзина, {id товара: строка корзины или None})
+    """
+    try:
+        return cart, apply_cart_operations(cart, operations)
+    except CartAlreadyOrderedError:
+        forget_cart(request)
+        cart = get_customer_cart(request)
+        return cart, apply_cart_operations(cart, operations)
 
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
 
-        self.cart = cart
+class CartMixin(View):
+
+    def dispatch(self, request, *args, **kwargs):
+        # корзина ленивая: запрос в базу уходит только когда view или шаблон обращается к ее полям
+        request.cart = SimpleLazyObject(lambda: get_cart(request))
+        self.cart = request.cart
         return super().dispatch(request, *args, **kwargs)
 
 
+class PageCacheMixin(View):
+    """
+    Кэш целых страниц каталога. Страница общая для всех посетителей и хранится с метками вместо
+    персональных кусков, которые заполняются после чтения из кэша (см. тег page_fragment).
+    """
 
+    page_cache_timeout = 60 * 15
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+        key = get_page_cache_key(request)
+        html = cache.get(key)
+        if html is not None:
+            return HttpResponse(render_fragments(request, html))
+        request.page_fragments = True
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        request.page_fragments = False
+        if response.status_code != 200 or response.streaming:
+            return response
+        html = response.content.decode(response.charset)
+        cache.set(key, html, self.page_cache_timeout)
+        response.content = render_fragments(request, html)
+        return response
@@ -12,6 +12,8 @@ class Category(models.Model):
     title = models.CharField(max_length=250, verbose_name='Наименование категории')
     slug = models.SlugField(unique=True)  # нужен для того, что бы у нас был некий конечный end point в нашей модели.
     # То есть чтобы мы могли перейти по ссылке ..../category/smartphones, вот smartphones и есть slug.
+    products_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество товаров')
+    # счетчик поддерживается сигналами при создании, удалении и переносе товаров между категориями
 
     def __str__(self):
         return self.title
@@ -40,9 +42,33 @@ class Product(models.Model):
     description = models.TextField(verbose_name='Описание продукта', null=True)
     price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
 
+    class Meta:
+        # индексы под постраничный вывод по ключу: поле сортировки + id для однозначного порядка
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='product_title_id_idx'),
+            models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_id_idx'),
+            models.Index(fields=['category', 'title', 'id'], name='product_category_title_id_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # запоминаем загруженные из базы значения, чтобы сигналы видели, что именно изменилось
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # после сохранения (и всех post_save сигналов) сохраненные значения становятся новой точкой отсчета
+        self._loaded_values = {
+            field.attname: field.get_prep_value(getattr(self, field.attname)) for field in self._meta.concrete_fields
+        }
+
     def get_model_name(self):
         return self.__class__.__name__.lower()
 
@@ -132,6 +158,12 @@ class CartProduct(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     total_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Всего к оплате')
 
+    class Meta:
+        constraints = [
+            # один товар - одна строка в корзине, дубли от параллельных запросов невозможны
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f'Product: {self.product.title} для корзины'
 
@@ -143,26 +175,41 @@ class CartProduct(models.Model):
 class Cart(models.Model):
     """Сама модель корзины"""
     owner = models.ForeignKey('Customer', null=True, verbose_name='Владелец', on_delete=models.CASCADE)
-    products = models.ManyToManyField(CartProduct, blank=True, related_name='related_cart')
-    # связь многие к многим к нашей модели CartProduct
-    # так же зададим related_name дабы различать поля в базе и можно было получать query сеты, например
-    # "cartproduct".related_cart.all() выдаст нам сет со всеми корзинами содержащими нужный нам продукт
-
+    # строки корзины хранятся только через CartProduct.cart: "cart".related_products.all()
     total_products = models.PositiveIntegerField(default=0)
     total_price = models.DecimalField(max_digits=9, default=0, decimal_places=2, verbose_name='Всего к оплате')
     in_order = models.BooleanField(default=False)
     for_anonymous_user = models.BooleanField(default=False)
+    # последнее изменение покупателем, по нему находятся брошенные корзины (python manage.py compact_carts)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['updated_at', 'id'], name='cart_open_updated_at', condition=models.Q(in_order=False)
+            ),
+        ]
 
     def __str__(self):
         return str(self.id)
 
+    @property
+    def items(self):
+        """Строки корзины вместе с товарами одним запросом"""
+        return self.related_products.select_related('product')
+
 
 class Customer(models.Model):
     """Модель пользователя"""
     user = models.ForeignKey(USER, verbose_name='Пользователь', on_delete=models.CASCADE)
     phone_number = models.CharField(max_length=11, verbose_name='Номер телефона', null=True, blank=True)
     address = models.CharField(max_length=250, verbose_name='Адрес', null=True, blank=True)
-    orders = models.ManyToManyField('Order', verbose_name='Заказы покупателя', related_name='related_customer')
+    # сводка по заказам обновляется при оформлении заказа (utils.place_order), а не пересчитывается при показе
+    orders_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество заказов')
+    orders_total = models.DecimalField(
+        max_digits=12, default=0, decimal_places=2, editable=False, verbose_name='Сумма всех заказов'
+    )
+    last_order_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Дата последнего заказа')
 
     def __str__(self):
         return f'Покупатель: {self.user.first_name}, {self.user.last_name}'
@@ -203,12 +250,41 @@ class Order(models.Model):
         max_length=100, verbose_name='Тип заказа', choices=BUYING_TYPE_CHOICES, default=BUYING_TYPE_SELF
     )
     comment = models.TextField(verbose_name='Комментарий к заказу', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True, verbose_name='Дата создания заказа')
+    total_products = models.PositiveIntegerField(default=0, verbose_name='Количество позиций')
+    total_price = models.DecimalField(max_digits=9, default=0, decimal_places=2, verbose_name='Сумма заказа')
+    # не меняется после создания: по created_at таблица секционирована (см. partitions.py)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания заказа')
+    # по нему отчеты находят дни с новыми и измененными заказами (см. reports/rollups.py)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения заказа')
     order_date = models.DateField(verbose_name='Дата получения заказа', default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # история заказов покупателя постранично по ключу (created_at, id)
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_id'),
+            # выборки за период; на PostgreSQL дополнительно отсекаются лишние секции
+            models.Index(fields=['created_at'], name='order_created_at'),
+            models.Index(fields=['updated_at'], name='order_updated_at'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
 
+class OrderLine(models.Model):
+    """
+    Строка заказа - снимок товара на момент оформления.
+    Название и цена копируются из товара, поэтому заказ не меняется при изменении каталога
+    и читается без обращения к корзине
+    """
+    # на PostgreSQL у секционированной таблицы заказов нет уникального индекса по одному id, поэтому миграция 0021
+    # снимает там ограничение внешнего ключа; каскадное удаление выполняет ORM
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='lines', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name='Товар', null=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=250, verbose_name='Наименование')
+    price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
+    quantity = models.PositiveIntegerField(default=1)
+    total_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Сумма')
 
-
+    def __str__(self):
+        return f'{self.title} x {self.quantity} для заказа {self.order_id}'
@@ -0,0 +1,118 @@
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Варианты сортировки товаров. Последнее поле всегда id - оно делает порядок однозначным
+PRODUCT_SORTING = {
+    'new': ('-id',),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'title': ('title', 'id'),
+}
+PRODUCT_SORTING_LABELS = (
+    ('new', 'Сначала новые'),
+    ('price', 'Сначала дешевле'),
+    ('-price', 'Сначала дороже'),
+    ('title', 'По названию'),
+)
+DEFAULT_PRODUCT_SORTING = 'new'
+# история заказов: сначала новые, по индексу order_customer_created_id
+ORDER_HISTORY_ORDERING = ('-created_at', '-id')
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Постраничный вывод по ключу (keyset/cursor pagination).
+    Вместо OFFSET следующая страница выбирается условием "после последней строки текущей страницы",
+    поэтому любая страница стоит одинаково и опирается на составной индекс по полям сортировки.
+    Курсор - подписанный токен с значениями полей сортировки, его нельзя подделать или разобрать на клиенте.
+    """
+
+    salt = 'keyset-pagination'
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def get_page(self, cursor=None):
+        position, backwards = self._decode(cursor)
+        ordering = self._reversed(self.ordering) if backwards else self.ordering
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else position is not None
+        return KeysetPage(
+            rows,
+            next_cursor=self._encode(rows[-1], backwards=False) if has_next else None,
+            previous_cursor=self._encode(rows[0], backwards=True) if has_previous else None,
+        )
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    def _after(self, ordering, position):
+        # (a, b, id) > (x, y, z) раскрывается в a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _encode(self, obj, backwards):
+        values = [getattr(obj, field) for field in self.fields]
+        return signing.dumps(
+            {'f': self.fields, 'v': [str(value) for value in values], 'b': backwards}, salt=self.salt, compress=True
+        )
+
+    def _decode(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            data = signing.loads(cursor, salt=self.salt)
+            model = self.queryset.model
+            position = [
+                model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, data['v'])
+            ]
+        except (signing.BadSignature, FieldDoesNotExist, ValidationError, KeyError, TypeError):
+            # битый или устаревший курсор - просто показываем первую страницу
+            return None, False
+        if data.get('f') != self.fields or len(position) != len(self.fields):
+            # курсор от другой сортировки
+            return None, False
+        return position, bool(data.get('b'))
@@ -0,0 +1,153 @@
+"""
+Помесячные секции таблицы заказов (PostgreSQL 12+).
+
+main_app_order секционирована по диапазонам created_at (PARTITION BY RANGE): секция на каждый месяц
+main_app_order_pYYYY_MM и секция по умолчанию для дат, под которые секции еще нет. Запросы с условием
+на created_at ("за последние 30 дней", история заказов по ключу (created_at, id)) читают только нужные секции.
+
+Таблицу секционирует миграция 0021. Первичный ключ секционированной таблицы обязан включать ключ
+секционирования - (id, created_at), поэтому уникального индекса по одному id нет и сослаться на заказ
+внешним ключом в базе нельзя: миграция снимает ограничение main_app_orderline.order_id, каскадное удаление
+строк заказа выполняет ORM, а при отключении секции ее строки заказов уходят в архив вместе с ней.
+
+Секции создаются заранее командой partition_orders. На остальных базах таблица обычная,
+внешний ключ строк заказа на месте, запросы за период обслуживает индекс order_created_at.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+ORDER_TABLE = 'main_app_order'
+ORDER_LINE_TABLE = 'main_app_orderline'
+DEFAULT_PARTITION = f'{ORDER_TABLE}_default'
+PARTITION_NAME_RE = re.compile(rf'^{ORDER_TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(value):
+    if timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def iter_months(start, end):
+    """Начала месяцев (UTC) с месяца start по месяц end включительно"""
+    month, last = month_start(start), month_start(end)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(month):
+    return f'{ORDER_TABLE}_p{month:%Y_%m}'
+
+
+def partition_bounds(month):
+    # границы в DDL - литералы, параметры запроса здесь не подставляются
+    return f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [ORDER_TABLE])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def create_partition(cursor, month):
+    """
+    Секция за месяц, если ее еще нет. Строки этого месяца, уже попавшие в секцию по умолчанию,
+    переносятся: новая таблица заполняется ими и только потом подключается как секция
+    """
+    name = partition_name(month)
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    if cursor.fetchone()[0]:
+        return False
+    start, end = month, add_months(month, 1)
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s)', [start, end]
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(f'CREATE TABLE {name} PARTITION OF {ORDER_TABLE} FOR VALUES {partition_bounds(month)}')
+        return True
+    cursor.execute(f'CREATE TABLE {name} (LIKE {ORDER_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute(f'ALTER TABLE {ORDER_TABLE} ATTACH PARTITION {name} FOR VALUES {partition_bounds(month)}')
+    return True
+
+
+def ensure_partitions(start, end, connection=default_connection):
+    """Недостающие секции с месяца start по месяц end. Каждая секция - своя короткая транзакция"""
+    if not is_partitioned(connection):
+        return []
+    created = []
+    for month in iter_months(start, end):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            if create_partition(cursor, month):
+                created.append(partition_name(month))
+    return created
+
+
+def split_default_partition(connection=default_connection):
+    """Выносит строки из секции по умолчанию в помесячные секции"""
+    if not is_partitioned(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION} "
+            f"WHERE created_at IS NOT NULL"
+        )
+        months = sorted(row[0].replace(tzinfo=dt_timezone.utc) for row in cursor.fetchall())
+    created = []
+    for month in months:
+        created += ensure_partitions(month, month, connection)
+    return created
+
+
+def list_partitions(connection=default_connection):
+    """[(имя секции, границы, примерное число строк)]"""
+    if not is_partitioned(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint '
+            'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass ORDER BY c.relname',
+            [ORDER_TABLE],
+        )
+        return cursor.fetchall()
+
+
+def detach_partitions_before(month, connection=default_connection):
+    """
+    Отключает секции месяцев раньше month. Таблицы секций остаются в базе для архивации,
+    но их заказы пропадают из магазина (сводка покупателей и витрины отчетов при этом не пересчитываются).
+    Строки этих заказов переносятся в таблицу <секция>_lines: без внешнего ключа в базе они иначе остались бы
+    в main_app_orderline, ссылаясь на заказы, которых в магазине уже нет
+    """
+    month = month_start(month)
+    detached = []
+    for name, _, _ in list_partitions(connection):
+        match = PARTITION_NAME_RE.match(name)
+        if match and datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc) < month:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f'CREATE TABLE {name}_lines (LIKE {ORDER_LINE_TABLE} INCLUDING DEFAULTS)')
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {ORDER_LINE_TABLE} WHERE order_id IN (SELECT id FROM {name}) '
+                    f'RETURNING *) INSERT INTO {name}_lines SELECT * FROM moved'
+                )
+                cursor.execute(f'ALTER TABLE {ORDER_TABLE} DETACH PARTITION {name}')
+            detached.append(name)
+    return detached
@@ -0,0 +1,243 @@
+"""
+Статистика запросов к базе и времени ответа по view (см. middleware.QueryStatsMiddleware).
+
+Каждый процесс копит гистограммы в памяти и раз в QUERY_STATS_FLUSH_INTERVAL секунд сливает их в кэш,
+в свой ключ query_stats:process:<номер>: номер процесса выдается атомарным cache.incr, и ключ пишет только
+его процесс. Данные процессов суммируются при чтении (load_stats), поэтому одновременные сбросы не затирают
+друг друга. Для нескольких процессов нужен общий кэш (redis, memcached).
+Гистограммы фиксированного размера, поэтому память не растет с числом запросов.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+# верхние границы корзин гистограмм, последняя корзина - все, что больше
+TIME_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377)
+# одинаковый SQL, выполненный за запрос столько раз и больше, - признак N+1
+REPEATED_QUERY_THRESHOLD = 5
+
+CACHE_PREFIX = 'query_stats'
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# счетчик выданных номеров процессов и поколение статистики (сдвигается при сбросе)
+PROCESSES_KEY = f'{CACHE_PREFIX}:processes'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+
+
+def process_key(number):
+    return f'{CACHE_PREFIX}:process:{number}'
+
+
+def incr_counter(key):
+    """Атомарное увеличение счетчика в кэше, счетчик создается при первом обращении"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+
+class Histogram:
+
+    def __init__(self, buckets, counts=None):
+        self.buckets = buckets
+        self.counts = counts or [0] * (len(buckets) + 1)
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+
+    def merge(self, counts):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+
+    def percentile(self, percent):
+        """Верхняя граница корзины, в которую попадает перцентиль. None - больше последней границы"""
+        total = sum(self.counts)
+        if not total:
+            return 0
+        rank = total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else None
+        return None
+
+
+class ViewStats:
+    """Накопленная статистика одного view"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.requests = data.get('requests', 0)
+        self.queries = Histogram(QUERY_BUCKETS, data.get('queries'))
+        self.db_time = Histogram(TIME_BUCKETS, data.get('db_time'))
+        self.wall_time = Histogram(TIME_BUCKETS, data.get('wall_time'))
+        self.max_queries = data.get('max_queries', 0)
+        self.min_queries = data.get('min_queries')
+        self.max_repeated = data.get('max_repeated', 0)
+        self.worst_sql = data.get('worst_sql', '')
+        self.total_db_time = data.get('total_db_time', 0.0)
+        self.total_wall_time = data.get('total_wall_time', 0.0)
+
+    def add(self, queries, db_time, wall_time, repeated, repeated_sql):
+        self.requests += 1
+        self.queries.add(queries)
+        self.db_time.add(db_time)
+        self.wall_time.add(wall_time)
+        self.max_queries = max(self.max_queries, queries)
+        self.min_queries = queries if self.min_queries is None else min(self.min_queries, queries)
+        if repeated > self.max_repeated:
+            self.max_repeated, self.worst_sql = repeated, repeated_sql
+        self.total_db_time += db_time
+        self.total_wall_time += wall_time
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.queries.merge(other.queries.counts)
+        self.db_time.merge(other.db_time.counts)
+        self.wall_time.merge(other.wall_time.counts)
+        self.max_queries = max(self.max_queries, other.max_queries)
+        if self.min_queries is None or (other.min_queries is not None and other.min_queries < self.min_queries):
+            self.min_queries = other.min_queries
+        if other.max_repeated > self.max_repeated:
+            self.max_repeated, self.worst_sql = other.max_repeated, other.worst_sql
+        self.total_db_time += other.total_db_time
+        self.total_wall_time += other.total_wall_time
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries.counts,
+            'db_time': self.db_time.counts,
+            'wall_time': self.wall_time.counts,
+            'max_queries': self.max_queries,
+            'min_queries': self.min_queries,
+            'max_repeated': self.max_repeated,
+            'worst_sql': self.worst_sql,
+            'total_db_time': self.total_db_time,
+            'total_wall_time': self.total_wall_time,
+        }
+
+    @property
+    def suspected_n_plus_one(self):
+        # один и тот же запрос повторяется в рамках одного запроса - число запросов растет вместе с данными
+        return self.max_repeated >= REPEATED_QUERY_THRESHOLD
+
+
+def normalize_sql(sql):
+    """
+    Приводит SQL к общему виду, чтобы одинаковые запросы совпадали:
+    числа и строки заменяются на ?, списки IN (%s, %s, ...) любой длины - на один параметр
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    sql = re.sub(r'%s(\s*,\s*%s)+', '%s', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class QueryCollector:
+    """Обертка для connection.execute_wrapper: считает запросы, их время и повторы одного и того же SQL"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += (time.perf_counter() - started) * 1000
+            self.count += 1
+            sql = normalize_sql(sql)
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def most_repeated(self):
+        if not self.statements:
+            return 0, ''
+        sql, count = max(self.statements.items(), key=lambda item: item[1])
+        return count, sql
+
+
+class StatsRecorder:
+    """Статистика текущего процесса с периодическим сбросом в кэш"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.views = {}
+        self.last_flush = time.monotonic()
+        self.pid = self.number = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'QUERY_STATS_FLUSH_INTERVAL', 30)
+
+    def record(self, view_name, collector, wall_time):
+        repeated, repeated_sql = collector.most_repeated()
+        with self.lock:
+            self.views.setdefault(view_name, ViewStats()).add(
+                collector.count, collector.time, wall_time, repeated, repeated_sql
+            )
+            if time.monotonic() - self.last_flush < self.flush_interval:
+                return
+            views, self.views = self.views, {}
+            self.last_flush = time.monotonic()
+        self.flush(views)
+
+    def flush(self, views):
+        """Добавляет статистику к ключу этого процесса. Другие процессы этот ключ не пишут"""
+        with self.flush_lock:
+            # после fork у процесса свой номер, а не номер родителя
+            if self.number is None or self.pid != os.getpid():
+                self.pid, self.number = os.getpid(), incr_counter(PROCESSES_KEY)
+            key = process_key(self.number)
+            generation = cache.get(GENERATION_KEY, 0)
+            stored = cache.get(key) or {}
+            # данные, записанные до сброса статистики, отбрасываются
+            stored_views = stored.get('views', {}) if stored.get('generation') == generation else {}
+            for view_name, stats in views.items():
+                merged = ViewStats(stored_views.get(view_name))
+                merged.merge(stats)
+                stored_views[view_name] = merged.to_dict()
+            cache.set(key, {'generation': generation, 'views': stored_views}, CACHE_TIMEOUT)
+
+
+recorder = StatsRecorder()
+
+
+def flush_current_process():
+    with recorder.lock:
+        views, recorder.views = recorder.views, {}
+        recorder.last_flush = time.monotonic()
+    recorder.flush(views)
+
+
+def stored_processes():
+    """Ключи всех процессов, когда-либо сбрасывавших статистику, и их данные"""
+    keys = [process_key(number) for number in range(1, (cache.get(PROCESSES_KEY) or 0) + 1)]
+    return keys, cache.get_many(keys)
+
+
+def load_stats():
+    """{имя view: ViewStats} - сумма данных всех процессов текущего поколения"""
+    generation = cache.get(GENERATION_KEY, 0)
+    stats = {}
+    for stored in stored_processes()[1].values():
+        if stored.get('generation') != generation:
+            continue
+        for view_name, data in stored['views'].items():
+            stats.setdefault(view_name, ViewStats()).merge(ViewStats(data))
+    return stats
+
+
+def reset_stats():
+    # процессы, уже прочитавшие старое поколение, запишут данные, которые load_stats пропустит
+    incr_counter(GENERATION_KEY)
+    cache.delete_many(stored_processes()[0])
@@ -0,0 +1,128 @@
+"""
+Маршрутизация запросов между основной базой и репликами (DATABASE_ROUTERS).
+
+На реплики уходит только чтение каталога (категории, товары, характеристики) и витрин отчетов в запросах,
+для которых ReplicaRoutingMiddleware разрешила реплики: GET/HEAD без недавних записей этого пользователя.
+Корзины, заказы, пользователи, сессии, фоновые задачи и команды всегда работают с основной базой.
+
+Чтение своих записей: после первой записи в запросе все чтение до конца запроса идет в основную базу,
+а cookie оставляет пользователя на основной базе еще REPLICA_PIN_SECONDS, пока реплики догоняют.
+Отставание: реплика, отставшая больше чем на REPLICA_MAX_LAG секунд или недоступная, исключается
+до следующей проверки (раз в REPLICA_CHECK_INTERVAL секунд). Сразу после изменения каталога
+страницы тоже строятся по основной базе, чтобы в кэш страниц с новой версией не попали старые данные.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# модели, которые можно читать с реплик: каталог и витрины отчетов меняются редко
+# и не относятся к одному пользователю
+REPLICA_APPS = {'specs', 'reports'}
+REPLICA_MODELS = {'main_app.category', 'main_app.product'}
+
+# отставание реплики PostgreSQL в секундах; 0, если реплика применила все полученные изменения
+POSTGRESQL_LAG_SQL = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+_local = Local()
+# {алиас реплики: (время проверки, можно ли читать)}
+_replica_checks = {}
+
+
+class RoutingState:
+    """Состояние маршрутизации текущего запроса"""
+
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.wrote = False
+        self.replica = None
+
+
+@contextmanager
+def routing_state(use_replicas):
+    previous = getattr(_local, 'state', None)
+    _local.state = state = RoutingState(use_replicas)
+    try:
+        yield state
+    finally:
+        _local.state = previous
+
+
+def get_replicas():
+    return [alias for alias in getattr(settings, 'REPLICA_DATABASES', ()) if alias in settings.DATABASES]
+
+
+def replica_lag(alias):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # локально "реплика" - та же база под другим алиасом
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRESQL_LAG_SQL)
+        lag = cursor.fetchone()[0]
+    # NULL - база не реплика (например, локально алиас указывает на основную)
+    return float(lag or 0)
+
+
+def replica_is_fresh(alias):
+    checked_at, fresh = _replica_checks.get(alias, (None, False))
+    if checked_at is not None and time.monotonic() - checked_at < getattr(settings, 'REPLICA_CHECK_INTERVAL', 5):
+        return fresh
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError:
+        logger.warning('Реплика %s недоступна, чтение идет в основную базу', alias, exc_info=True)
+        fresh = False
+    else:
+        fresh = lag <= getattr(settings, 'REPLICA_MAX_LAG', 2)
+        if not fresh:
+            logger.warning('Реплика %s отстает на %.1f c, чтение идет в основную базу', alias, lag)
+    _replica_checks[alias] = (time.monotonic(), fresh)
+    return fresh
+
+
+def is_replica_model(model):
+    return model._meta.app_label in REPLICA_APPS or model._meta.label_lower in REPLICA_MODELS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = getattr(_local, 'state', None)
+        if state is None or not state.use_replicas or state.wrote or not is_replica_model(model):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # внутри транзакции читаем то же, что пишем
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            # одна реплика на весь запрос, чтобы страница не собиралась из данных разной свежести
+            replicas = [alias for alias in get_replicas() if replica_is_fresh(alias)]
+            state.replica = random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = getattr(_local, 'state', None)
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплик приходит с основной базы
+        if db in get_replicas():
+            return False
+        return None
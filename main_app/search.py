@@ -0,0 +1,137 @@
+"""
+Полнотекстовый поиск по товарам: название, описание и значения характеристик.
+
+На PostgreSQL у таблицы товаров есть колонка search_vector (tsvector) с GIN-индексом,
+на SQLite - отдельная виртуальная таблица FTS5. Обе создаются миграцией 0015 и
+обновляются точечно при сохранении товара или его характеристик (см. signals.py).
+"""
+import re
+
+from django.db import connection
+
+from .models import Product
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'main_app_product_fts'
+# id в одном запросе к FTS5: старые сборки SQLite принимают не больше 999 параметров
+SEARCH_BATCH_SIZE = 500
+
+POSTGRES_DOCUMENT = f"""
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.title, '')), 'A') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.description, '')), 'B') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(
+        (SELECT string_agg(f.value, ' ') FROM specs_productfeatures f WHERE f.product_id = p.id), ''
+    )), 'C')
+"""
+
+
+def update_search_index(product_ids):
+    """Переиндексирует только переданные товары. Удаленные товары просто пропадают из индекса"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'UPDATE main_app_product p SET search_vector = {POSTGRES_DOCUMENT} WHERE p.id = ANY(%s)',
+                [product_ids]
+            )
+        elif connection.vendor == 'sqlite':
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(f"""
+                INSERT INTO {FTS_TABLE} (rowid, title, description, features)
+                SELECT p.id, p.title, coalesce(p.description, ''),
+                       coalesce((SELECT group_concat(f.value, ' ') FROM specs_productfeatures f
+                                 WHERE f.product_id = p.id), '')
+                FROM main_app_product p WHERE p.id IN ({placeholders})
+            """, product_ids)
+
+
+def rebuild_search_index(batch_size=SEARCH_BATCH_SIZE):
+    """Полная переиндексация пачками, например после массового импорта"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM main_app_product)')
+    batch = []
+    for product_id in Product.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size):
+        batch.append(product_id)
+        if len(batch) >= batch_size:
+            update_search_index(batch)
+            batch = []
+    update_search_index(batch)
+
+
+def _fts5_query(query):
+    # каждое слово в кавычках и с префиксным поиском, чтобы пользовательский ввод не ломал синтаксис FTS5
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchResults:
+    """
+    Результаты поиска, отсортированные по релевантности.
+    Поддерживает count() и срезы, поэтому подходит для обычного django Paginator:
+    из базы читается только запрошенная страница.
+    """
+
+    def __init__(self, query):
+        self.query = query.strip()
+        self.vendor = connection.vendor
+        self._count = None
+
+    def _match(self):
+        if self.vendor == 'postgresql':
+            return (
+                f"FROM main_app_product p, plainto_tsquery('{SEARCH_CONFIG}', %s) q WHERE p.search_vector @@ q",
+                [self.query],
+                'ts_rank(p.search_vector, q) DESC, p.id',
+                'p.id',
+            )
+        if self.vendor == 'sqlite':
+            return (
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                [_fts5_query(self.query)],
+                f'bm25({FTS_TABLE}, 10.0, 3.0, 1.0), rowid',
+                'rowid',
+            )
+        return None
+
+    def count(self):
+        if self._count is None:
+            match = self._match()
+            if not self.query or (self.vendor == 'sqlite' and not _fts5_query(self.query)):
+                self._count = 0
+            elif match is None:
+                self._count = self._fallback().count()
+            else:
+                sql, params, _, _ = match
+                with connection.cursor() as cursor:
+                    cursor.execute(f'SELECT count(*) {sql}', params)
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def _fallback(self):
+        return Product.objects.filter(title__icontains=self.query).order_by('id')
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop
+        if not self.count():
+            return []
+        match = self._match()
+        if match is None:
+            return list(self._fallback()[start:stop])
+        sql, params, order_by, id_column = match
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {id_column} {sql} ORDER BY {order_by} LIMIT %s OFFSET %s',
+                params + [stop - start, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        products = Product.objects.in_bulk(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
@@ -0,0 +1,102 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from specs.models import CategoryFeature, ProductFeatures
+from .cart import SESSION_CART_KEY
+from .catalog_cache import bump_catalog_version
+from .images import VARIANTS_FAILED, forget_variants_state, get_variants_state, schedule_variants
+from .models import Category, Product
+from .search import update_search_index
+from .mixins import get_customer_cart
+from .utils import CartLimitError, merge_session_cart, schedule_cart_repricing
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """После входа анонимная корзина из сессии переносится в корзину покупателя"""
+    if request is None or not hasattr(request, 'session'):
+        return
+    lines = request.session.pop(SESSION_CART_KEY, None)
+    if lines:
+        try:
+            merge_session_cart(get_customer_cart(request), lines)
+        except CartLimitError:
+            # вход не должен падать из-за корзины: анонимная корзина остается в сессии
+            request.session[SESSION_CART_KEY] = lines
+
+
+def change_products_count(category_id, delta):
+    Category.objects.filter(pk=category_id).update(products_count=F('products_count') + delta)
+
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(sender, instance, created, raw=False, **kwargs):
+    """Счетчики товаров в категориях меняются на единицу, без COUNT по всей категории"""
+    if raw:
+        return
+    loaded_category_id = getattr(instance, '_loaded_values', {}).get('category_id')
+    if created:
+        change_products_count(instance.category_id, 1)
+    elif loaded_category_id is not None and loaded_category_id != instance.category_id:
+        change_products_count(loaded_category_id, -1)
+        change_products_count(instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, instance, **kwargs):
+    change_products_count(instance.category_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductFeatures)
+@receiver([post_save, post_delete], sender=CategoryFeature)
+def invalidate_catalog_pages(sender, **kwargs):
+    """
+    Любое изменение каталога сдвигает его версию и тем самым сбрасывает кэш страниц.
+    Версия сдвигается после коммита: иначе параллельный запрос успеет закэшировать старые данные под новой версией.
+    Приемник подключен после счетчиков товаров: вне транзакции on_commit срабатывает сразу,
+    и меню (context_processors.navigation) должно закэшироваться уже с новыми products_count
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def update_product_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # после удаления django обнуляет instance.pk, поэтому id запоминается сразу
+        product_id = instance.pk
+        transaction.on_commit(lambda: update_search_index([product_id]))
+
+
+@receiver([post_save, post_delete], sender=ProductFeatures)
+def update_features_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: update_search_index([instance.product_id]))
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants(sender, instance, created, raw=False, **kwargs):
+    """Уменьшенные копии картинки готовятся в фоне, только если картинка новая или поменялась"""
+    if raw or not instance.image:
+        return
+    loaded_image = getattr(instance, '_loaded_values', {}).get('image')
+    if created or loaded_image != instance.image.name:
+        schedule_variants(instance.image.name)
+    elif get_variants_state(instance.image.name) == VARIANTS_FAILED:
+        # оригинал могли заменить под тем же именем - следующий показ страницы попробует снова
+        forget_variants_state(instance.image.name)
+
+
+@receiver(post_save, sender=Product)
+def reprice_open_carts(sender, instance, created, raw=False, **kwargs):
+    """При изменении цены открытые корзины с этим товаром пересчитываются после коммита"""
+    if raw or created:
+        return
+    loaded_price = getattr(instance, '_loaded_values', {}).get('price')
+    price_field = sender._meta.get_field('price')
+    if loaded_price is not None and price_field.to_python(loaded_price) != price_field.to_python(instance.price):
+        transaction.on_commit(lambda: schedule_cart_repricing([instance.pk]))
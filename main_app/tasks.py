@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+# Небольшой пул потоков для работы, которую не нужно делать в рамках запроса:
+# генерация картинок, пересчеты и т.п. Задачи ставятся только после коммита транзакции,
+# чтобы фоновый поток гарантированно видел сохраненные данные.
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BACKGROUND_WORKERS', 2))
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # у каждого потока свои соединения с базой, закрываем их, чтобы не копились
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    transaction.on_commit(lambda: executor.submit(_run, func, args, kwargs))
@@ -0,0 +1,18 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from main_app.catalog_cache import FRAGMENT_PLACEHOLDER
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def page_fragment(context, template_name):
+    """
+    Персональный кусок страницы. Если страница рендерится для кэша, вместо него выводится метка,
+    которая заполняется уже после чтения из кэша для конкретного пользователя
+    """
+    request = context.get('request')
+    if getattr(request, 'page_fragments', False):
+        return mark_safe(FRAGMENT_PLACEHOLDER.format(template_name))
+    return context.template.engine.get_template(template_name).render(context)
@@ -0,0 +1,25 @@
+from django import template
+
+from main_app.images import get_variant_url
+
+register = template.Library()
+
+
+@register.inclusion_tag('product_picture.html')
+def product_picture(product, size='listing', css_class='img-fluid'):
+    """
+    <picture> с уменьшенными копиями картинки товара: webp и jpg, 1x и 2x.
+    Пример: {% product_picture product 'detail' 'img-fluid' %}
+    """
+    context = {'src': product.image.url if product.image else '', 'alt': product.title, 'css_class': css_class}
+    srcset = {}
+    for extension in ('jpg', 'webp'):
+        normal = get_variant_url(product.image, size, extension)
+        retina = get_variant_url(product.image, f'{size}_2x', extension)
+        if normal and retina:
+            srcset[extension] = f'{normal} 1x, {retina} 2x'
+    if 'jpg' in srcset:
+        context['src'] = get_variant_url(product.image, size, 'jpg')
+        context['srcset'] = srcset['jpg']
+    context['webp_srcset'] = srcset.get('webp')
+    return context
@@ -1,11 +1,44 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
 from unittest import mock
-from django.test import TestCase, RequestFactory
+from django.db import connection, router
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils import timezone
 
-from .models import Category, Notebook, CartProduct, Cart, Customer
-from .views import recalculate_cart, AddToCartView, BaseView
+from specs.models import CategoryFeature, ProductFeatures
+from .models import Category, Product, CartProduct, Cart, Customer, Order
+from .cart import SessionCart
+from .catalog_cache import bump_catalog_version
+from .cart_compaction import CartCompactor
+from .catalog_export import export_catalog
+from .catalog_import import CatalogImporter, CatalogValidator, RowError
+from .context_processors import get_navigation_categories
+from .data_generator import DataGenerator
+from .images import get_variant_url
+from .pagination import PRODUCT_SORTING, KeysetPaginator
+from .partitions import add_months, iter_months, month_start, partition_bounds
+from .query_stats import QueryCollector, StatsRecorder, ViewStats, load_stats, reset_stats
+from .routers import routing_state
+from .search import SearchResults, rebuild_search_index
+from .utils import (
+    CART_ADD, MAX_CART_QUANTITY, CartAlreadyOrderedError, EmptyCartError, add_to_cart, apply_cart_operations,
+    change_cart_product_quantity, change_products_price, get_drifted_carts, move_products,
+    place_order, recalculate_cart, reprice_carts, schedule_cart_repricing,
+)
+from .views import AddToCartView, BaseView, ProductDetailView
 
 User = get_user_model()
 
@@ -16,41 +49,118 @@ class ShopTestCases(TestCase):
         self.user = User.objects.create(username='testuser', password='testuser')
         self.category = Category.objects.create(title='Ноутбуки', slug='notebooks')
         image = SimpleUploadedFile('notebook_image.jpg', content=b'', content_type='image/jpg')
-        self.notebook = Notebook.objects.create(
+        self.notebook = Product.objects.create(
             category=self.category,
             title='Huawei MateBook 13',
             slug='huawei_matebook_13',
             image=image,
             price=Decimal('50000.00'),
-            diagonal='13',
-            display_type='IPS',
-            cpu_freq='2300 MHz',
-            ram='8 GB',
-            gpu='Radeon Vega',
-            time_without_charge='10 hours'
         )
         self.customer = Customer.objects.create(user=self.user, phone_number='123456789', address='sdgklfjkldj', )
         self.cart = Cart.objects.create(owner=self.customer)
         self.cart_product = CartProduct.objects.create(
             customer=self.customer,
             cart=self.cart,
-            content_object=self.notebook
+            product=self.notebook
         )
 
     def test_add_to_cart(self):
-        self.cart.products.add(self.cart_product)
         recalculate_cart(self.cart)
-        self.assertIn(self.cart_product, self.cart.products.all())
-        self.assertEqual(self.cart.products.count(), 1)
+        self.assertIn(self.cart_product, self.cart.related_products.all())
+        self.assertEqual(self.cart.related_products.count(), 1)
         self.assertEqual(self.cart.total_price, Decimal('50000.00'))
 
+    def test_cart_totals_follow_deltas_and_reconcile(self):
+        cart = Cart.objects.create(owner=self.customer)
+        add_to_cart(cart, self.notebook, 2)
+        change_cart_product_quantity(cart, self.notebook, 3)
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_price, cart.total_products), (Decimal('150000.00'), 1))
+        self.assertFalse(get_drifted_carts(Cart.objects.filter(pk=cart.pk)).exists())
+
+        ordered = Cart.objects.create(owner=self.customer)
+        add_to_cart(ordered, self.notebook)
+        place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), ordered)
+        Cart.objects.filter(pk__in=[cart.pk, ordered.pk]).update(total_price=Decimal('1.00'), total_products=5)
+        updated_at = Cart.objects.get(pk=cart.pk).updated_at
+        self.assertEqual(get_drifted_carts().filter(pk=cart.pk).count(), 1)
+        call_command('reconcile_carts', '--fix', '--all', stdout=io.StringIO())
+        cart.refresh_from_db()
+        ordered.refresh_from_db()
+        self.assertEqual((cart.total_price, cart.total_products), (Decimal('150000.00'), 1))
+        self.assertEqual(cart.updated_at, updated_at)
+        # пересчет пишет только итоги: корзина, ушедшая в заказ, остается в заказе
+        self.assertEqual((ordered.total_price, ordered.in_order), (Decimal('50000.00'), True))
+        self.assertFalse(get_drifted_carts(Cart.objects.all()).exists())
+
+    def test_place_order_snapshots_lines(self):
+        recalculate_cart(self.cart)
+        order = Order(customer=self.customer, first_name='Иван', last_name='Иванов', phone_number='123456789')
+        place_order(order, self.cart)
+        self.notebook.price = Decimal('60000.00')
+        self.notebook.save()
+        line = order.lines.get()
+        self.assertEqual((line.title, line.price, line.quantity), ('Huawei MateBook 13', Decimal('50000.00'), 1))
+        self.assertEqual(order.total_price, Decimal('50000.00'))
+        self.cart.refresh_from_db()
+        self.assertTrue(self.cart.in_order)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.orders_count, self.customer.orders_total), (1, Decimal('50000.00')))
+
+    def test_place_order_rejects_empty_cart(self):
+        empty = Cart.objects.create(owner=self.customer)
+        with self.assertRaises(EmptyCartError):
+            place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), empty)
+        self.assertFalse(Order.objects.exists())
+        empty.refresh_from_db()
+        self.assertFalse(empty.in_order)
+
+    def test_place_order_twice_on_one_cart(self):
+        recalculate_cart(self.cart)
+        place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), self.cart)
+        # повторная отправка формы с той же корзиной, загруженной до первого заказа
+        stale = Cart.objects.get(pk=self.cart.pk)
+        stale.in_order = False
+        with self.assertRaises(CartAlreadyOrderedError):
+            place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), stale)
+        self.assertEqual(Order.objects.count(), 1)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.orders_count, self.customer.orders_total), (1, Decimal('50000.00')))
+
+    def test_change_products_price_rounds_and_rejects_overflow(self):
+        products = Product.objects.filter(pk=self.notebook.pk)
+        change_products_price(products, Decimal('3.333'))
+        self.notebook.refresh_from_db()
+        self.assertEqual(self.notebook.price, Decimal('51666.50'))
+        # процент вне диапазона и цена, не помещающаяся в numeric(9, 2), - ValueError, а не ошибка базы
+        with self.assertRaises(ValueError):
+            change_products_price(products, 5000)
+        products.update(price=Decimal('6000000.00'))
+        with self.assertRaises(ValueError):
+            change_products_price(products, 100)
+        self.assertTrue(products.filter(price=Decimal('6000000.00')).exists())
+
+    def test_move_products_shifts_category_counters(self):
+        target = Category.objects.create(title='Планшеты', slug='tablets')
+        Product.objects.create(category=self.category, title='Ноутбук 2', slug='notebook_2', price=Decimal('1'))
+        Product.objects.create(category=target, title='Планшет', slug='tablet', price=Decimal('1'))
+        products = Product.objects.filter(slug__in=['notebook_2', 'tablet'])
+        # подсчет по исходным категориям, перенос и по UPDATE на каждую затронутую категорию, без пересчета всех
+        with self.assertNumQueries(6):
+            self.assertEqual(move_products(products, target), 2)
+        counts = dict(Category.objects.values_list('slug', 'products_count'))
+        self.assertEqual(counts, {'notebooks': 1, 'tablets': 2})
+
     def test_response_from_add_to_cart_view(self):
         factory = RequestFactory()
         request = factory.get('')
         request.user = self.user
-        response = AddToCartView.as_view()(request, ct_model='notebook', slug='huawei_matebook_13')
+        request.session = SessionStore()
+        response = AddToCartView.as_view()(request, slug='huawei_matebook_13')
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, '/cart/')
+        # повторное добавление увеличивает количество в той же строке, а не создает новую
+        self.assertEqual(self.cart.related_products.get().quantity, 2)
 
     def test_mock_homepage(self):
         mock_data = mock.Mock(status_code=444)
@@ -61,5 +171,573 @@ class ShopTestCases(TestCase):
             response = BaseView.as_view()(request)
             self.assertEqual(response.status_code, 444)
 
+    def test_query_collector_detects_repeated_queries(self):
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            for cart_product in CartProduct.objects.all():
+                cart_product.product.title
+            Product.objects.filter(id__in=[1, 2, 3]).count()
+            Product.objects.filter(id__in=[4]).count()
+        self.assertEqual(collector.count, 4)
+        # запросы с разными id и разной длиной списка IN считаются одним и тем же SQL
+        self.assertEqual(collector.most_repeated()[0], 2)
+
+    def test_navigation_counts_follow_product_changes(self):
+        get_navigation_categories()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=self.category, title='Ноутбук 2', slug='notebook_2', price=Decimal('1'))
+        # версия каталога сдвигается после коммита и обновления счетчика, меню не остается со старым числом
+        self.assertEqual(get_navigation_categories()[0].products_count, 2)
+
+    def test_missing_original_is_not_rescheduled_on_every_render(self):
+        product = Product(image='missing.jpg')
+        with mock.patch('main_app.images.run_in_background', side_effect=lambda func, *args: func(*args)) as run:
+            self.assertIsNone(get_variant_url(product.image, 'listing'))
+            self.assertIsNone(get_variant_url(product.image, 'listing'))
+        # генерация упала один раз, повторно картинка в очередь не ставится
+        self.assertEqual(run.call_count, 1)
+
+    def test_compact_carts_removes_only_abandoned(self):
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=timezone.now() - timedelta(days=31))
+        ordered = Cart.objects.create(owner=self.customer)
+        add_to_cart(ordered, self.notebook)
+        place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), ordered)
+        Cart.objects.filter(pk=ordered.pk).update(updated_at=timezone.now() - timedelta(days=31))
+        fresh = Cart.objects.create(owner=self.customer)
+        compactor = CartCompactor(30, pause=0)
+        compactor.run()
+        self.assertEqual((compactor.carts, compactor.lines), (1, 1))
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {ordered.pk, fresh.pk})
+
+
+class CartApiTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='buyer')
+        self.customer = Customer.objects.create(user=self.user)
+        self.cart = Cart.objects.create(owner=self.customer)
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.products = {
+            slug: Product.objects.create(category=category, title=slug, slug=slug, image='notebook.jpg', price=price)
+            for slug, price in [('a', Decimal('100.00')), ('b', Decimal('50.00')), ('c', Decimal('10.00'))]
+        }
+        add_to_cart(self.cart, self.products['a'], 2)
+        self.client.force_login(self.user)
+
+    def post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def test_batch_applies_operations_in_order(self):
+        response = self.post_json(reverse('api_cart_batch'), {'operations': [
+            {'op': 'add', 'product': 'a', 'quantity': 3},
+            {'op': 'set', 'product': 'a', 'quantity': 4},
+            {'op': 'remove', 'product': 'b'},
+            {'op': 'add', 'product': 'b'},
+            # удаление товара, которого нет в корзине, не ошибка
+            {'op': 'remove', 'product': 'c'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual({line['product']: line['quantity'] for line in data['lines']}, {'a': 4, 'b': 1, 'c': 0})
+        self.assertEqual(data['cart'], {'total_products': 2, 'total_price': '450.00'})
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_products, self.cart.total_price), (2, Decimal('450.00')))
+        self.assertFalse(get_drifted_carts().exists())
+
+    def test_change_after_checkout_goes_to_open_cart(self):
+        self.client.get(reverse('api_cart'))
+        place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), self.cart)
+        with self.assertRaises(CartAlreadyOrderedError):
+            apply_cart_operations(self.cart, [(CART_ADD, self.products['b'], 1)])
+        # в сессии еще корзина, ушедшая в заказ: добавление попадает в новую открытую корзину, а не теряется
+        response = self.client.post(reverse('api_add_to_cart', args=['b']))
+        self.assertEqual(response.json()['cart'], {'total_products': 1, 'total_price': '50.00'})
+        self.assertEqual(self.cart.related_products.get().product, self.products['a'])
+        open_cart = Cart.objects.get(owner=self.customer, in_order=False)
+        self.assertEqual(open_cart.related_products.get().product, self.products['b'])
+
+    def test_quantity_is_bounded(self):
+        too_many = MAX_CART_QUANTITY + 1
+        response = self.client.post(reverse('api_change_quantity', args=['a']), {'quantity': 10 ** 12})
+        self.assertEqual(response.status_code, 400)
+        response = self.post_json(
+            reverse('api_cart_batch'), {'operations': [{'op': 'add', 'product': 'a', 'quantity': too_many}]}
+        )
+        self.assertEqual(response.status_code, 400)
+        # сумма строки, не помещающаяся в numeric(9, 2), - тоже 400, а не ошибка базы
+        Product.objects.filter(slug='a').update(price=Decimal('9999999.00'))
+        response = self.client.post(reverse('api_change_quantity', args=['a']), {'quantity': 2})
+        self.assertEqual(response.status_code, 400)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal('200.00'))
+
+
+class CartRepricingTestCases(TestCase):
+
+    def setUp(self) -> None:
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.product = Product.objects.create(
+            category=category, title='Ноутбук', slug='notebook', image='notebook.jpg', price=Decimal('10.00')
+        )
+        self.products = Product.objects.filter(pk=self.product.pk)
+        self.customer = Customer.objects.create(user=User.objects.create(username='buyer'))
+        self.carts = [Cart.objects.create(owner=self.customer) for _ in range(3)]
+        for cart in self.carts:
+            add_to_cart(cart, self.product, 3)
+        place_order(Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), self.carts[0])
+        self.ordered, self.open_carts = self.carts[0], self.carts[1:]
+
+    def assert_totals(self, cart, line_total, cart_total):
+        cart.refresh_from_db()
+        self.assertEqual(cart.related_products.get().total_price, Decimal(line_total))
+        self.assertEqual(cart.total_price, Decimal(cart_total))
+
+    def test_price_change_reprices_open_carts_inline(self):
+        # 10.00 * 1.33333 = 13.3333 -> 13.33 в самом UPDATE, строка корзины 3 * 13.33
+        self.assertEqual(change_products_price(self.products, Decimal('33.333')), (1, 2))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, Decimal('13.33'))
+        for cart in self.open_carts:
+            self.assert_totals(cart, '39.99', '39.99')
+        # корзина, ушедшая в заказ, не пересчитывается
+        self.assert_totals(self.ordered, '30.00', '30.00')
+        self.assertEqual(reprice_carts([self.product.pk]), 0)
+
+    def test_rejected_price_change_leaves_carts_alone(self):
+        for percent in [-100, 1001]:
+            with self.assertRaises(ValueError):
+                change_products_price(self.products, percent)
+        self.products.update(price=Decimal('5000000.00'))
+        with self.assertRaises(ValueError):
+            change_products_price(self.products, 100)
+        self.assertEqual(self.products.get().price, Decimal('5000000.00'))
+        self.assert_totals(self.open_carts[0], '30.00', '30.00')
+
+    @mock.patch('main_app.utils.REPRICE_INLINE_LIMIT', 1)
+    def test_many_stale_lines_are_repriced_in_background(self):
+        self.products.update(price=Decimal('20.00'))
+        with mock.patch('main_app.utils.run_in_background') as run_in_background:
+            self.assertIsNone(schedule_cart_repricing([self.product.pk]))
+        func, product_ids = run_in_background.call_args.args
+        self.assert_totals(self.open_carts[0], '30.00', '30.00')
+        self.assertEqual(func(product_ids), 2)
+        self.assert_totals(self.open_carts[0], '60.00', '60.00')
+        self.assertEqual(schedule_cart_repricing([]), 0)
+
+
+@mock.patch('main_app.images.run_in_background')
+class SearchTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.feature = CategoryFeature.objects.create(
+            category=self.category, feature_name='Экран', feature_filter_name='screen'
+        )
+
+    def create_product(self, slug, title, description=''):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                category=self.category, title=title, slug=slug, description=description, image='notebook.jpg',
+                price=Decimal('100.00'),
+            )
+
+    @staticmethod
+    def search(query):
+        return [product.slug for product in SearchResults(query)[:10]]
+
+    def test_index_follows_product_changes(self, run_in_background):
+        product = self.create_product('thinkpad', 'Lenovo ThinkPad', 'Легкий ноутбук')
+        oled = self.create_product('oled', 'OLED Yoga')
+        self.assertEqual(self.search('thinkpad'), ['thinkpad'])
+        # характеристики тоже ищутся, но совпадение в названии важнее
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(product=product, feature=self.feature, value='OLED')
+        self.assertEqual(self.search('oled'), ['oled', 'thinkpad'])
+        self.assertEqual(SearchResults('oled').count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.title = 'Lenovo IdeaPad'
+            product.save()
+        self.assertEqual(self.search('thinkpad'), [])
+        self.assertEqual(self.search('ideapad'), ['thinkpad'])
+        with self.captureOnCommitCallbacks(execute=True):
+            oled.delete()
+        # из индекса пропадает сам товар, а не только его строка в выдаче
+        self.assertEqual(SearchResults('oled').count(), 1)
+        self.assertEqual(self.search('oled'), ['thinkpad'])
+        self.assertEqual(self.search('""'), [])
+
+    def test_rebuild_search_index(self, run_in_background):
+        Product.objects.bulk_create([
+            Product(category=self.category, title=f'Ноутбук Asus {index}', slug=f'asus-{index}', price=Decimal('1'))
+            for index in range(3)
+        ])
+        self.assertEqual(SearchResults('asus').count(), 0)
+        rebuild_search_index(batch_size=2)
+        self.assertEqual(sorted(self.search('asus')), ['asus-0', 'asus-1', 'asus-2'])
+
+
+@mock.patch('main_app.images.run_in_background')
+class PageCacheTestCases(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.product = Product.objects.create(
+            category=category, title='Ноутбук', slug='notebook', image='notebook.jpg', price=Decimal('100.00')
+        )
+        self.url = reverse('product_detail', args=['notebook'])
+        self.alice = User.objects.create(username='alice')
+        cart = Cart.objects.create(owner=Customer.objects.create(user=self.alice))
+        add_to_cart(cart, self.product, 3)
+        self.bob = User.objects.create(username='bob')
+
+    def get_page(self, user=None):
+        self.client.logout()
+        if user:
+            self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_cached_page_has_no_other_users_fragments(self, run_in_background):
+        page = self.get_page(self.alice)
+        self.assertIn('alice', page)
+        self.assertIn('badge-danger">1<', page)
+        # дальше страница отдается из кэша: view ее больше не строит
+        with mock.patch.object(ProductDetailView, 'get_object', side_effect=AssertionError('страница не из кэша')):
+            page = self.get_page(self.bob)
+            self.assertIn('bob', page)
+            self.assertNotIn('alice', page)
+            self.assertIn('badge-danger">0<', page)
+            page = self.get_page()
+            self.assertNotIn('alice', page)
+            self.assertNotIn('bob', page)
+            self.assertIn('Авторизация', page)
+
+    def test_bump_catalog_version_invalidates_pages(self, run_in_background):
+        self.assertIn('Ноутбук', self.get_page())
+        Product.objects.filter(pk=self.product.pk).update(title='Планшет')
+        self.assertNotIn('Планшет', self.get_page())
+        bump_catalog_version()
+        self.assertIn('Планшет', self.get_page())
+        # сохранение товара сдвигает версию каталога после коммита
+        self.product.refresh_from_db()
+        self.product.title = 'Смартфон'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertIn('Смартфон', self.get_page())
+
+
+class KeysetPaginatorTestCases(TestCase):
+
+    def setUp(self) -> None:
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        # одинаковые цены и названия: порядок внутри них задает id
+        for index, (title, price) in enumerate([
+            ('b', '10'), ('a', '10'), ('b', '10'), ('a', '20'), ('c', '20'), ('a', '10'), ('c', '30'),
+        ]):
+            Product.objects.create(
+                category=category, title=title, slug=f'p{index}', image='notebook.jpg', price=Decimal(price)
+            )
+        self.products = Product.objects.all()
+
+    def test_every_sorting_round_trips_forward_and_backward(self):
+        for sort, ordering in PRODUCT_SORTING.items():
+            with self.subTest(sort=sort):
+                expected = list(self.products.order_by(*ordering).values_list('id', flat=True))
+                paginator = KeysetPaginator(self.products, ordering, per_page=3)
+                pages = [paginator.get_page()]
+                while pages[-1].has_next:
+                    pages.append(paginator.get_page(pages[-1].next_cursor))
+                self.assertEqual([product.id for page in pages for product in page], expected)
+                self.assertFalse(pages[0].has_previous)
+                backward = [pages[-1]]
+                while backward[-1].has_previous:
+                    backward.append(paginator.get_page(backward[-1].previous_cursor))
+                # назад от последней страницы - те же товары в том же порядке, без пропусков и повторов
+                self.assertEqual([product.id for page in reversed(backward) for product in page], expected)
+
+    def test_invalid_cursors_fall_back_to_first_page(self):
+        paginator = KeysetPaginator(self.products, PRODUCT_SORTING['price'], per_page=3)
+        first = [product.id for product in paginator.get_page()]
+        cursor = paginator.get_page().next_cursor
+        title_cursor = KeysetPaginator(self.products, PRODUCT_SORTING['title'], per_page=3).get_page().next_cursor
+        salt = KeysetPaginator.salt
+        cursors = [
+            cursor[:-2] + ('aa' if not cursor.endswith('aa') else 'bb'),
+            'not-a-cursor',
+            # курсор другой сортировки
+            title_cursor,
+            signing.dumps({'f': ['price', 'id'], 'v': ['дорого', '1'], 'b': False}, salt=salt),
+            signing.dumps({'f': ['price', 'id'], 'v': ['10'], 'b': False}, salt=salt),
+            signing.dumps({'f': ['price', 'id'], 'v': 5, 'b': False}, salt=salt),
+            signing.dumps(['price', 'id'], salt=salt),
+        ]
+        for bad in cursors:
+            with self.subTest(cursor=bad):
+                self.assertEqual([product.id for product in paginator.get_page(bad)], first)
+
+
+class SessionCartTestCases(TestCase):
+
+    def setUp(self) -> None:
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.products = {
+            slug: Product.objects.create(category=category, title=slug, slug=slug, image='notebook.jpg', price=price)
+            for slug, price in [('a', Decimal('100.00')), ('b', Decimal('50.00')), ('c', Decimal('10.00'))]
+        }
+
+    def test_totals_skip_products_removed_from_catalog(self):
+        session = {}
+        cart = SessionCart(session)
+        cart.add(self.products['a'], 2)
+        cart.add(self.products['b'])
+        cart.set_quantity(self.products['c'], 3)
+        cart.remove(self.products['c'])
+        self.products['b'].delete()
+        cart = SessionCart(session)
+        # значок корзины и страница корзины показывают одно и то же
+        self.assertEqual([(item.product.slug, item.quantity) for item in cart.items], [('a', 2)])
+        self.assertEqual((cart.total_products, cart.total_price), (1, Decimal('200.00')))
+
+    def test_anonymous_cart_is_merged_on_login(self):
+        user = User.objects.create_user(username='buyer', password='secret-password')
+        cart = Cart.objects.create(owner=Customer.objects.create(user=user))
+        add_to_cart(cart, self.products['a'])
+        for slug in ['a', 'a', 'b', 'c']:
+            self.client.get(reverse('add_to_cart', args=[slug]))
+        self.products['c'].delete()
+        response = self.client.post(reverse('login'), {'username': 'buyer', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 302)
+        lines = dict(cart.related_products.values_list('product__slug', 'quantity'))
+        self.assertEqual(lines, {'a': 3, 'b': 1})
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_products, cart.total_price), (2, Decimal('350.00')))
+        self.assertEqual(self.client.get(reverse('api_cart')).json()['cart']['total_products'], 2)
+
+
+class QueryStatsTestCases(SimpleTestCase):
+
+    def setUp(self) -> None:
+        reset_stats()
+
+    @staticmethod
+    def view_stats(queries):
+        stats = ViewStats()
+        stats.add(queries, 1.0, 2.0, 1, '')
+        return {'home': stats}
+
+    def test_processes_flush_to_own_keys_and_sum_on_read(self):
+        first, second = StatsRecorder(), StatsRecorder()
+        first.flush(self.view_stats(3))
+        second.flush(self.view_stats(7))
+        first.flush(self.view_stats(5))
+        self.assertNotEqual(first.number, second.number)
+        home = load_stats()['home']
+        self.assertEqual((home.requests, home.min_queries, home.max_queries), (3, 3, 7))
+        # после сброса старые данные процесса не возвращаются с его следующим сбросом
+        reset_stats()
+        self.assertEqual(load_stats(), {})
+        first.flush(self.view_stats(4))
+        self.assertEqual(load_stats()['home'].requests, 1)
+
+
+class ReplicaRouterTestCases(SimpleTestCase):
+    # TestCase держит каждый тест в транзакции, а внутри транзакции роутер читает из основной базы.
+    # SimpleTestCase запрещает запросы, поэтому отставание реплики подменяется, а кэш проверок очищается
+
+    @mock.patch.dict('main_app.routers._replica_checks', clear=True)
+    @mock.patch('main_app.routers.replica_lag', return_value=0)
+    def test_catalog_reads_go_to_replica_until_write(self, replica_lag):
+        with routing_state(use_replicas=True):
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            # корзины и пользователи всегда читаются из основной базы
+            self.assertEqual(router.db_for_read(Cart), 'default')
+            self.assertEqual(router.db_for_write(Cart), 'default')
+            # после записи запрос читает свои изменения из основной базы
+            self.assertEqual(router.db_for_read(Product), 'default')
+        # вне запроса (команды, фоновые задачи) реплики не используются
+        self.assertEqual(router.db_for_read(Product), 'default')
+        replica_lag.assert_called_once_with('replica')
+
+    @mock.patch.dict('main_app.routers._replica_checks', clear=True)
+    @mock.patch('main_app.routers.replica_lag', return_value=60)
+    def test_lagging_replica_is_skipped(self, replica_lag):
+        with routing_state(use_replicas=True):
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+
+class PartitionMonthsTestCases(SimpleTestCase):
+
+    def test_month_start_is_utc(self):
+        # 1 марта 02:00 по Москве - еще февраль по UTC
+        value = datetime(2026, 3, 1, 2, 0, tzinfo=dt_timezone(timedelta(hours=3)))
+        self.assertEqual(month_start(value), datetime(2026, 2, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(month_start(datetime(2026, 3, 15)), datetime(2026, 3, 1, tzinfo=dt_timezone.utc))
+
+    def test_add_months_crosses_years(self):
+        start = datetime(2025, 11, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(add_months(start, 2), datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(start, -11), datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+
+    def test_iter_months_includes_both_ends(self):
+        months = list(iter_months(datetime(2025, 12, 31, tzinfo=dt_timezone.utc),
+                                  datetime(2026, 2, 1, tzinfo=dt_timezone.utc)))
+        self.assertEqual([f'{month:%Y_%m}' for month in months], ['2025_12', '2026_01', '2026_02'])
+        self.assertEqual(list(iter_months(months[-1], months[0])), [])
+
+    def test_partition_bounds(self):
+        self.assertEqual(
+            partition_bounds(datetime(2025, 12, 1, tzinfo=dt_timezone.utc)),
+            "FROM ('2025-12-01T00:00:00+00:00') TO ('2026-01-01T00:00:00+00:00')",
+        )
+
+
+class CatalogImportTestCases(TestCase):
+
+    def setUp(self) -> None:
+        Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.validator = CatalogValidator()
+
+    def row(self, **fields):
+        return {'slug': 'notebook', 'title': 'Ноутбук', 'category': 'notebooks', 'price': '100', **fields}
+
+    def test_clean_accepts_valid_row(self):
+        self.assertEqual(self.validator.clean(self.row(price='99,9'))['price'], Decimal('99.90'))
+
+    def test_clean_rejects_malformed_rows(self):
+        bad_rows = [
+            self.row(price='NaN'),
+            self.row(price='Infinity'),
+            self.row(price='-1'),
+            self.row(features=['ram']),
+            self.row(features={'ram': '8'}),
+            self.row(slug=123),
+            self.row(title=['Ноутбук']),
+            self.row(category={'slug': 'notebooks'}),
+            self.row(slug='x' * 51),
+            self.row(title='x' * 251),
+            self.row(title=' '),
+            ['не объект'],
+        ]
+        for row in bad_rows:
+            with self.subTest(row=row), self.assertRaises(RowError):
+                self.validator.clean(row)
+
+    def test_import_reports_bad_rows_and_writes_good_ones(self):
+        errors = []
+        importer = CatalogImporter(batch_size=10)
+        importer.run([self.row(), self.row(slug='nan', price='NaN')], on_error=lambda line, error: errors.append(line))
+        self.assertEqual((importer.created, errors), (1, [2]))
+        self.assertTrue(Product.objects.filter(slug='notebook').exists())
+
+    def test_import_reprices_carts_after_each_batch(self):
+        CatalogImporter().run([self.row(), self.row(slug='tablet')])
+        customer = Customer.objects.create(user=User.objects.create(username='buyer'))
+        cart = Cart.objects.create(owner=customer)
+        for product in Product.objects.all():
+            add_to_cart(cart, product)
+        importer = CatalogImporter(batch_size=1)
+        with mock.patch('main_app.catalog_import.reprice_carts', wraps=reprice_carts) as reprice:
+            importer.run([self.row(price='150'), self.row(slug='tablet', price='50')])
+        # id товаров с новой ценой не копятся до конца импорта, корзины пересчитываются по пачкам
+        self.assertEqual([len(call.args[0]) for call in reprice.call_args_list], [1, 1])
+        self.assertEqual((importer.repriced_products, importer.repriced_carts), (2, 2))
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_price, Decimal('200.00'))
+
+
+class CatalogExportTestCases(TestCase):
+
+    def setUp(self) -> None:
+        category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        ram = CategoryFeature.objects.create(category=category, feature_name='Память', feature_filter_name='ram')
+        for slug in ['a', 'b', 'c']:
+            product = Product.objects.create(
+                category=category, title=f'Ноутбук {slug}', slug=slug, image='notebook.jpg', price=Decimal('99.90')
+            )
+            # характеристики есть не у всех товаров: склейка двух курсоров не должна сбиваться
+            if slug != 'b':
+                ProductFeatures.objects.create(product=product, feature=ram, value=f'{slug}-8')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    def export(self, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('catalog_export'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_only_staff_can_export(self):
+        url = reverse('catalog_export')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create(username='buyer'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/admin/login/', response.url)
+
+    def test_csv_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalog.csv"')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8'))))
+        self.assertEqual(rows[0], ['slug', 'title', 'category', 'price', 'description', 'image', 'ram'])
+        self.assertEqual([row[0] for row in rows[1:]], ['a', 'b', 'c'])
+        self.assertEqual(rows[1], ['a', 'Ноутбук a', 'notebooks', '99.90', '', 'notebook.jpg', 'a-8'])
+        self.assertEqual(rows[2][-1], '')
+
+    def test_jsonl_and_gzip_export(self):
+        response, content = self.export(format='jsonl')
+        rows = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        self.assertEqual([(row['slug'], row['features']) for row in rows],
+                         [('a', {'ram': 'a-8'}), ('b', {}), ('c', {'ram': 'c-8'})])
+        response, compressed = self.export(format='jsonl', gzip=1)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalog.jsonl.gz"')
+        self.assertEqual(gzip.decompress(compressed), content)
+        # маленькие чанки курсоров дают ту же выгрузку
+        self.assertEqual(b''.join(export_catalog('jsonl', chunk_size=1)), content)
+
+
+@mock.patch('main_app.data_generator.ensure_placeholder_image')
+class DataGeneratorTestCases(TestCase):
+
+    @staticmethod
+    def generate(**options):
+        DataGenerator(categories=2, products=20, customers=5, orders_per_customer=2, seed=7, **options).run(
+            rebuild_search=False
+        )
+        orders = list(Order.objects.order_by('id').values_list('created_at', 'updated_at', 'total_price', 'status'))
+        carts = list(Cart.objects.order_by('id').values_list('updated_at', 'total_price'))
+        passwords = list(User.objects.order_by('id').values_list('password', 'date_joined'))
+        for model in (Order, Cart, User, Category):
+            model.objects.all().delete()
+        return orders, carts, passwords
+
+    def test_same_seed_and_base_date_give_same_data(self, ensure_placeholder_image):
+        first = self.generate(base_date=date(2026, 3, 1))
+        self.assertTrue(first[0])
+        self.assertTrue(all(created_at < datetime(2026, 3, 1, tzinfo=dt_timezone.utc) for created_at, *_ in first[0]))
+        self.assertEqual(self.generate(base_date=date(2026, 3, 1)), first)
+        self.assertNotEqual(self.generate(base_date=date(2026, 4, 1))[0], first[0])
+
+
+class BenchmarkTestCases(TransactionTestCase):
 
+    def test_rejects_empty_runs(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--requests', '0')
 
+    def test_runs_scenarios_on_current_db(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('main_app.images.run_in_background'):
+            output = os.path.join(media_root, 'bench.json')
+            call_command(
+                'benchmark', '--use-current-db', '--scenarios', 'home', 'product', '--workers', '1',
+                '--requests', '2', '--warmup', '0', '--categories', '1', '--products', '5', '--orders-per-user', '1',
+                '--output', output, stdout=io.StringIO(),
+            )
+            with open(output, encoding='utf-8') as file:
+                scenarios = json.load(file)['scenarios']
+            # картинка товаров бенчмарка существует, поэтому уменьшенные копии могут быть созданы
+            self.assertTrue(os.path.exists(os.path.join(media_root, 'bench.jpg')))
+        self.assertEqual({name: (row['requests'], row['errors']) for name, row in scenarios.items()},
+                         {'home': (2, 0), 'product': (2, 0)})
@@ -1,10 +1,13 @@
 from django.urls import path
 from django.contrib.auth.views import LogoutView
 
+from .api import cart_add, cart_batch, cart_detail, cart_remove, cart_reorder, cart_set_quantity
+
 from .views import(
     BaseView,
     ProductDetailView,
     CategoryDetailView,
+    SearchView,
     CartView,
     AddToCartView,
     DeleteFromCartView,
@@ -14,12 +17,14 @@ from .views import(
     LoginView,
     RegistrationView,
     ProfileView,
+    CatalogExportView,
 )
 
 urlpatterns = [
     path('', BaseView.as_view(), name='base'),
     path('products/<str:slug>/', ProductDetailView.as_view(), name='product_detail'),
     path('category/<str:slug>/', CategoryDetailView.as_view(), name='category_detail'),
+    path('search/', SearchView.as_view(), name='search'),
     path('cart/', CartView.as_view(), name='cart'),
     path('add_to_cart/<str:slug>/', AddToCartView.as_view(), name='add_to_cart'),
     path('remove_from_cart/<str:slug>/', DeleteFromCartView.as_view(), name='delete_from_cart'),
@@ -30,4 +35,11 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(next_page='/'), name='logout'),
     path('registration/', RegistrationView.as_view(), name='registration'),
     path('profile/', ProfileView.as_view(), name='profile'),
+    path('catalog/export/', CatalogExportView.as_view(), name='catalog_export'),
+    path('api/cart/', cart_detail, name='api_cart'),
+    path('api/cart/add/<str:slug>/', cart_add, name='api_add_to_cart'),
+    path('api/cart/remove/<str:slug>/', cart_remove, name='api_delete_from_cart'),
+    path('api/cart/quantity/<str:slug>/', cart_set_quantity, name='api_change_quantity'),
+    path('api/cart/batch/', cart_batch, name='api_cart_batch'),
+    path('api/cart/reorder/<int:order_id>/', cart_reorder, name='api_cart_reorder'),
 ]
\ No newline at end of file
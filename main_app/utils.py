@@ -1,11 +1,331 @@
-from django.db import models
+import logging
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import Cart, CartProduct, Category, Customer, OrderLine, Product
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# сколько устаревших строк корзин можно пересчитать прямо в запросе, больше - уходит в фон
+REPRICE_INLINE_LIMIT = 200
+# предел Product.price (max_digits=9, decimal_places=2) и допустимое изменение цен в процентах
+MAX_PRICE = Decimal('9999999.99')
+MIN_PRICE_PERCENT, MAX_PRICE_PERCENT = -99, 1000
+# больше этого количества одного товара в строку корзины не попадает
+MAX_CART_QUANTITY = 1000
 
 
 def recalculate_cart(cart):
-    cart_data = cart.products.aggregate(models.Sum('total_price'), models.Count('id'))
-    if cart_data.get('total_price__sum'):
-        cart.total_price = cart_data['total_price__sum']
-    else:
-        cart.total_price = 0
-    cart.total_products = cart_data['id__count']
-    cart.save()
+    """
+    Полный пересчет итогов корзины по всем строкам. В обычной работе итоги меняются дельтами.
+    Строки суммируются под той же блокировкой корзины, что и у apply_cart_operations, и записываются
+    только итоги: параллельные дельты не теряются, in_order и дата изменения не перезаписываются
+    """
+    with transaction.atomic():
+        list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk', flat=True))
+        cart_data = cart.related_products.aggregate(models.Sum('total_price'), models.Count('id'))
+        cart.total_price = cart_data['total_price__sum'] or 0
+        cart.total_products = cart_data['id__count']
+        Cart.objects.filter(pk=cart.pk).update(total_price=cart.total_price, total_products=cart.total_products)
+
+
+def update_cart_totals(cart, price_delta, products_delta=0):
+    """Сдвигает итоги корзины на дельту одним атомарным UPDATE, не пересчитывая строки"""
+    # update() не заполняет auto_now, дата изменения выставляется явно
+    Cart.objects.filter(pk=cart.pk).update(
+        total_price=F('total_price') + price_delta,
+        total_products=F('total_products') + products_delta,
+        updated_at=timezone.now(),
+    )
+    cart.total_price += price_delta
+    cart.total_products += products_delta
+
+
+CART_ADD = 'add'
+CART_SET = 'set'
+CART_REMOVE = 'remove'
+CART_OPERATIONS = (CART_ADD, CART_SET, CART_REMOVE)
+
+
+class EmptyCartError(ValueError):
+    pass
+
+
+# корзина уже ушла в заказ или удалена очисткой брошенных корзин и больше не меняется
+class CartAlreadyOrderedError(ValueError):
+    pass
+
+
+# сумма строки или корзины не помещается в numeric(9, 2)
+class CartLimitError(ValueError):
+    pass
+
+
+def lock_cart(cart):
+    """
+    Блокирует строку открытой корзины до конца транзакции, поэтому изменения одной корзины выполняются строго
+    по очереди. Возвращает сумму корзины под блокировкой или None, если корзина уже ушла в заказ или удалена
+    """
+    return Cart.objects.select_for_update().filter(pk=cart.pk, in_order=False).values_list(
+        'total_price', flat=True
+    ).first()
+
+
+def apply_cart_operations(cart, operations):
+    """
+    Применяет к корзине список операций (операция, товар, количество) в одной транзакции:
+    add - увеличить количество (строка создается при необходимости), set - задать количество,
+    remove - удалить строку. Количество в строке не больше MAX_CART_QUANTITY.
+    Под блокировкой корзины читаются все затронутые строки одним запросом, итоговое состояние считается в памяти
+    и записывается пачкой: bulk_create, bulk_update, один DELETE и один UPDATE итогов корзины.
+    Возвращает {id товара: строка корзины или None, если строка удалена}.
+    Корзина, ушедшая в заказ или удаленная, - CartAlreadyOrderedError, переполнение суммы - CartLimitError.
+    """
+    with transaction.atomic():
+        cart_total = lock_cart(cart)
+        if cart_total is None:
+            raise CartAlreadyOrderedError('Корзина уже оформлена или удалена')
+        products = {product.id: product for _, product, _ in operations}
+        existing = {
+            cart_product.product_id: cart_product
+            for cart_product in CartProduct.objects.filter(cart=cart, product_id__in=products)
+        }
+        quantities = {product_id: cart_product.quantity for product_id, cart_product in existing.items()}
+        for operation, product, quantity in operations:
+            if operation == CART_ADD:
+                quantities[product.id] = (quantities.get(product.id) or 0) + quantity
+            elif operation == CART_SET:
+                quantities[product.id] = quantity
+            else:
+                quantities[product.id] = 0
+
+        to_create, to_update, to_delete = [], [], []
+        price_delta = products_delta = 0
+        lines = {}
+        for product_id, product in products.items():
+            quantity, cart_product = quantities[product_id], existing.get(product_id)
+            if quantity <= 0:
+                lines[product_id] = None
+                if cart_product:
+                    to_delete.append(cart_product)
+                    price_delta -= cart_product.total_price
+                    products_delta -= 1
+                continue
+            quantity = min(quantity, MAX_CART_QUANTITY)
+            total_price = quantity * product.price
+            if total_price > MAX_PRICE:
+                raise CartLimitError(f'Сумма строки {total_price} больше {MAX_PRICE}')
+            if cart_product is None:
+                cart_product = CartProduct(
+                    customer=cart.owner, cart=cart, product=product, quantity=quantity, total_price=total_price
+                )
+                to_create.append(cart_product)
+                price_delta += total_price
+                products_delta += 1
+            elif (cart_product.quantity, cart_product.total_price) != (quantity, total_price):
+                price_delta += total_price - cart_product.total_price
+                cart_product.quantity, cart_product.total_price = quantity, total_price
+                to_update.append(cart_product)
+            cart_product.product = product
+            lines[product_id] = cart_product
+        if cart_total + price_delta > MAX_PRICE:
+            raise CartLimitError(f'Сумма корзины превысит {MAX_PRICE}')
+
+        if to_delete:
+            CartProduct.objects.filter(pk__in=[cart_product.pk for cart_product in to_delete]).delete()
+        CartProduct.objects.bulk_update(to_update, ['quantity', 'total_price'])
+        CartProduct.objects.bulk_create(to_create)
+        if price_delta or products_delta:
+            update_cart_totals(cart, price_delta, products_delta)
+    return lines
+
+
+def add_to_cart(cart, product, quantity=1):
+    return apply_cart_operations(cart, [(CART_ADD, product, quantity)])[product.id]
+
+
+def change_cart_product_quantity(cart, product, quantity):
+    return apply_cart_operations(cart, [(CART_SET, product, quantity)])[product.id]
+
+
+def remove_from_cart(cart, product):
+    apply_cart_operations(cart, [(CART_REMOVE, product, 0)])
+
+
+def place_order(order, cart):
+    """
+    Оформляет заказ по корзине: строки корзины копируются в OrderLine одним bulk_create
+    с текущими названиями и ценами товаров, заказ сохраняется один раз вместе с итогами,
+    сводка покупателя сдвигается одним UPDATE. Пустую корзину не оформляет (EmptyCartError),
+    корзину, которая уже ушла в заказ, - тоже (CartAlreadyOrderedError)
+    """
+    with transaction.atomic():
+        # повторная отправка формы (двойной клик, вторая вкладка) ждет блокировку и видит корзину уже в заказе
+        if lock_cart(cart) is None:
+            raise CartAlreadyOrderedError('Корзина уже оформлена')
+        lines = [
+            OrderLine(
+                order=order, product=item.product, title=item.product.title, price=item.product.price,
+                quantity=item.quantity, total_price=item.product.price * item.quantity,
+            )
+            for item in cart.items
+        ]
+        # строки читаются под блокировкой: корзину могли опустошить в соседней вкладке
+        if not lines:
+            raise EmptyCartError('Корзина пуста')
+        order.cart = cart
+        order.total_products = len(lines)
+        order.total_price = sum((line.total_price for line in lines), 0)
+        order.save()
+        OrderLine.objects.bulk_create(lines)
+        Cart.objects.filter(pk=cart.pk).update(in_order=True)
+        Customer.objects.filter(pk=order.customer_id).update(
+            orders_count=F('orders_count') + 1,
+            orders_total=F('orders_total') + order.total_price,
+            last_order_at=order.created_at,
+        )
+    cart.in_order = True
+    return order
+
+
+def get_drifted_carts(carts=None):
+    """Корзины, у которых сохраненные итоги разошлись с суммой по строкам"""
+    if carts is None:
+        carts = Cart.objects.filter(in_order=False)
+    return carts.annotate(
+        actual_total_price=Coalesce(
+            models.Sum('related_products__total_price'), 0, output_field=models.DecimalField()
+        ),
+        actual_total_products=models.Count('related_products'),
+    ).filter(
+        ~Q(total_price=F('actual_total_price')) | ~Q(total_products=F('actual_total_products'))
+    )
+
+
+def merge_session_cart(cart, lines):
+    """Переносит строки анонимной корзины из сессии в корзину покупателя одной пачкой"""
+    quantities = dict(lines)
+    products = Product.objects.in_bulk(quantities)
+    apply_cart_operations(cart, [
+        (CART_ADD, product, quantities[product_id]) for product_id, product in products.items()
+    ])
+
+
+def recount_category_products():
+    """Полный пересчет счетчиков товаров в категориях, например после массового импорта"""
+    Category.objects.update(
+        products_count=Coalesce(models.Subquery(
+            Product.objects.filter(category=models.OuterRef('pk'))
+            .values('category').annotate(count=models.Count('id')).values('count'),
+            output_field=models.PositiveIntegerField(),
+        ), 0)
+    )
+
+
+def get_stale_cart_products(product_ids):
+    """Строки открытых корзин с переданными товарами, сумма которых не совпадает с текущей ценой"""
+    return CartProduct.objects.filter(cart__in_order=False, product_id__in=product_ids).exclude(
+        total_price=F('quantity') * F('product__price')
+    )
+
+
+def reprice_carts(product_ids, batch_size=500):
+    """
+    Пересчитывает открытые корзины после изменения цен товаров.
+    Корзины обрабатываются пачками: на пачку - блокировка корзин, один UPDATE строк по текущим ценам
+    и один UPDATE итогов корзин по сумме строк. Каждая транзакция короткая, поэтому даже изменение цен
+    всего каталога не держит таблицы корзин заблокированными. Возвращает количество измененных корзин.
+    """
+    product_ids = sorted(set(product_ids))
+    repriced = 0
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        cart_ids = sorted(set(get_stale_cart_products(chunk).values_list('cart_id', flat=True)))
+        for cart_start in range(0, len(cart_ids), batch_size):
+            batch = cart_ids[cart_start:cart_start + batch_size]
+            with transaction.atomic():
+                # те же блокировки, что и у apply_cart_operations, поэтому дельты итогов не теряются
+                list(Cart.objects.select_for_update().filter(pk__in=batch, in_order=False).values_list('pk', flat=True))
+                CartProduct.objects.filter(cart_id__in=batch, cart__in_order=False, product_id__in=chunk).update(
+                    total_price=F('quantity') * models.Subquery(
+                        Product.objects.filter(pk=models.OuterRef('product_id')).values('price')[:1]
+                    )
+                )
+                lines = CartProduct.objects.filter(cart_id=models.OuterRef('pk')).order_by().values('cart_id')
+                repriced += Cart.objects.filter(pk__in=batch, in_order=False).update(total_price=Coalesce(
+                    models.Subquery(lines.annotate(total=models.Sum('total_price')).values('total')), 0,
+                    output_field=models.DecimalField(),
+                ))
+    return repriced
+
+
+def _reprice_carts_in_background(product_ids):
+    repriced = reprice_carts(product_ids)
+    logger.info('Пересчитано корзин после изменения цен: %s', repriced)
+    return repriced
+
+
+def schedule_cart_repricing(product_ids):
+    """
+    Пересчет корзин после изменения цен. Если устаревших строк немного - сразу, иначе в фоновом потоке
+    после коммита. Возвращает количество пересчитанных корзин или None, если пересчет ушел в фон
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    if len(product_ids) <= REPRICE_INLINE_LIMIT and (
+        get_stale_cart_products(product_ids)[:REPRICE_INLINE_LIMIT + 1].count() <= REPRICE_INLINE_LIMIT
+    ):
+        return reprice_carts(product_ids)
+    run_in_background(_reprice_carts_in_background, product_ids)
+    return None
+
+
+def change_products_price(products, percent):
+    """
+    Меняет цены товаров из queryset на percent процентов одним UPDATE с округлением до копеек
+    и пересчитывает открытые корзины. Недопустимый процент или переполнение цены - ValueError.
+    Возвращает количество товаров и количество пересчитанных корзин (None, если пересчет ушел в фон)
+    """
+    percent = Decimal(percent)
+    if not MIN_PRICE_PERCENT <= percent <= MAX_PRICE_PERCENT:
+        raise ValueError(f'Процент изменения цены должен быть от {MIN_PRICE_PERCENT} до {MAX_PRICE_PERCENT}')
+    factor = 1 + percent / 100
+    # иначе UPDATE упадет на переполнении numeric(9, 2) посреди админки
+    max_price = products.aggregate(models.Max('price'))['price__max']
+    if max_price is not None and max_price * factor > MAX_PRICE:
+        raise ValueError(f'Цена {max_price} после изменения превысит {MAX_PRICE}')
+    product_ids = list(products.values_list('id', flat=True))
+    # ROUND в самом UPDATE: SQLite иначе сохранит цену с лишними знаками после запятой
+    new_price = models.Func(F('price') * factor, 2, function='ROUND', output_field=models.DecimalField())
+    count = products.update(price=new_price)
+    if not count:
+        return 0, 0
+    bump_catalog_version()
+    return count, schedule_cart_repricing(product_ids)
+
+
+def move_products(products, category):
+    """
+    Переносит товары из queryset в другую категорию одним UPDATE. Счетчики товаров сдвигаются на число
+    перенесенных товаров только у затронутых категорий, как и в сигналах. Возвращает количество товаров
+    """
+    with transaction.atomic():
+        moved = dict(
+            products.exclude(category=category).order_by().values_list('category').annotate(models.Count('id'))
+        )
+        count = products.update(category=category)
+        for category_id, moved_count in moved.items():
+            Category.objects.filter(pk=category_id).update(products_count=F('products_count') - moved_count)
+        if moved:
+            Category.objects.filter(pk=category.pk).update(products_count=F('products_count') + sum(moved.values()))
+    if count:
+        bump_catalog_version()
+    return count
+
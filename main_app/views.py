@@ -1,32 +1,66 @@
-from django.db import transaction
+from django.db.models import Prefetch
+from django.core.paginator import Paginator
 from django.shortcuts import render
 from django.views.generic import DetailView, View
 from django.http import HttpResponseRedirect
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
 from django.contrib.auth import authenticate, login
+from django.utils.http import urlencode
 
-from .models import Category, Customer, CartProduct, Product, Order
-from .mixins import CartMixin
+from specs.facets import FacetIndex
+
+from .models import Category, Customer, Product, Order, OrderLine
+from .mixins import CartMixin, PageCacheMixin, change_customer_cart, forget_cart
+from .pagination import (
+    KeysetPaginator, PRODUCT_SORTING, PRODUCT_SORTING_LABELS, DEFAULT_PRODUCT_SORTING, ORDER_HISTORY_ORDERING
+)
 from .forms import OrderForm, LoginForm, RegistrationForm
-from .utils import recalculate_cart
+from .search import SearchResults
+from .catalog_export import export_catalog
+from .utils import (
+    CART_ADD, CART_REMOVE, CART_SET, CartAlreadyOrderedError, CartLimitError, EmptyCartError, place_order,
+)
 
 
-class BaseView(CartMixin, View):
+class ProductListMixin:
+    """Постраничный вывод товаров с сортировкой: ?sort=price&cursor=..."""
 
-    def get(self, request, *args, **kwargs):
+    paginate_by = 24
+
+    def get_sorting(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in PRODUCT_SORTING else DEFAULT_PRODUCT_SORTING
+
+    def get_products_page(self, products):
+        paginator = KeysetPaginator(products, PRODUCT_SORTING[self.get_sorting()], per_page=self.paginate_by)
+        return paginator.get_page(self.request.GET.get('cursor'))
+
+    def get_pagination_context(self, products, filter_query=''):
+        return {
+            'products': self.get_products_page(products),
+            'sort': self.get_sorting(),
+            'sorting_choices': PRODUCT_SORTING_LABELS,
+            'filter_query': filter_query,
+        }
+
+
+class BaseView(CartMixin, PageCacheMixin, ProductListMixin, View):
 
-        categories = Category.objects.all()
-        products = Product.objects.all()
+    def get(self, request, *args, **kwargs):
         context = {
-            'categories': categories,
-            'products': products,
             'cart': self.cart
         }
+        context.update(self.get_pagination_context(Product.objects.all()))
         return render(request, 'base.html', context)
 
 
-class ProductDetailView(CartMixin, DetailView):
+class ProductDetailView(CartMixin, PageCacheMixin, DetailView):
 
+    model = Product
+    queryset = Product.objects.select_related('category')
     context_object_name = 'product'
     template_name = 'product_detail.html'
     slug_url_kwarg = 'slug'
@@ -37,7 +71,7 @@ class ProductDetailView(CartMixin, DetailView):
         return context
 
 
-class CategoryDetailView(CartMixin, DetailView):
+class CategoryDetailView(CartMixin, PageCacheMixin, ProductListMixin, DetailView):
 
     model = Category
     queryset = Category.objects.all()
@@ -48,20 +82,44 @@ class CategoryDetailView(CartMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
         context['cart'] = self.cart
+        facet_index = FacetIndex.for_category(self.object)
+        selection = facet_index.parse_selection(self.request.GET)
+        products = Product.objects.filter(category=self.object)
+        if selection:
+            products = facet_index.filter_products(products, selection)
+        filter_query = urlencode([(name, value) for name, values in selection.items() for value in sorted(values)])
+        context.update(self.get_pagination_context(products, filter_query))
+        context['facets'] = facet_index.facets(selection)
         return context
 
 
+class SearchView(CartMixin, PageCacheMixin, View):
+
+    paginate_by = 24
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        paginator = Paginator(SearchResults(query), self.paginate_by)
+        context = {
+            'cart': self.cart,
+            'query': query,
+            'page': paginator.get_page(request.GET.get('page')),
+        }
+        return render(request, 'search.html', context)
+
+
 class AddToCartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         product_slug = kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
-        cart_product, created = CartProduct.objects.get_or_create(
-            customer=self.cart.owner, cart=self.cart, product=product
-        )
-        if created:
-            self.cart.products.add(cart_product)
-        recalculate_cart(self.cart)
+        if not request.user.is_authenticated:
+            self.cart.add(product)
+            return HttpResponseRedirect('/cart/')
+        try:
+            change_customer_cart(request, self.cart, [(CART_ADD, product, 1)])
+        except CartLimitError:
+            messages.add_message(request, messages.INFO, 'Сумма корзины превышает допустимую')
         #messages.add_message(request, messages.INFO, 'Товар успешно добавлен')
         return HttpResponseRedirect('/cart/')
 
@@ -71,12 +129,11 @@ class DeleteFromCartView(CartMixin, View):
     def get(self, request, *args, **kwargs):
         product_slug =  kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            customer=self.cart.owner, cart=self.cart, product=product
-        )
-        self.cart.products.remove(cart_product)
-        cart_product.delete()
-        recalculate_cart(self.cart)
+        if not request.user.is_authenticated:
+            self.cart.remove(product)
+            messages.add_message(request, messages.INFO, 'Товар успешно удален')
+            return HttpResponseRedirect('/cart/')
+        change_customer_cart(request, self.cart, [(CART_REMOVE, product, 0)])
         messages.add_message(request, messages.INFO, 'Товар успешно удален')
         return HttpResponseRedirect('/cart/')
 
@@ -86,13 +143,16 @@ class ChangeQuantityView(CartMixin, View):
     def post(self, request, *args, **kwargs):
         product_slug = kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            customer=self.cart.owner, cart=self.cart, product=product
-        )
         quantity = int(request.POST.get('quantity'))
-        cart_product.quantity = quantity
-        cart_product.save()
-        recalculate_cart(self.cart)
+        if not request.user.is_authenticated:
+            self.cart.set_quantity(product, quantity)
+            messages.add_message(request, messages.INFO, 'Количество успешно изменено')
+            return HttpResponseRedirect('/cart/')
+        try:
+            change_customer_cart(request, self.cart, [(CART_SET, product, quantity)])
+        except CartLimitError:
+            messages.add_message(request, messages.INFO, 'Сумма корзины превышает допустимую')
+            return HttpResponseRedirect('/cart/')
         messages.add_message(request, messages.INFO, 'Количество успешно изменено')
         return HttpResponseRedirect('/cart/')
 
@@ -100,10 +160,8 @@ class ChangeQuantityView(CartMixin, View):
 class CartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
         context = {
             'cart': self.cart,
-            'categories': categories
         }
         return render(request, 'cart.html', context)
 
@@ -111,11 +169,9 @@ class CartView(CartMixin, View):
 class CheckoutView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
         form = OrderForm(request.POST or None)
         context = {
             'cart': self.cart,
-            'categories': categories,
             'form': form
         }
         return render(request, 'checkout.html', context)
@@ -123,26 +179,25 @@ class CheckoutView(CartMixin, View):
 
 class MakeOrderView(CartMixin, View):
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            # анонимная корзина живет в сессии и попадет в базу после входа
+            return HttpResponseRedirect('/login/')
         form = OrderForm(request.POST or None)
-        customer = Customer.objects.get(user=request.user)
         if form.is_valid():
             new_order = form.save(commit=False)
-            new_order.customer = customer
-            new_order.first_name = form.cleaned_data['first_name']
-            new_order.last_name = form.cleaned_data['last_name']
-            new_order.phone_number = form.cleaned_data['phone_number']
-            new_order.address = form.cleaned_data['address']
-            new_order.buying_type = form.cleaned_data['buying_type']
-            new_order.order_date = form.cleaned_data['order_date']
-            new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            self.cart.save()
-            new_order.cart = self.cart
-            new_order.save()
-            customer.orders.add(new_order)
+            new_order.customer = self.cart.owner
+            try:
+                place_order(new_order, self.cart)
+            except EmptyCartError:
+                messages.add_message(request, messages.INFO, 'Корзина пуста, добавьте товары перед оформлением')
+                return HttpResponseRedirect('/cart/')
+            except CartAlreadyOrderedError:
+                # форму отправили повторно: заказ по этой корзине уже оформлен
+                forget_cart(request)
+                messages.add_message(request, messages.INFO, 'Заказ по этой корзине уже оформлен')
+                return HttpResponseRedirect('/profile/')
+            forget_cart(request)
             messages.add_message(request, messages.INFO, 'Спасибо за заказ! Менеджер с Вами свяжется')
             return HttpResponseRedirect('/')
         return HttpResponseRedirect('/checkout/')
@@ -152,8 +207,7 @@ class LoginView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         form = LoginForm(request.POST or None)
-        categories = Category.objects.all()
-        context = {'form': form, 'categories': categories, 'cart': self.cart}
+        context = {'form': form, 'cart': self.cart}
         return render(request, 'login.html', context)
 
     def post(self, request, *args, **kwargs):
@@ -173,8 +227,7 @@ class RegistrationView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         form = RegistrationForm(request.POST or None)
-        categories = Category.objects.all()
-        context = {'form': form, 'categories': categories, 'cart': self.cart}
+        context = {'form': form, 'cart': self.cart}
         return render(request, 'registration.html', context)
 
     def post(self, request, *args, **kwargs):
@@ -202,18 +255,32 @@ class RegistrationView(CartMixin, View):
 
 
 class ProfileView(CartMixin, View):
+    """История заказов постранично по ключу, строки всех заказов страницы - одним запросом"""
+
+    paginate_by = 10
 
     def get(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
-        orders = Order.objects.filter(customer=customer).order_by('-created_at')
-        categories = Category.objects.all()
-        context = {'orders': orders, 'cart': self.cart, 'categories': categories}
+        customer = self.cart.owner
+        orders = Order.objects.filter(customer=customer).prefetch_related(
+            Prefetch('lines', queryset=OrderLine.objects.select_related('product'))
+        )
+        paginator = KeysetPaginator(orders, ORDER_HISTORY_ORDERING, per_page=self.paginate_by)
+        context = {'orders': paginator.get_page(request.GET.get('cursor')), 'customer': customer, 'cart': self.cart}
         return render(request, 'profile.html', context)
 
 
+@method_decorator(staff_member_required, name='dispatch')
+class CatalogExportView(View):
+    """Выгрузка каталога для сотрудников: ?format=csv|jsonl&gzip=1"""
 
-
-
-
-
+    def get(self, request, *args, **kwargs):
+        file_format = 'jsonl' if request.GET.get('format') == 'jsonl' else 'csv'
+        compress = bool(request.GET.get('gzip'))
+        filename = f'catalog.{file_format}' + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            export_catalog(file_format, compress),
+            content_type='application/gzip' if compress else f'text/{file_format}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
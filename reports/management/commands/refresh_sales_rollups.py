@@ -0,0 +1,42 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reports.rollups import refresh_sales_rollups
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Ожидается дата в формате YYYY-MM-DD: {value}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновляет дневные витрины продаж. По умолчанию пересчитывает только дни с заказами, созданными '
+        'или измененными после прошлого запуска; рассчитана на запуск по расписанию'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все дни с заказами')
+        parser.add_argument('--from', dest='date_from', help='Пересчитать дни с этой даты (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='По эту дату включительно, по умолчанию сегодня')
+
+    def handle(self, *args, **options):
+        days = None
+        if options['date_from']:
+            first = parse_day(options['date_from'])
+            last = parse_day(options['date_to']) if options['date_to'] else timezone.localdate()
+            if last < first:
+                raise CommandError('--to раньше --from')
+            days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+        started = time.monotonic()
+
+        def on_day(day):
+            self.stdout.write(f'[{time.monotonic() - started:.1f} c] {day}')
+
+        days = refresh_sales_rollups(days=days, full=options['full'], on_day=on_day)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано дней: {len(days)}'))
@@ -0,0 +1,79 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('main_app', '0022_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('title', models.CharField(max_length=250, verbose_name='Наименование')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('buying_type', models.CharField(choices=[('self', 'Самовывоз'), ('delivery', 'Доставка')], max_length=100, verbose_name='Тип заказа')),
+                ('status', models.CharField(choices=[('new', 'Новый заказ'), ('in_progress', 'Заказ в обработке'), ('is_ready', 'Заказ готов'), ('completed', 'Заказ выполнен')], max_length=100, verbose_name='Статус заказа')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('refreshed_until', models.DateTimeField(verbose_name='Учтены изменения до')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('day', 'buying_type', 'status'), name='daily_sales_unique'),
+        ),
+        migrations.AddField(
+            model_name='dailyproductsales',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='main_app.product', verbose_name='Товар'),
+        ),
+        migrations.AddField(
+            model_name='dailycategorysales',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='main_app.category', verbose_name='Категория'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='daily_product_sales_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category'), name='daily_category_sales_unique'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from django.db import models
+
+from main_app.models import Order
+
+
+class SalesRollup(models.Model):
+    """Продажи за день. Строки пересчитываются командой refresh_sales_rollups, отчеты читают только их"""
+
+    day = models.DateField(verbose_name='День')
+    orders_count = models.PositiveIntegerField(default=0, verbose_name='Заказов')
+    quantity = models.PositiveIntegerField(default=0, verbose_name='Товаров, шт.')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    """Продажи за день по способу получения и статусу заказа"""
+
+    buying_type = models.CharField(max_length=100, choices=Order.BUYING_TYPE_CHOICES, verbose_name='Тип заказа')
+    status = models.CharField(max_length=100, choices=Order.STATUS_CHOICES, verbose_name='Статус заказа')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'buying_type', 'status'], name='daily_sales_unique'),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    """Продажи за день по категории товара"""
+
+    category = models.ForeignKey(
+        'main_app.Category', verbose_name='Категория', null=True, on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_unique'),
+        ]
+
+
+class DailyProductSales(SalesRollup):
+    """Продажи за день по товару. Название - из строк заказов, поэтому остается и у удаленных товаров"""
+
+    product = models.ForeignKey('main_app.Product', verbose_name='Товар', null=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=250, verbose_name='Наименование')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+
+
+class RollupState(models.Model):
+    """До какого момента изменения заказов уже учтены в витринах"""
+
+    name = models.CharField(max_length=50, unique=True)
+    refreshed_until = models.DateTimeField(verbose_name='Учтены изменения до')
+
+    def __str__(self):
+        return f'{self.name}: {self.refreshed_until}'
@@ -0,0 +1,109 @@
+"""
+Витрины продаж по дням (python manage.py refresh_sales_rollups).
+
+Отчеты читают только дневные витрины, а не заказы, поэтому не конкурируют с магазином за таблицы заказов.
+Обновление пересчитывает только дни, в которых есть заказы, созданные или измененные (Order.updated_at)
+после прошлого запуска. День пересчитывается целиком в своей короткой транзакции: строки дня удаляются
+и вставляются заново, запросы ограничены диапазоном created_at и на PostgreSQL читают одну секцию заказов.
+Удаление заказов updated_at не отражает - такие дни пересчитываются явно (--from/--to или --full).
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from main_app.models import Order, OrderLine
+from .models import DailyCategorySales, DailyProductSales, DailySales, RollupState
+
+ROLLUP_NAME = 'sales'
+ROLLUP_MODELS = (DailySales, DailyCategorySales, DailyProductSales)
+# заказ, сохраненный во время обновления, может закоммититься позже с меньшим updated_at,
+# поэтому следующий запуск перечитывает изменения с запасом
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def line_totals():
+    return {
+        'quantity': Coalesce(models.Sum('quantity'), 0),
+        'revenue': Coalesce(models.Sum('total_price'), 0, output_field=models.DecimalField()),
+    }
+
+
+def refresh_day(day):
+    start, end = day_bounds(day)
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end).order_by()
+    lines = OrderLine.objects.filter(order__created_at__gte=start, order__created_at__lt=end).order_by()
+
+    quantities = {
+        (row['order__buying_type'], row['order__status']): row['quantity']
+        for row in lines.values('order__buying_type', 'order__status').annotate(quantity=models.Sum('quantity'))
+    }
+    sales = [
+        DailySales(day=day, quantity=quantities.get((row['buying_type'], row['status']), 0), **row)
+        for row in orders.values('buying_type', 'status').annotate(
+            orders_count=models.Count('id'),
+            revenue=Coalesce(models.Sum('total_price'), 0, output_field=models.DecimalField()),
+        )
+    ]
+    categories = [
+        DailyCategorySales(day=day, category_id=row.pop('product__category'), **row)
+        for row in lines.values('product__category').annotate(
+            orders_count=models.Count('order', distinct=True), **line_totals()
+        )
+    ]
+    # товар, переименованный в течение дня, - одна строка с последним по алфавиту названием;
+    # удаленные товары (product NULL) различаются только названием из строк заказов
+    products = [
+        DailyProductSales(day=day, product_id=row.pop('product'), **row)
+        for row in lines.filter(product__isnull=False).values('product').annotate(
+            title=models.Max('title'), orders_count=models.Count('order', distinct=True), **line_totals()
+        )
+    ] + [
+        DailyProductSales(day=day, product=None, **row)
+        for row in lines.filter(product__isnull=True).values('title').annotate(
+            orders_count=models.Count('order', distinct=True), **line_totals()
+        )
+    ]
+    with transaction.atomic():
+        for model in ROLLUP_MODELS:
+            model.objects.filter(day=day).delete()
+        DailySales.objects.bulk_create(sales)
+        DailyCategorySales.objects.bulk_create(categories)
+        DailyProductSales.objects.bulk_create(products)
+
+
+def changed_days(since=None):
+    """Дни (по created_at), в которых есть заказы, созданные или измененные начиная с since"""
+    orders = Order.objects.order_by()
+    if since is not None:
+        orders = orders.filter(updated_at__gte=since)
+    return sorted(orders.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct())
+
+
+def refresh_sales_rollups(days=None, full=False, on_day=None):
+    """
+    Пересчитывает витрины. По умолчанию - дни с изменениями после прошлого запуска (при первом запуске - все),
+    days - явный список дней, full - все дни с заказами. Возвращает пересчитанные дни
+    """
+    started = timezone.now()
+    # явный список дней не сдвигает отметку: изменения в остальных днях еще не учтены
+    track_changes = days is None
+    if track_changes:
+        state = RollupState.objects.filter(name=ROLLUP_NAME).first()
+        days = changed_days(None if full or state is None else state.refreshed_until)
+    for day in days:
+        refresh_day(day)
+        if on_day:
+            on_day(day)
+    if track_changes:
+        # отметка сдвигается только после обновления всех дней: прерванный запуск повторится целиком
+        RollupState.objects.update_or_create(
+            name=ROLLUP_NAME, defaults={'refreshed_until': started - REFRESH_OVERLAP}
+        )
+    return days
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from main_app.models import Cart, Category, Customer, Order, OrderLine, Product
+from main_app.utils import add_to_cart, place_order
+from .models import DailyCategorySales, DailyProductSales, DailySales, RollupState
+from .rollups import changed_days, refresh_sales_rollups
+
+
+class SalesRollupTestCases(TestCase):
+
+    def setUp(self) -> None:
+        user = get_user_model().objects.create(username='buyer')
+        self.customer = Customer.objects.create(user=user)
+        self.category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        self.product = Product.objects.create(
+            category=self.category, title='Ноутбук', slug='notebook', image='notebook.jpg', price=Decimal('100.00')
+        )
+        cart = Cart.objects.create(owner=self.customer)
+        add_to_cart(cart, self.product, 3)
+        self.order = place_order(
+            Order(customer=self.customer, first_name='a', last_name='b', phone_number='1'), cart
+        )
+
+    def test_refresh_builds_daily_rollups_and_tracks_changes(self):
+        day = timezone.localdate(self.order.created_at)
+        self.assertEqual(refresh_sales_rollups(), [day])
+        sales = DailySales.objects.get(day=day)
+        self.assertEqual((sales.status, sales.orders_count, sales.quantity), (Order.STATUS_NEW, 1, 3))
+        self.assertEqual(sales.revenue, Decimal('300.00'))
+        self.assertEqual(DailyCategorySales.objects.get(day=day).category, self.category)
+        # после обновления в выборку попадают только заказы, измененные позже отметки
+        state = RollupState.objects.get()
+        self.assertEqual(changed_days(timezone.now()), [])
+        Order.objects.filter(pk=self.order.pk).update(status=Order.STATUS_COMPLETED, updated_at=timezone.now())
+        self.assertEqual(changed_days(state.refreshed_until), [day])
+        refresh_sales_rollups(days=[day])
+        self.assertEqual(DailySales.objects.get(day=day).status, Order.STATUS_COMPLETED)
+
+    def test_product_report_groups_renamed_and_deleted_products(self):
+        day = timezone.localdate(self.order.created_at)
+        # второй заказ того же товара под новым названием и два заказа уже удаленных товаров
+        for title in ['Ноутбук Pro', 'Мышь', 'Клавиатура']:
+            order = Order.objects.create(
+                customer=self.customer, first_name='a', last_name='b', phone_number='1', total_price=Decimal('10.00')
+            )
+            OrderLine.objects.create(
+                order=order, product=self.product if title == 'Ноутбук Pro' else None, title=title,
+                price=Decimal('10.00'), quantity=1, total_price=Decimal('10.00'),
+            )
+        refresh_sales_rollups()
+        self.assertEqual(
+            set(DailyProductSales.objects.filter(day=day).values_list('product_id', 'title')),
+            {(self.product.pk, 'Ноутбук Pro'), (None, 'Мышь'), (None, 'Клавиатура')},
+        )
+        self.client.force_login(get_user_model().objects.create(username='staff', is_staff=True))
+        response = self.client.get(reverse('sales-report'), {'by': 'product'})
+        rows = {(row['product_id'], row['product_title']): row['quantity_sum'] for row in response.json()['rows']}
+        self.assertEqual(rows, {(self.product.pk, 'Ноутбук Pro'): 4, (None, 'Мышь'): 1, (None, 'Клавиатура'): 1})
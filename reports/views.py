@@ -0,0 +1,86 @@
+"""
+JSON-отчет о продажах. Читает только дневные витрины (reports/models.py), заказы не трогает,
+а на репликах отчет не мешает оформлению заказов в основной базе (см. main_app/routers.py).
+"""
+from datetime import date, timedelta
+
+from django.db import models
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, DailySales
+
+MAX_REPORT_DAYS = 366
+MAX_REPORT_ROWS = 100
+
+# группировка: (витрина, поля группировки, подписи групп, сортировка)
+GROUPINGS = {
+    'day': (DailySales, ('day',), {}, ('day',)),
+    'buying_type': (DailySales, ('buying_type',), {}, ('-revenue_sum',)),
+    'status': (DailySales, ('status',), {}, ('-revenue_sum',)),
+    'category': (DailyCategorySales, ('category_id', 'category__title'), {}, ('-revenue_sum',)),
+    # товар группируется по id, переименования за период не дробят его на несколько строк;
+    # удаленные товары (product_id NULL) различаются по названию, а не сливаются в одну строку
+    'product': (
+        DailyProductSales, ('product_id', 'deleted_title'), {'product_title': models.Max('title')}, ('-revenue_sum',)
+    ),
+}
+# вспомогательные ключи группировки, в ответ не попадают
+GROUP_KEYS = {
+    'deleted_title': models.Case(
+        models.When(product__isnull=True, then='title'), default=models.Value(''), output_field=models.CharField()
+    ),
+}
+
+
+def rollup_sums():
+    # имена (как и подписи групп) не должны совпадать с полями витрин
+    return {
+        'orders_sum': models.Sum('orders_count'),
+        'quantity_sum': models.Sum('quantity'),
+        'revenue_sum': models.Sum('revenue'),
+    }
+
+
+def get_period(params):
+    today = timezone.localdate()
+    date_to = date.fromisoformat(params['to']) if params.get('to') else today
+    date_from = date.fromisoformat(params['from']) if params.get('from') else date_to - timedelta(days=29)
+    if date_from > date_to or (date_to - date_from).days >= MAX_REPORT_DAYS:
+        raise ValueError
+    return date_from, date_to
+
+
+def sales_report(request):
+    """
+    GET reports/sales/?from=YYYY-MM-DD&to=YYYY-MM-DD&by=day|buying_type|status|category|product
+    По умолчанию последние 30 дней по дням. Только для сотрудников
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Отчет доступен только сотрудникам'}, status=403)
+    by = request.GET.get('by', 'day')
+    if by not in GROUPINGS:
+        return JsonResponse({'error': f'by: одно из {", ".join(GROUPINGS)}'}, status=400)
+    try:
+        date_from, date_to = get_period(request.GET)
+    except ValueError:
+        return JsonResponse(
+            {'error': f'Период from..to в формате YYYY-MM-DD, не длиннее {MAX_REPORT_DAYS} дней'}, status=400
+        )
+    model, fields, labels, ordering = GROUPINGS[by]
+    keys = {name: GROUP_KEYS[name] for name in fields if name in GROUP_KEYS}
+    period = {'day__gte': date_from, 'day__lte': date_to}
+    totals = DailySales.objects.filter(**period).aggregate(**rollup_sums())
+    rows = (
+        model.objects.filter(**period).annotate(**keys).values(*fields)
+        .annotate(**labels, **rollup_sums()).order_by(*ordering)
+    )
+    return JsonResponse({
+        'from': date_from,
+        'to': date_to,
+        'by': by,
+        'totals': {key: value or 0 for key, value in totals.items()},
+        'rows': [{key: value for key, value in row.items() if key not in keys} for row in rows[:MAX_REPORT_ROWS]],
+    })
@@ -1,6 +1,34 @@
 from django.contrib import admin
 
 from .models import *
-admin.site.register(ProductFeatures)
-admin.site.register(CategoryFeature)
-admin.site.register(FeatureValidator)
+
+
+class CategoryFeatureAdmin(admin.ModelAdmin):
+    list_display = ('feature_name', 'feature_filter_name', 'category', 'unit')
+    list_select_related = ('category',)
+    list_filter = ('category',)
+    search_fields = ('feature_name', '=feature_filter_name')
+    autocomplete_fields = ('category',)
+
+
+class FeatureValidatorAdmin(admin.ModelAdmin):
+    list_display = ('category', 'feature_key', 'validation_feature_value')
+    list_select_related = ('category', 'feature_key__category')
+    list_filter = ('category',)
+    search_fields = ('^validation_feature_value',)
+    autocomplete_fields = ('category', 'feature_key')
+
+
+class ProductFeaturesAdmin(admin.ModelAdmin):
+    """Характеристики товаров: товар и характеристика подтягиваются join'ом, выбор товара - через автодополнение"""
+    list_display = ('product', 'feature', 'value')
+    list_select_related = ('product', 'feature__category')
+    list_filter = ('feature__category',)
+    search_fields = ('=product__slug', '^value')
+    autocomplete_fields = ('product', 'feature')
+    show_full_result_count = False
+
+
+admin.site.register(ProductFeatures, ProductFeaturesAdmin)
+admin.site.register(CategoryFeature, CategoryFeatureAdmin)
+admin.site.register(FeatureValidator, FeatureValidatorAdmin)
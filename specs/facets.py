@@ -0,0 +1,141 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from main_app.catalog_cache import get_catalog_version
+from main_app.models import Product
+from .models import CategoryFeature, ProductFeatures
+
+# параметры запроса, которые относятся к выводу списка, а не к фильтрам
+RESERVED_PARAMS = ('sort', 'cursor')
+# больше стольких товаров в запрос списком IN не передаются: длинный список раздувает SQL
+# и упирается в лимит параметров SQLite, такие выборки фильтруются подзапросами к ProductFeatures
+MAX_ID_LIST = 500
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def to_bitmap(positions, size):
+    # собираем карту в bytearray и превращаем в int один раз - OR по одному биту копировал бы число целиком
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class FacetIndex:
+    """
+    Предрасчитанный индекс фильтров категории.
+    Для каждого значения каждой характеристики хранится битовая карта товаров (posting list в виде int,
+    бит N соответствует N-му товару категории). Фильтрация и подсчет количества товаров по каждому
+    значению сводятся к AND/OR над битовыми картами, без джойнов таблицы ProductFeatures самой с собой.
+    """
+
+    def __init__(self, product_ids, features, postings):
+        self.product_ids = product_ids
+        self.features = features
+        self.postings = postings
+        self.all = (1 << len(product_ids)) - 1
+
+    @classmethod
+    def build(cls, category):
+        product_ids = list(Product.objects.filter(category=category).order_by('id').values_list('id', flat=True))
+        positions = {product_id: position for position, product_id in enumerate(product_ids)}
+        features = list(
+            CategoryFeature.objects.filter(category=category)
+            .order_by('feature_name').values('feature_name', 'feature_filter_name', 'unit')
+        )
+        postings = {feature['feature_filter_name']: {} for feature in features}
+        rows = ProductFeatures.objects.filter(
+            feature__category=category, product__category=category
+        ).order_by().values_list('feature__feature_filter_name', 'value', 'product_id')
+        for filter_name, value, product_id in rows.iterator():
+            # товар, добавленный между двумя запросами, попадет в индекс при следующей версии каталога
+            if product_id in positions:
+                postings.setdefault(filter_name, {}).setdefault(value, []).append(positions[product_id])
+        for values in postings.values():
+            for value, value_positions in values.items():
+                values[value] = to_bitmap(value_positions, len(product_ids))
+        return cls(product_ids, features, postings)
+
+    @classmethod
+    def for_category(cls, category):
+        key = f'facets:{get_catalog_version()}:{category.pk}'
+        index = cache.get(key)
+        if index is None:
+            index = cls.build(category)
+            cache.set(key, index, 60 * 60 * 24)
+        return index
+
+    def parse_selection(self, query):
+        """{имя фильтра: множество значений} из GET-параметров вида ?ram=8&ram=16&color=black"""
+        selection = {}
+        for filter_name in query:
+            if filter_name in RESERVED_PARAMS or filter_name not in self.postings:
+                continue
+            values = {value for value in query.getlist(filter_name) if value in self.postings[filter_name]}
+            if values:
+                selection[filter_name] = values
+        return selection
+
+    def _masks(self, selection):
+        # внутри одной характеристики значения объединяются (OR), между характеристиками - пересекаются (AND)
+        masks = {}
+        for filter_name, values in selection.items():
+            mask = 0
+            for value in values:
+                mask |= self.postings[filter_name][value]
+            masks[filter_name] = mask
+        return masks
+
+    def _intersect(self, masks, exclude=None):
+        bitmap = self.all
+        for filter_name, mask in masks.items():
+            if filter_name != exclude:
+                bitmap &= mask
+        return bitmap
+
+    def _ids(self, bitmap):
+        # биты читаются от младшего к старшему: позиция бита - это позиция товара в product_ids
+        bits = bin(bitmap)[:1:-1]
+        return [self.product_ids[position] for position, bit in enumerate(bits) if bit == '1']
+
+    def filter(self, selection):
+        """id товаров, подходящих под выбранные фильтры"""
+        return self._ids(self._intersect(self._masks(selection)))
+
+    def filter_products(self, products, selection):
+        """
+        Товары категории из queryset products, подходящие под выбранные фильтры.
+        Если их не больше MAX_ID_LIST - условие id IN по карте, иначе по подзапросу на каждую характеристику
+        """
+        bitmap = self._intersect(self._masks(selection))
+        if popcount(bitmap) <= MAX_ID_LIST:
+            return products.filter(id__in=self._ids(bitmap))
+        for filter_name, values in selection.items():
+            products = products.filter(Exists(ProductFeatures.objects.filter(
+                product=OuterRef('pk'), feature__category=OuterRef('category'),
+                feature__feature_filter_name=filter_name, value__in=values,
+            )))
+        return products
+
+    def facets(self, selection):
+        """
+        Фильтры с количеством товаров для каждого значения.
+        Количество для значения считается с учетом выбора во всех остальных характеристиках,
+        то есть показывает, сколько товаров останется, если отметить это значение.
+        """
+        masks = self._masks(selection)
+        facets = []
+        for feature in self.features:
+            filter_name = feature['feature_filter_name']
+            base = self._intersect(masks, exclude=filter_name)
+            selected = selection.get(filter_name, set())
+            values = [
+                {'value': value, 'count': popcount(bitmap & base), 'selected': value in selected}
+                for value, bitmap in sorted(self.postings.get(filter_name, {}).items())
+            ]
+            if values:
+                facets.append({**feature, 'values': values})
+        return facets
@@ -1,3 +1,35 @@
+from decimal import Decimal
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from main_app.models import Category, Product
+from .facets import FacetIndex
+from .models import CategoryFeature, ProductFeatures
+
+
+class FacetIndexTestCases(TestCase):
+
+    def setUp(self) -> None:
+        self.category = Category.objects.create(title='Ноутбуки', slug='notebooks')
+        ram = CategoryFeature.objects.create(category=self.category, feature_name='Память', feature_filter_name='ram')
+        color = CategoryFeature.objects.create(category=self.category, feature_name='Цвет', feature_filter_name='color')
+        self.products = {}
+        for slug, ram_value, color_value in [('a', '8', 'black'), ('b', '16', 'black'), ('c', '16', 'white')]:
+            product = Product.objects.create(
+                category=self.category, title=slug, slug=slug, image='notebook.jpg', price=Decimal('1.00')
+            )
+            ProductFeatures.objects.create(product=product, feature=ram, value=ram_value)
+            ProductFeatures.objects.create(product=product, feature=color, value=color_value)
+            self.products[slug] = product
+
+    def test_filter_by_id_list_and_by_subqueries_match(self):
+        index = FacetIndex.build(self.category)
+        selection = {'ram': {'8', '16'}, 'color': {'black'}}
+        products = Product.objects.filter(category=self.category)
+        expected = {self.products['a'].pk, self.products['b'].pk}
+        self.assertEqual(set(index.filter_products(products, selection).values_list('pk', flat=True)), expected)
+        # большая выборка фильтруется подзапросами, без длинного списка id
+        with mock.patch('specs.facets.MAX_ID_LIST', 0):
+            filtered = index.filter_products(products, selection)
+            self.assertEqual(set(filtered.values_list('pk', flat=True)), expected)